@@ -0,0 +1,341 @@
+"""
+Motor analítico opcional (DuckDB) para los reportes.
+Mantiene en memoria una copia columnar de las tablas de una base SQLite: la
+primera consulta carga cada tabla completa y las siguientes solo aplican las
+filas que cambiaron según el changelog (ver models.create_changelog). Si
+DuckDB no está instalado, disponible() devuelve False y los reportes siguen
+usando SQLite. Si una sincronización falla (base bloqueada, error del CSV
+temporal) los reportes usan SQLite mientras tanto y se reintenta una carga
+completa tras una espera que se duplica con cada fallo consecutivo.
+
+La carga completa pasa por un CSV temporal y read_csv(): no depende de la
+extensión sqlite de DuckDB, que se descarga de internet en el primer uso.
+
+Las particiones de archivo (ver archivo.py) se cargan con el mismo nombre que
+en SQLite; como no pasan por el changelog, cada corrida de archivo (que cambia
+firma_archivo) provoca una carga completa. Las tablas del cierre de periodos
+(ver cierres.py) tampoco: son chicas y se recargan enteras cuando cambia su versión.
+"""
+
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from archivo import TABLAS_CON_ARCHIVO, firma_archivo
+from cierres import TABLAS_CIERRE, version_cierres
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+TABLAS_ANALITICAS = [
+    'productos', 'clientes', 'pedidos', 'pedido_productos',
+    'ventas', 'cuentas_por_cobrar', 'cuentas_por_pagar'
+]
+
+NULO_CSV = '\\N'
+
+def tipo_duckdb(tipo_sqlite):
+    """Tipo DuckDB equivalente a la afinidad de un tipo declarado en SQLite"""
+    tipo = (tipo_sqlite or '').upper()
+    if 'INT' in tipo or 'BOOL' in tipo:
+        return 'BIGINT'
+    if 'REAL' in tipo or 'FLOA' in tipo or 'DOUB' in tipo:
+        return 'DOUBLE'
+    # TEXT, DATE, etc.: como texto, igual que los guarda SQLite
+    return 'VARCHAR'
+
+def _clase_fila(columnas):
+    """Tupla con acceso por posición o por nombre de columna, como sqlite3.Row"""
+    indices = {columna: i for i, columna in enumerate(columnas)}
+    
+    class FilaAnalitica(tuple):
+        __slots__ = ()
+        
+        def __getitem__(self, clave):
+            if isinstance(clave, str):
+                clave = indices[clave]
+            return tuple.__getitem__(self, clave)
+        
+        def keys(self):
+            return list(columnas)
+    
+    return FilaAnalitica
+
+def cargar_en_duckdb(duck, destino, cursor, columnas):
+    """Crea (o reemplaza) la tabla DuckDB `destino` con las filas de un cursor sqlite3.
+    `columnas` es un dict ordenado nombre -> tipo DuckDB con las columnas del SELECT"""
+    archivo = tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', encoding='utf-8', delete=False)
+    try:
+        with archivo:
+            writer = csv.writer(archivo)
+            writer.writerow(columnas)
+            while True:
+                filas = cursor.fetchmany(10000)
+                if not filas:
+                    break
+                writer.writerows([NULO_CSV if v is None else v for v in fila] for fila in filas)
+        duck.execute(f'''
+            CREATE OR REPLACE TABLE {destino} AS
+            SELECT * FROM read_csv(?, header = true, nullstr = ?, columns = ?)
+        ''', [archivo.name, NULO_CSV, columnas])
+    finally:
+        os.remove(archivo.name)
+
+class CursorAnalitico:
+    """Cursor DuckDB con la interfaz de sqlite3 que usan los reportes"""
+    
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._fila = None
+    
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql, list(params))
+        self._fila = _clase_fila([d[0] for d in self._cursor.description]) if self._cursor.description else None
+        return self
+    
+    @property
+    def description(self):
+        return self._cursor.description
+    
+    def fetchone(self):
+        fila = self._cursor.fetchone()
+        return None if fila is None else self._fila(fila)
+    
+    def fetchmany(self, cantidad):
+        return [self._fila(fila) for fila in self._cursor.fetchmany(cantidad)]
+    
+    def fetchall(self):
+        return [self._fila(fila) for fila in self._cursor.fetchall()]
+    
+    def close(self):
+        self._cursor.close()
+
+class ConexionAnalitica:
+    """Conexión de solo lectura al snapshot DuckDB (commit/rollback no hacen nada)"""
+    
+    def __init__(self, conexion):
+        self._conexion = conexion
+    
+    def cursor(self):
+        return CursorAnalitico(self._conexion.cursor())
+    
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+    
+    def commit(self):
+        pass
+    
+    def rollback(self):
+        pass
+    
+    def close(self):
+        self._conexion.close()
+
+class MotorAnalitico:
+    """Copia columnar (DuckDB en memoria) de una base SQLite, sincronizada por changelog"""
+    
+    def __init__(self, ruta, delta_max_filas=20000, reintento_segundos=5, reintento_max_segundos=300):
+        self.ruta = ruta
+        self.delta_max_filas = delta_max_filas
+        self.reintento_segundos = reintento_segundos
+        self.reintento_max_segundos = reintento_max_segundos
+        self.lock = threading.Lock()
+        self.duck = None
+        self.sqlite = None
+        self.data_version = None
+        self.seq = 0
+        self.firma_archivo = None
+        self.version_cierres = None
+        self.error = None if duckdb is not None else 'duckdb no está instalado'
+        self.fallos_consecutivos = 0
+        self.reintentar_en = None  # monotonic a partir del cual se reintenta tras un fallo
+        self.cargas_completas = 0
+        self.deltas_aplicados = 0
+        self.filas_delta = 0
+        self.ms_ultima_sincronizacion = None
+        self.consultas = 0
+    
+    def disponible(self):
+        return duckdb is not None and (self.reintentar_en is None or time.monotonic() >= self.reintentar_en)
+    
+    def _ultimo_seq(self):
+        fila = self.sqlite.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'").fetchone()
+        return fila[0] if fila else 0
+    
+    def _cargar_tabla(self, tabla):
+        columnas = {fila[1]: tipo_duckdb(fila[2]) for fila in self.sqlite.execute(f'PRAGMA table_info({tabla})')}
+        cursor = self.sqlite.execute(f'SELECT {", ".join(columnas)} FROM {tabla}')
+        cargar_en_duckdb(self.duck, tabla, cursor, columnas)
+    
+    def _carga_completa(self):
+        # El seq se lee antes de copiar: los cambios que entren durante la copia
+        # se vuelven a aplicar en la siguiente sincronización (son idempotentes)
+        self.sqlite.execute('BEGIN')
+        try:
+            seq = self._ultimo_seq()
+            firma = firma_archivo(self.sqlite)
+            version = version_cierres(self.sqlite)
+            particiones = [fila[0] for fila in self.sqlite.execute(
+                'SELECT nombre FROM archivo_particiones WHERE tabla IN (SELECT value FROM json_each(?))',
+                (json.dumps(TABLAS_CON_ARCHIVO),))]
+            self.duck.execute('BEGIN TRANSACTION')
+            try:
+                for tabla in TABLAS_ANALITICAS + particiones + TABLAS_CIERRE:
+                    self._cargar_tabla(tabla)
+                self.duck.execute('COMMIT')
+            except Exception:
+                self.duck.execute('ROLLBACK')
+                raise
+        finally:
+            self.sqlite.rollback()
+        self.seq = seq
+        self.firma_archivo = firma
+        self.version_cierres = version
+        self.cargas_completas += 1
+    
+    def _recargar_cierres(self):
+        """Vuelve a cargar las tablas del cierre si cambió su versión"""
+        self.sqlite.execute('BEGIN')
+        try:
+            version = version_cierres(self.sqlite)
+            if version == self.version_cierres:
+                return
+            self.duck.execute('BEGIN TRANSACTION')
+            try:
+                for tabla in TABLAS_CIERRE:
+                    self._cargar_tabla(tabla)
+                self.duck.execute('COMMIT')
+            except Exception:
+                self.duck.execute('ROLLBACK')
+                raise
+        finally:
+            self.sqlite.rollback()
+        self.version_cierres = version
+    
+    def _aplicar_cambios(self):
+        """Aplica los cambios del changelog posteriores a self.seq; False si hace falta carga completa"""
+        self._recargar_cierres()
+        ultimo = self._ultimo_seq()
+        if ultimo == self.seq:
+            return True
+        if ultimo < self.seq:
+            # Base restaurada desde un respaldo: el changelog volvió atrás
+            return False
+        if firma_archivo(self.sqlite) != self.firma_archivo:
+            # Se movieron filas a las particiones de archivo
+            return False
+        minimo = self.sqlite.execute('SELECT MIN(seq) FROM changelog').fetchone()[0]
+        if minimo is None or minimo > self.seq + 1:
+            # El changelog se podó por encima de lo ya aplicado
+            return False
+        
+        cambios = self.sqlite.execute('''
+            SELECT tabla, fila_id FROM changelog WHERE seq > ? AND seq <= ?
+        ''', (self.seq, ultimo)).fetchall()
+        if len(cambios) > self.delta_max_filas:
+            return False
+        
+        por_tabla = {}
+        for tabla, fila_id in cambios:
+            if tabla in TABLAS_ANALITICAS:
+                por_tabla.setdefault(tabla, set()).add(fila_id)
+        
+        self.duck.execute('BEGIN TRANSACTION')
+        try:
+            for tabla, ids in por_tabla.items():
+                ids = sorted(ids)
+                # Borrar y volver a insertar el estado actual (las filas borradas no vuelven)
+                self.duck.execute(f'DELETE FROM {tabla} WHERE id IN (SELECT UNNEST(?))', [ids])
+                columnas = [fila[0] for fila in self.duck.execute(
+                    'SELECT column_name FROM duckdb_columns() WHERE table_name = ? ORDER BY column_index', [tabla]
+                ).fetchall()]
+                filas = self.sqlite.execute(f'''
+                    SELECT {", ".join(columnas)} FROM {tabla} WHERE id IN (SELECT value FROM json_each(?))
+                ''', (json.dumps(ids),)).fetchall()
+                if filas:
+                    self.duck.executemany(
+                        f'INSERT INTO {tabla} VALUES ({", ".join("?" * len(columnas))})', filas)
+            self.duck.execute('COMMIT')
+        except Exception:
+            self.duck.execute('ROLLBACK')
+            raise
+        self.seq = ultimo
+        self.deltas_aplicados += 1
+        self.filas_delta += len(cambios)
+        return True
+    
+    def _sincronizar(self):
+        if self.duck is None:
+            self.duck = duckdb.connect(':memory:')
+            self.sqlite = sqlite3.connect(self.ruta, check_same_thread=False)
+        
+        # PRAGMA data_version solo cambia cuando otra conexión hizo commit
+        data_version = self.sqlite.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self.data_version:
+            return
+        inicio = time.perf_counter()
+        if self.data_version is None or not self._aplicar_cambios():
+            self._carga_completa()
+        self.data_version = data_version
+        self.ms_ultima_sincronizacion = round((time.perf_counter() - inicio) * 1000, 2)
+    
+    def _descartar(self):
+        """Cierra las conexiones para que el próximo intento haga una carga completa"""
+        for conexion in (self.duck, self.sqlite):
+            try:
+                if conexion is not None:
+                    conexion.close()
+            except Exception:
+                pass
+        self.duck = self.sqlite = None
+        self.data_version = None
+
+    def conexion(self):
+        """Conexión DuckDB al snapshot actualizado, o None si el motor no está disponible"""
+        with self.lock:
+            if duckdb is None:
+                return None
+            if self.reintentar_en is not None and time.monotonic() < self.reintentar_en:
+                return None
+            try:
+                self._sincronizar()
+            except Exception as e:
+                self._descartar()
+                self.fallos_consecutivos += 1
+                espera = min(self.reintento_segundos * 2 ** (self.fallos_consecutivos - 1), self.reintento_max_segundos)
+                self.reintentar_en = time.monotonic() + espera
+                self.error = str(e)
+                print(f"⚠️ Motor analítico no disponible para {self.ruta} (reintento en {espera}s): {e}")
+                return None
+            self.error = None
+            self.fallos_consecutivos = 0
+            self.reintentar_en = None
+            self.consultas += 1
+            # Cada cursor es una conexión propia sobre la misma base en memoria
+            return ConexionAnalitica(self.duck.cursor())
+    
+    def cerrar(self):
+        with self.lock:
+            self._descartar()
+    
+    def metricas(self):
+        with self.lock:
+            return {
+                'disponible': duckdb is not None and self.reintentar_en is None,
+                'error': self.error,
+                'fallos_consecutivos': self.fallos_consecutivos,
+                'reintento_en_segundos': (round(max(0.0, self.reintentar_en - time.monotonic()), 1)
+                                          if self.reintentar_en is not None else None),
+                'seq': self.seq,
+                'cargas_completas': self.cargas_completas,
+                'deltas_aplicados': self.deltas_aplicados,
+                'filas_delta': self.filas_delta,
+                'ms_ultima_sincronizacion': self.ms_ultima_sincronizacion,
+                'consultas': self.consultas
+            }
@@ -1,14 +1,46 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, g, has_app_context
+from werkzeug.exceptions import NotFound, MethodNotAllowed
 from flask_cors import CORS
 import sqlite3
 from datetime import datetime, timedelta
-from models import init_db
+from models import init_db, TABLAS_CHANGELOG, TABLAS_FTS, prune_changelog
+from analitica import MotorAnalitico
+from replica import ReplicaLectura
+from importar_datos import ESQUEMAS_IMPORTACION, FORMATOS_IMPORTACION, SEPARADORES_DECIMALES, DELIMITADORES_CSV, importar, leer_filas, formato_de_archivo
+from snapshots_columnar import generar_snapshot, leer_estado
+from respaldos import crear_respaldo, listar_respaldos
+from archivo import ESTADOS_PEDIDO_CERRADOS, TABLAS_CON_ARCHIVO, archivar, eliminar_archivo, horizonte_meses, particiones_archivo, union_archivo
+from cierres import (PeriodoCerrado, cerrar_periodos, corte_cierre, eliminar_cierres, listar_periodos, mes_anterior,
+                     meses_desactualizados, reabrir_periodos, siguiente_mes, validar_mes, verificar_periodo)
+from flujo_caja import GRANULARIDADES, proyectar_flujo
+from estados_cuenta import consultar_estados, generar_lote, xlsx_estado_cuenta
 import io
+import threading
+import time
+import hashlib
+import json
+import gzip
+import zlib
+import csv
+import queue
+import re
+import heapq
+import bisect
+import unicodedata
+from collections import deque, namedtuple, OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
 import os
 from dotenv import load_dotenv
 
+# Serializador JSON rápido opcional (si no está instalado se usa json estándar)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -50,9 +82,352 @@ def check_login_credentials(email, password):
 
 # Conexión a la base de datos
 def get_db_connection():
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row  # Para obtener diccionarios en lugar de tuplas
-    return conn
+    # Dentro de /api/batch todas las sub-peticiones comparten una conexión
+    if has_app_context():
+        compartida = g.get('conexion_batch')
+        if compartida is not None:
+            return compartida
+    # Conexión del pool del tenant de la petición (ver MULTI-TENANT)
+    return estado_tenant().conectar()
+
+class _ConexionCompartida:
+    """Proxy de una conexión prestada: close/commit/rollback no la afectan"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def close(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+# -------------------- MULTI-TENANT (UNA BASE DE DATOS POR ESTUDIO) --------------------
+# Cada estudio (tenant) tiene su propio archivo SQLite. El tenant se resuelve en
+# cada petición (cabecera X-Tenant-ID o subdominio) y todo el estado en memoria
+# que depende de los datos (conexiones, versiones, caches, eventos, contadores)
+# vive en un _EstadoTenant. Los estados se guardan en un LRU acotado: al expulsar
+# un tenant se cierran sus conexiones y se descartan sus caches. El esquema de
+# cada tenant se migra con init_db() la primera vez que se usa en el proceso.
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'database.db')
+TENANTS_HABILITADO = os.getenv('TENANTS_HABILITADO', 'false').lower() == 'true'
+TENANTS_DIR = os.getenv('TENANTS_DIR', 'tenants')
+TENANT_DOMINIO_BASE = os.getenv('TENANT_DOMINIO_BASE', '').lower()
+TENANTS_AUTO_CREAR = os.getenv('TENANTS_AUTO_CREAR', 'false').lower() == 'true'
+TENANTS_MAX_ABIERTOS = int(os.getenv('TENANTS_MAX_ABIERTOS', '32'))
+TENANT_CONEXIONES_INACTIVAS = int(os.getenv('TENANT_CONEXIONES_INACTIVAS', '4'))
+TENANT_DEFAULT = 'default'
+_PATRON_TENANT = re.compile(r'^[a-z0-9][a-z0-9_-]{0,62}$')
+
+# Ajustes aplicados a cada conexión nueva. synchronous=NORMAL es seguro con WAL
+# (una caída puede perder el último commit, nunca corromper la base)
+PRAGMAS_CONEXION = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 134217728',
+)
+
+def tenant_actual():
+    """Tenant de la petición en curso (el tenant por defecto fuera de una petición)"""
+    if has_app_context():
+        return g.get('tenant', TENANT_DEFAULT)
+    return TENANT_DEFAULT
+
+def ruta_tenant(tenant):
+    if tenant == TENANT_DEFAULT:
+        return DATABASE_PATH
+    return os.path.join(TENANTS_DIR, f'{tenant}.db')
+
+def tenants_existentes():
+    """Tenants con base de datos en disco (el tenant por defecto siempre incluido)"""
+    tenants = [TENANT_DEFAULT]
+    if TENANTS_HABILITADO and os.path.isdir(TENANTS_DIR):
+        tenants += sorted(nombre[:-3] for nombre in os.listdir(TENANTS_DIR)
+                          if nombre.endswith('.db') and _PATRON_TENANT.match(nombre[:-3]))
+    return tenants
+
+def tarea_periodica(minutos, funcion):
+    """Hilo daemon que ejecuta funcion(tenant) para cada tenant cada `minutos`"""
+    def bucle():
+        while True:
+            time.sleep(minutos * 60)
+            for tenant in tenants_existentes():
+                try:
+                    funcion(tenant)
+                except Exception as e:
+                    print(f"⚠️ Error en {funcion.__name__} para {tenant}: {e}")
+    threading.Thread(target=bucle, name=funcion.__name__, daemon=True).start()
+
+def resolver_tenant():
+    """Tenant pedido por la cabecera X-Tenant-ID o el subdominio; ValueError si es inválido"""
+    if not TENANTS_HABILITADO:
+        return TENANT_DEFAULT
+    tenant = request.headers.get('X-Tenant-ID', '').strip().lower()
+    if not tenant and TENANT_DOMINIO_BASE:
+        host = request.host.split(':')[0].lower()
+        sufijo = '.' + TENANT_DOMINIO_BASE
+        if host.endswith(sufijo):
+            tenant = host[:-len(sufijo)]
+    if not tenant or tenant == 'www':
+        return TENANT_DEFAULT
+    if not _PATRON_TENANT.match(tenant):
+        raise ValueError('Tenant inválido')
+    return tenant
+
+class _ConexionPool:
+    """Conexión prestada del pool de un tenant: close() la devuelve en vez de cerrarla"""
+
+    def __init__(self, conn, estado):
+        self._conn = conn
+        self._estado = estado
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._estado.devolver(conn)
+
+    def __getattr__(self, nombre):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(self._conn, nombre)
+
+class _EstadoTenant:
+    """Conexiones y estado en memoria de un tenant"""
+
+    def __init__(self, tenant, ruta):
+        self.tenant = tenant
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        self.inactivas = []
+        self.cerrado = False
+        self.lector_versiones = _LectorVersiones(ruta)
+        self.autocompletar = {
+            'productos': _IndicePrefijos('productos', 'tipo', ['nombre']),
+            'clientes': _IndicePrefijos('clientes', 'email', ['nombre'], ['email']),
+        }
+        self.catalogo = _CatalogoProductos()
+        self.broker = _BrokerEventos()
+        self.contadores_lock = threading.Lock()
+        self.contadores = {'valores': None, 'fecha': None, 'generacion': 0}
+        self.analitica = None
+        self.replica = None
+        self.archivo = None
+        self.archivo_version = None
+        self.cierre = (None, [])
+        self.cierre_version = None
+        self.columnas_por_tabla = {}
+        self.columnas_esquema = None
+        self.peticiones = 0
+        self.segundos = 0.0
+        self.peticiones_con_respaldo = 0
+        self.segundos_con_respaldo = 0.0
+        self.conexiones_nuevas = 0
+        self.conexiones_reusadas = 0
+
+    def conectar(self):
+        with self.lock:
+            if self.inactivas:
+                self.conexiones_reusadas += 1
+                return _ConexionPool(self.inactivas.pop(), self)
+            self.conexiones_nuevas += 1
+        conn = sqlite3.connect(self.ruta, check_same_thread=False)
+        for pragma in PRAGMAS_CONEXION:
+            conn.execute(pragma)
+        conn.row_factory = sqlite3.Row  # Para obtener diccionarios en lugar de tuplas
+        return _ConexionPool(conn, self)
+
+    def motor_analitico(self):
+        """Motor DuckDB del tenant (se crea en el primer reporte que lo usa)"""
+        with self.lock:
+            if self.analitica is None:
+                self.analitica = MotorAnalitico(self.ruta, ANALITICA_DELTA_MAX_FILAS, ANALITICA_REINTENTO_SEGUNDOS)
+            return self.analitica
+    
+    def replica_lectura(self):
+        """Réplica de solo lectura del tenant (se crea y arranca en la primera lectura que la usa)"""
+        with self.lock:
+            if self.replica is None:
+                self.replica = ReplicaLectura(
+                    self.ruta, os.path.join(REPLICA_DIR, f'{self.tenant}.db'),
+                    intervalo=REPLICA_INTERVALO_MS / 1000, delta_max_filas=ANALITICA_DELTA_MAX_FILAS,
+                    paginas_por_paso=RESPALDOS_PAGINAS_POR_PASO, pragmas=PRAGMAS_CONEXION)
+                self.replica.iniciar()
+            return self.replica
+    
+    def particiones(self):
+        """Particiones de archivo del tenant (ver archivo.py), recargadas cuando cambia su registro"""
+        try:
+            version = self.lector_versiones.leer().get('archivo_particiones', 0)
+        except sqlite3.Error:
+            return {}
+        with self.lock:
+            if self.archivo_version == version:
+                return self.archivo
+        conn = self.conectar()
+        try:
+            particiones = particiones_archivo(conn)
+        finally:
+            conn.close()
+        with self.lock:
+            self.archivo, self.archivo_version = particiones, version
+        return particiones
+    
+    def periodos_cerrados(self):
+        """(corte, meses desactualizados) del cierre de periodos del tenant (ver cierres.py)"""
+        try:
+            version = self.lector_versiones.leer().get('periodos_cerrados', 0)
+        except sqlite3.Error:
+            return None, []
+        with self.lock:
+            if self.cierre_version == version:
+                return self.cierre
+        conn = self.conectar()
+        try:
+            cierre = (corte_cierre(conn), meses_desactualizados(conn))
+        finally:
+            conn.close()
+        with self.lock:
+            self.cierre, self.cierre_version = cierre, version
+        return cierre
+    
+    def columnas(self, conn, tabla):
+        """Columnas de `tabla`; PRAGMA schema_version cambia con cada migración (init_db)"""
+        esquema = conn.execute('PRAGMA schema_version').fetchone()[0]
+        with self.lock:
+            if esquema != self.columnas_esquema:
+                self.columnas_por_tabla, self.columnas_esquema = {}, esquema
+            columnas = self.columnas_por_tabla.get(tabla)
+        if columnas is None:
+            columnas = [fila[1] for fila in conn.execute(f'PRAGMA table_info({tabla})').fetchall()]
+            with self.lock:
+                if esquema == self.columnas_esquema:
+                    self.columnas_por_tabla[tabla] = columnas
+        return columnas
+    
+    def devolver(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            if not self.cerrado and len(self.inactivas) < TENANT_CONEXIONES_INACTIVAS:
+                self.inactivas.append(conn)
+                return
+        conn.close()
+
+    def cerrar(self):
+        with self.lock:
+            self.cerrado = True
+            inactivas, self.inactivas = self.inactivas, []
+        for conn in inactivas:
+            conn.close()
+        self.lector_versiones.cerrar()
+        if self.analitica is not None:
+            self.analitica.cerrar()
+        if self.replica is not None:
+            self.replica.cerrar()
+
+    def registrar_peticion(self, segundos, durante_respaldo=False):
+        with self.lock:
+            self.peticiones += 1
+            self.segundos += segundos
+            if durante_respaldo:
+                self.peticiones_con_respaldo += 1
+                self.segundos_con_respaldo += segundos
+    
+    def metricas_latencia_respaldo(self):
+        with self.lock:
+            sin_respaldo = self.peticiones - self.peticiones_con_respaldo
+            return {
+                'peticiones_durante_respaldo': self.peticiones_con_respaldo,
+                'ms_promedio_durante_respaldo': round(self.segundos_con_respaldo * 1000 / self.peticiones_con_respaldo, 2)
+                if self.peticiones_con_respaldo else None,
+                'ms_promedio_sin_respaldo': round((self.segundos - self.segundos_con_respaldo) * 1000 / sin_respaldo, 2)
+                if sin_respaldo else None
+            }
+
+    def metricas(self):
+        with self.lock:
+            return {
+                'ruta': self.ruta,
+                'peticiones': self.peticiones,
+                'ms_promedio': round(self.segundos * 1000 / self.peticiones, 2) if self.peticiones else None,
+                'conexiones_inactivas': len(self.inactivas),
+                'conexiones_nuevas': self.conexiones_nuevas,
+                'conexiones_reusadas': self.conexiones_reusadas,
+                'suscriptores_sse': len(self.broker.suscriptores)
+            }
+
+_tenants = OrderedDict()  # tenant -> _EstadoTenant, del menos al más reciente
+_tenants_lock = threading.Lock()
+_tenants_migrados = set()
+_migracion_lock = threading.Lock()
+_tenants_expulsados = 0
+
+def _migrar_tenant(tenant, ruta):
+    """Crea o actualiza el esquema de un tenant (una vez por proceso)"""
+    with _migracion_lock:
+        if tenant in _tenants_migrados:
+            return
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        init_db(ruta)
+        conn = sqlite3.connect(ruta)
+        try:
+            podadas = prune_changelog(conn.cursor(), CHANGELOG_RETENCION_DIAS)
+            conn.commit()
+        finally:
+            conn.close()
+        if podadas:
+            print(f"🧹 Changelog de {tenant} podado: {podadas} entradas con más de {CHANGELOG_RETENCION_DIAS} días")
+        _tenants_migrados.add(tenant)
+
+def estado_tenant(tenant=None):
+    """Estado del tenant (el de la petición en curso por defecto), migrándolo si es nuevo"""
+    global _tenants_expulsados
+    tenant = tenant or tenant_actual()
+    with _tenants_lock:
+        estado = _tenants.get(tenant)
+        if estado is not None:
+            _tenants.move_to_end(tenant)
+            return estado
+    
+    ruta = ruta_tenant(tenant)
+    _migrar_tenant(tenant, ruta)
+    
+    expulsados = []
+    with _tenants_lock:
+        estado = _tenants.get(tenant)
+        if estado is None:
+            estado = _tenants[tenant] = _EstadoTenant(tenant, ruta)
+        # Expulsar los menos usados, salvo los que tienen clientes SSE conectados
+        for candidato in list(_tenants):
+            if len(_tenants) <= TENANTS_MAX_ABIERTOS:
+                break
+            if candidato != tenant and not _tenants[candidato].broker.suscriptores:
+                expulsados.append(_tenants.pop(candidato))
+        _tenants_expulsados += len(expulsados)
+    for expulsado in expulsados:
+        expulsado.cerrar()
+    return estado
+
+def get_metricas_tenants():
+    with _tenants_lock:
+        estados = list(_tenants.values())
+        expulsados = _tenants_expulsados
+    return {
+        'habilitado': TENANTS_HABILITADO,
+        'abiertos': len(estados),
+        'max_abiertos': TENANTS_MAX_ABIERTOS,
+        'expulsados': expulsados,
+        'por_tenant': {estado.tenant: estado.metricas() for estado in estados}
+    }
 
 app = Flask(__name__)
 
@@ -65,12 +440,687 @@ CORS(app, origins=[
     "https://plus-graphics.onrender.com"  # URL específica producción
 ])
 
+@app.before_request
+def seleccionar_tenant():
+    # Resolver el tenant antes de que el handler abra conexiones
+    try:
+        tenant = resolver_tenant()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if (tenant != TENANT_DEFAULT and not TENANTS_AUTO_CREAR
+            and tenant not in _tenants and not os.path.exists(ruta_tenant(tenant))):
+        return jsonify({'error': f'Tenant no encontrado: {tenant}'}), 404
+    g.tenant = tenant
+    g.inicio_peticion = time.perf_counter()
+
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Tenant-ID')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
+
+# -------------------- SERIALIZACIÓN Y COMPRESIÓN DE RESPUESTAS --------------------
+COMPRESION_MIN_BYTES = int(os.getenv('COMPRESION_MIN_BYTES', '1024'))
+COMPRESION_NIVEL = int(os.getenv('COMPRESION_NIVEL', '3'))
+_MIMETYPES_COMPRIMIBLES = ('application/json', 'text/csv', 'text/html', 'text/plain')
+
+def consultar_dicts(conn, sql, params=()):
+    """Ejecuta una consulta y arma los dicts directamente desde tuplas + nombres de columna"""
+    cursor = conn.cursor()
+    cursor.row_factory = None  # evitar crear un sqlite3.Row por fila
+    cursor.execute(sql, params)
+    columnas = [d[0] for d in cursor.description]
+    return [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+
+def dumps_json(datos):
+    """Serializa a bytes JSON usando orjson si está disponible"""
+    if orjson is not None:
+        return orjson.dumps(datos)
+    return json.dumps(datos, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def respuesta_json(datos, status=200):
+    """Equivalente a jsonify() para listas grandes, sin pasar por el encoder de Flask"""
+    return Response(dumps_json(datos), status=status, mimetype='application/json')
+
+@app.after_request
+def comprimir_respuesta(response):
+    # Comprimir con gzip/deflate según Accept-Encoding cuando la respuesta es grande
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in _MIMETYPES_COMPRIMIBLES):
+        return response
+    
+    codificacion = None
+    if request.accept_encodings['gzip']:
+        codificacion = 'gzip'
+    elif request.accept_encodings['deflate']:
+        codificacion = 'deflate'
+    if codificacion is None:
+        return response
+    
+    datos = response.get_data()
+    if len(datos) < COMPRESION_MIN_BYTES:
+        return response
+    
+    if codificacion == 'gzip':
+        comprimido = gzip.compress(datos, compresslevel=COMPRESION_NIVEL, mtime=0)
+    else:
+        comprimido = zlib.compress(datos, COMPRESION_NIVEL)
+    response.set_data(comprimido)
+    response.headers['Content-Encoding'] = codificacion
+    response.vary.add('Accept-Encoding')
+    return response
+
+# -------------------- PROYECCIÓN DE CAMPOS (?fields= / ?include=) --------------------
+def columnas_tabla(conn, tabla):
+    """Columnas reales de una tabla del tenant (cacheadas hasta que cambie su esquema)"""
+    return estado_tenant().columnas(conn, tabla)
+
+def param_lista(nombre):
+    """Lee un query param separado por comas; None si no se envió"""
+    valor = request.args.get(nombre)
+    if valor is None:
+        return None
+    return [v.strip() for v in valor.split(',') if v.strip()]
+
+IDS_MAX = int(os.getenv('IDS_MAX', '200'))
+
+def param_ids():
+    """
+    Lee ?ids=1,5,9 como lista de enteros sin duplicados (en el orden recibido).
+    None si no se envió; ValueError si hay valores inválidos o demasiados ids.
+    """
+    valores = param_lista('ids')
+    if valores is None:
+        return None
+    if not valores or not all(v.isdigit() for v in valores):
+        raise ValueError("'ids' debe ser una lista de enteros separados por comas")
+    ids = list(dict.fromkeys(int(v) for v in valores))
+    if len(ids) > IDS_MAX:
+        raise ValueError(f'Máximo {IDS_MAX} ids por petición')
+    return ids
+
+BATCH_MAX_IDS = int(os.getenv('BATCH_MAX_IDS', '1000'))
+
+def es_entero(valor):
+    """int de JSON que no sea true/false (bool es subclase de int)"""
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+def ids_del_body(data):
+    """Lee {"ids": [...]} de un body JSON como lista de enteros sin duplicados; ValueError si es inválido"""
+    valores = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(valores, list) or not valores or not all(es_entero(v) for v in valores):
+        raise ValueError("Se esperaba 'ids': una lista no vacía de enteros")
+    ids = list(dict.fromkeys(valores))
+    if len(ids) > BATCH_MAX_IDS:
+        raise ValueError(f'Máximo {BATCH_MAX_IDS} ids por petición')
+    return ids
+
+def consultar_por_ids(conn, tabla, ids):
+    """Filas de `tabla` con esos ids en una sola consulta, en el mismo orden que `ids`"""
+    return consultar_dicts(conn, f'''
+        SELECT t.* FROM json_each(?) AS j
+        JOIN {tabla} t ON t.id = j.value
+        ORDER BY j.key
+    ''', (json.dumps(ids),))
+
+def fuente(tabla, desde=None, hasta=None, estado=None):
+    """
+    Expresión FROM de una tabla archivable: la tabla activa sola, o un UNION ALL
+    con las particiones de archivo cuyo rango de fechas se solapa con [desde, hasta].
+    Sin rango se incluyen todas las particiones (mismo resultado que antes de archivar).
+    """
+    return union_archivo(tabla, (estado or estado_tenant()).particiones(), desde, hasta)
+
+def ventas_con_cierre(estado=None):
+    """
+    Partes de una consulta sobre todo el historial de ventas con periodos cerrados:
+    (FROM de las ventas abiertas, condición sobre v.fecha, condición sobre las tablas
+    cierre_ventas_* o None si no hay cierres). Las ventas abiertas son las posteriores
+    al corte, las sin fecha y las de meses desactualizados; solo se leen las
+    particiones de archivo que se solapan con ellas.
+    """
+    estado = estado or estado_tenant()
+    corte, desactualizados = estado.periodos_cerrados()
+    if corte is None:
+        return fuente('ventas', estado=estado), '1 = 1', None
+    # Los valores vienen de periodos_cerrados con formato ya validado (YYYY-MM)
+    abiertas = [f"v.fecha >= '{corte}'", 'v.fecha IS NULL'] + [
+        f"(v.fecha >= '{mes}-01' AND v.fecha < '{siguiente_mes(mes)}-01')" for mes in desactualizados
+    ]
+    cerradas = '1 = 1'
+    if desactualizados:
+        cerradas = 'mes NOT IN (' + ', '.join(f"'{mes}'" for mes in desactualizados) + ')'
+    desde = min([corte] + [f'{mes}-01' for mes in desactualizados])
+    return fuente('ventas', desde=desde, estado=estado), f"({' OR '.join(abiertas)})", cerradas
+
+def ventas_agregadas(columna, por_mes=False, estado=None):
+    """
+    Subconsulta con las ventas de todo el historial agregadas por `columna`
+    ('producto_id' o 'cliente_id') y opcionalmente por mes: columnas [mes,] <columna>,
+    num_ventas, total (y ultima_fecha por cliente). Los meses cerrados se leen de
+    cierre_ventas_producto / cierre_ventas_cliente y solo se recorren las ventas abiertas.
+    """
+    vivas, abiertas, cerradas = ventas_con_cierre(estado)
+    mes = 'substr(v.fecha, 1, 7) AS mes, ' if por_mes else ''
+    grupo = 'substr(v.fecha, 1, 7), ' if por_mes else ''
+    ultima_fecha = columna == 'cliente_id'
+    sql = f'''
+        SELECT {mes}v.{columna}, COUNT(v.id) AS num_ventas, SUM(v.total) AS total
+               {', MAX(v.fecha) AS ultima_fecha' if ultima_fecha else ''}
+        FROM {vivas} v WHERE {abiertas}
+        GROUP BY {grupo}v.{columna}
+    '''
+    if cerradas is not None:
+        tabla = 'cierre_ventas_cliente' if ultima_fecha else 'cierre_ventas_producto'
+        sql += f'''
+        UNION ALL
+        SELECT {'mes, ' if por_mes else ''}{columna}, num_ventas, total{', ultima_fecha' if ultima_fecha else ''}
+        FROM {tabla} WHERE {cerradas}
+        '''
+    return f'({sql})'
+
+def rango_fechas():
+    """?desde= y ?hasta= (YYYY-MM-DD) de la petición; ValueError si alguno es inválido"""
+    return (validar_fecha(request.args.get('desde'), 'desde'),
+            validar_fecha(request.args.get('hasta'), 'hasta'))
+
+def filtro_rango(columna, desde, hasta):
+    """Condiciones SQL y parámetros para filtrar `columna` por [desde, hasta]"""
+    condiciones = []
+    params = []
+    if desde:
+        condiciones.append(f'{columna} >= ?')
+        params.append(desde)
+    if hasta:
+        # 'hasta' incluye el día completo
+        condiciones.append(f"{columna} < date(?, '+1 day')")
+        params.append(hasta)
+    return condiciones, params
+
+def construir_proyeccion(conn, tabla, alias, relaciones, relaciones_default):
+    """
+    Arma la lista SELECT y los JOIN de una consulta de listado según ?fields= e ?include=.
+    `relaciones` mapea nombre -> (columnas SELECT, JOIN o None). Sin parámetros se
+    devuelve la proyección completa de siempre. Lanza ValueError si algo es inválido.
+    """
+    campos = param_lista('fields')
+    incluir = param_lista('include')
+    # Un valor repetido (?include=cliente,cliente) duplicaría el JOIN
+    if campos is not None:
+        campos = list(dict.fromkeys(campos))
+    if incluir is not None:
+        incluir = list(dict.fromkeys(incluir))
+    
+    if campos is None:
+        columnas = [f'{alias}.*']
+    else:
+        validas = columnas_tabla(conn, tabla)
+        invalidas = [c for c in campos if c not in validas]
+        if invalidas or not campos:
+            raise ValueError(f'Campos inválidos: {", ".join(invalidas) or "(vacío)"}. Campos válidos: {", ".join(validas)}')
+        columnas = [f'{alias}.{c}' for c in campos]
+    
+    if incluir is None:
+        # Sin ?include= explícito: con ?fields= no se hace ningún JOIN
+        incluir = [] if campos is not None else list(relaciones_default)
+    invalidas = [r for r in incluir if r not in relaciones]
+    if invalidas:
+        raise ValueError(f'Relaciones inválidas: {", ".join(invalidas)}. Relaciones válidas: {", ".join(relaciones)}')
+    
+    joins = []
+    for nombre in incluir:
+        columnas_relacion, join = relaciones[nombre]
+        if columnas_relacion:
+            columnas.append(columnas_relacion)
+        if join:
+            joins.append(join)
+    return campos, incluir, ', '.join(columnas), '\n'.join(joins)
+
+# -------------------- COALESCING Y CACHE DE LECTURAS --------------------
+# Las lecturas costosas (dashboard y reportes) se calculan una sola vez aunque
+# lleguen muchas peticiones idénticas a la vez: la primera ejecuta la consulta y
+# las demás esperan su resultado. El resultado se guarda unos segundos en cache
+# (LRU de hasta CACHE_MAX_ENTRADAS claves).
+CACHE_TTL_SEGUNDOS = float(os.getenv('CACHE_TTL_SEGUNDOS', '5'))
+CACHE_MAX_ENTRADAS = int(os.getenv('CACHE_MAX_ENTRADAS', '1000'))
+
+_cache_lock = threading.Lock()
+_cache_lecturas = OrderedDict()   # clave -> (expira, body, status, content_type), la más reciente al final
+# Aumenta con cada invalidación: un líder que empezó antes no guarda su resultado
+_generacion_cache = 0
+_lecturas_en_vuelo = {}  # clave -> _LecturaEnVuelo
+_metricas_coalescing = {
+    'ejecuciones': 0,
+    'coalescidas': 0,
+    'cache_hits': 0
+}
+
+class _LecturaEnVuelo:
+    """Cálculo en curso compartido por todas las peticiones con la misma clave"""
+    __slots__ = ('evento', 'resultado')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+
+def clave_lectura():
+    """Clave de la petición actual: tenant + ruta + query args normalizados (ordenados)"""
+    args = sorted(request.args.items(multi=True))
+    return f"{tenant_actual()}:{request.path}?{urlencode(args)}"
+
+def _respuesta_desde_resultado(resultado):
+    body, status, content_type = resultado
+    return Response(body, status=status, content_type=content_type)
+
+def coalescer(ttl=None):
+    """Decorador single-flight + cache TTL para endpoints GET de solo lectura"""
+    def decorador(f):
+        @wraps(f)
+        def envoltura(*args, **kwargs):
+            # Dentro de /api/batch se lee el snapshot del batch: ni se sirve desde
+            # la cache (rompería la consistencia) ni se guarda (podría ser anterior)
+            if g.get('conexion_batch') is not None:
+                return f(*args, **kwargs)
+            
+            # Si @condicional ya leyó las versiones, forman parte de la clave para
+            # no servir desde cache un resultado anterior a un cambio externo
+            clave = f"{clave_lectura()}#{g.get('firma_versiones', '')}"
+            duracion = CACHE_TTL_SEGUNDOS if ttl is None else ttl
+            
+            with _cache_lock:
+                entrada = _cache_lecturas.get(clave)
+                if entrada and entrada[0] > time.monotonic():
+                    _cache_lecturas.move_to_end(clave)
+                    _metricas_coalescing['cache_hits'] += 1
+                    return _respuesta_desde_resultado(entrada[1:])
+                generacion = _generacion_cache
+                
+                vuelo = _lecturas_en_vuelo.get(clave)
+                lider = vuelo is None
+                if lider:
+                    vuelo = _LecturaEnVuelo()
+                    _lecturas_en_vuelo[clave] = vuelo
+                    _metricas_coalescing['ejecuciones'] += 1
+                else:
+                    _metricas_coalescing['coalescidas'] += 1
+            
+            # Seguidores: esperar el resultado del cálculo en curso
+            if not lider:
+                vuelo.evento.wait()
+                if vuelo.resultado is None:
+                    return jsonify({'error': 'Error calculando la respuesta'}), 500
+                return _respuesta_desde_resultado(vuelo.resultado)
+            
+            # Líder: ejecutar el handler y compartir el resultado
+            resultado = None
+            try:
+                respuesta = app.make_response(f(*args, **kwargs))
+                resultado = (respuesta.get_data(), respuesta.status_code, respuesta.content_type)
+                return _respuesta_desde_resultado(resultado)
+            finally:
+                with _cache_lock:
+                    _lecturas_en_vuelo.pop(clave, None)
+                    # Si hubo una escritura mientras se calculaba, el resultado puede ser anterior
+                    if (resultado is not None and resultado[1] == 200 and duracion > 0
+                            and generacion == _generacion_cache):
+                        _guardar_en_cache(clave, (time.monotonic() + duracion,) + resultado)
+                vuelo.resultado = resultado
+                vuelo.evento.set()
+        return envoltura
+    return decorador
+
+def _guardar_en_cache(clave, entrada):
+    """Guarda una entrada (con _cache_lock tomado) descartando vencidas y, si sigue llena, las menos usadas"""
+    _cache_lecturas[clave] = entrada
+    _cache_lecturas.move_to_end(clave)
+    if len(_cache_lecturas) > CACHE_MAX_ENTRADAS:
+        ahora = time.monotonic()
+        for vencida in [c for c, e in _cache_lecturas.items() if e[0] <= ahora]:
+            del _cache_lecturas[vencida]
+        while len(_cache_lecturas) > CACHE_MAX_ENTRADAS:
+            _cache_lecturas.popitem(last=False)
+
+def limpiar_cache_lecturas():
+    """Vaciar la cache de lecturas (por ejemplo tras resetear la base de datos)"""
+    global _generacion_cache
+    with _cache_lock:
+        _cache_lecturas.clear()
+        _generacion_cache += 1
+
+# -------------------- GET CONDICIONAL (ETag / 304) --------------------
+# Cada tabla tiene un contador de versión mantenido por triggers (ver models.py).
+# El ETag de una lectura se deriva de las versiones de las tablas que consulta,
+# de modo que un cliente que repite la petición sin cambios recibe un 304 sin
+# que el handler llegue a ejecutar ninguna consulta.
+class _LectorVersiones:
+    """Conexión persistente que lee versiones_tablas solo cuando hubo commits"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        self.conn = None
+        self.data_version = None
+        self.versiones = None
+
+    def leer(self):
+        with self.lock:
+            if self.conn is None:
+                self.conn = sqlite3.connect(self.ruta, check_same_thread=False)
+            # PRAGMA data_version cambia cuando otra conexión hace commit
+            data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+            if self.versiones is None or data_version != self.data_version:
+                filas = self.conn.execute('SELECT tabla, version FROM versiones_tablas').fetchall()
+                self.versiones = dict(filas)
+                self.data_version = data_version
+            return self.versiones
+
+    def cerrar(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+def get_versiones_tablas():
+    """Versiones actuales de todas las tablas del tenant, o None si no hay contadores"""
+    try:
+        return estado_tenant().lector_versiones.leer()
+    except sqlite3.Error:
+        # Base de datos sin inicializar (sin tabla versiones_tablas)
+        return None
+
+def condicional(*tablas):
+    """Decorador que responde 304 si las tablas consultadas no han cambiado"""
+    def decorador(f):
+        @wraps(f)
+        def envoltura(*args, **kwargs):
+            compartida = g.get('conexion_batch')
+            if compartida is not None:
+                # El ETag de una sub-petición refleja el snapshot del batch, no el estado actual
+                versiones = dict(compartida.execute('SELECT tabla, version FROM versiones_tablas').fetchall())
+            else:
+                versiones = get_versiones_tablas()
+            if versiones is None:
+                return f(*args, **kwargs)
+            
+            # La fecha entra en el ETag porque algunas respuestas (días vencidos) dependen de ella
+            firma = '|'.join(f"{t}:{versiones.get(t, 0)}" for t in tablas)
+            g.firma_versiones = firma
+            base = f"{clave_lectura()}|{firma}|{datetime.now().date().isoformat()}"
+            etag = hashlib.sha1(base.encode()).hexdigest()[:20]
+            
+            if request.if_none_match.contains_weak(etag):
+                respuesta = Response(status=304)
+            else:
+                respuesta = app.make_response(f(*args, **kwargs))
+                if respuesta.status_code != 200:
+                    return respuesta
+            respuesta.set_etag(etag, weak=True)
+            respuesta.headers['Cache-Control'] = 'no-cache'
+            return respuesta
+        return envoltura
+    return decorador
+
+@app.after_request
+def invalidar_cache_tras_escritura(response):
+    # Cualquier escritura exitosa deja obsoletos los agregados cacheados
+    if request.method in ('POST', 'PUT', 'DELETE') and response.status_code < 400:
+        limpiar_cache_lecturas()
+        # Las rutas que publican eventos ajustan los contadores del dashboard con
+        # deltas; cualquier otra escritura obliga a recalcularlos
+        if request.endpoint not in ENDPOINTS_CON_EVENTOS:
+            invalidar_contadores()
+    
+    # Métricas por tenant (sin crear el estado si la petición falló antes de usarlo)
+    inicio = g.get('inicio_peticion')
+    estado = _tenants.get(g.get('tenant'))
+    if inicio is not None and estado is not None:
+        estado.registrar_peticion(time.perf_counter() - inicio, respaldo_en_curso(estado.tenant))
+    return response
+
+def get_metricas_coalescing():
+    with _cache_lock:
+        ahora = time.monotonic()
+        return {
+            **_metricas_coalescing,
+            'en_vuelo': len(_lecturas_en_vuelo),
+            'entradas_cache': sum(1 for e in _cache_lecturas.values() if e[0] > ahora),
+            'ttl_segundos': CACHE_TTL_SEGUNDOS
+        }
+
+# -------------------- AUTOCOMPLETADO (ÍNDICE DE PREFIJOS EN MEMORIA) --------------------
+# Arreglo ordenado de (clave, id) por entidad: un bisect encuentra el primer
+# candidato y se recorre mientras la clave empiece por el prefijo. Las rutas
+# CRUD aplican sus cambios en el índice; cualquier otra escritura (importación,
+# reset, otro proceso) se detecta por el contador de versión de la tabla y
+# provoca una recarga completa en la siguiente búsqueda.
+AUTOCOMPLETAR_MAX_RESULTADOS = int(os.getenv('AUTOCOMPLETAR_MAX_RESULTADOS', '20'))
+
+def normalizar_texto(texto):
+    """Minúsculas y sin acentos, para comparar prefijos"""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower().strip()
+
+class _EntradaAutocompletar:
+    __slots__ = ('id', 'nombre', 'detalle', 'claves')
+
+    def __init__(self, id, nombre, detalle, claves):
+        self.id = id
+        self.nombre = nombre
+        self.detalle = detalle
+        self.claves = claves
+
+class _IndicePrefijos:
+    """Índice de prefijos de una tabla, sincronizado con versiones_tablas"""
+
+    def __init__(self, tabla, columna_detalle, columnas_palabras, columnas_completas=()):
+        self.tabla = tabla
+        self.columna_detalle = columna_detalle
+        # Columnas indexadas por cada palabra (nombre) o como un solo token (email)
+        self.columnas_palabras = columnas_palabras
+        self.columnas_completas = columnas_completas
+        self.lock = threading.Lock()
+        self.pares = []
+        self.entradas = {}
+        self.version = None
+        self.recargas = 0
+        self.busquedas = 0
+
+    def _claves(self, fila):
+        claves = set()
+        for columna in self.columnas_palabras:
+            palabras = normalizar_texto(fila[columna]).split()
+            # Cada sufijo de palabras: "zuniga perez" -> "zuniga perez", "perez"
+            claves.update(' '.join(palabras[i:]) for i in range(len(palabras)))
+        for columna in self.columnas_completas:
+            clave = normalizar_texto(fila[columna])
+            if clave:
+                claves.add(clave)
+        return tuple(claves)
+
+    def _entrada(self, fila):
+        return _EntradaAutocompletar(fila['id'], fila['nombre'], fila[self.columna_detalle], self._claves(fila))
+
+    def _quitar(self, id):
+        entrada = self.entradas.pop(id, None)
+        if entrada is not None:
+            for clave in entrada.claves:
+                i = bisect.bisect_left(self.pares, (clave, id))
+                if i < len(self.pares) and self.pares[i] == (clave, id):
+                    del self.pares[i]
+
+    def _recargar(self):
+        columnas = ['id', 'nombre', self.columna_detalle, *self.columnas_palabras, *self.columnas_completas]
+        version, filas = leer_versionado(self.tabla, f'SELECT {", ".join(dict.fromkeys(columnas))} FROM {self.tabla}')
+        self.entradas = {fila['id']: self._entrada(fila) for fila in filas}
+        self.pares = sorted((clave, e.id) for e in self.entradas.values() for clave in e.claves)
+        self.version = version
+        self.recargas += 1
+
+    def buscar(self, prefijo, limite):
+        prefijo = normalizar_texto(prefijo)
+        versiones = get_versiones_tablas() or {}
+        with self.lock:
+            version = versiones.get(self.tabla, 0)
+            if version != self.version:
+                self._recargar()
+            self.busquedas += 1
+            
+            resultados = []
+            vistos = set()
+            i = bisect.bisect_left(self.pares, (prefijo,))
+            while i < len(self.pares) and len(resultados) < limite:
+                clave, id = self.pares[i]
+                if not clave.startswith(prefijo):
+                    break
+                if id not in vistos:
+                    vistos.add(id)
+                    entrada = self.entradas[id]
+                    resultados.append({'id': id, 'nombre': entrada.nombre, self.columna_detalle: entrada.detalle})
+                i += 1
+            return resultados
+
+    def aplicar(self, id, fila, version):
+        """
+        Aplica el alta/cambio (fila) o la baja (fila=None) hecha por una ruta CRUD.
+        `version` es la versión de la tabla leída en la misma transacción; si el
+        índice se saltó otra escritura intermedia se deja para recargar.
+        """
+        with self.lock:
+            if self.version is None or version != self.version + 1:
+                self.version = None
+                return
+            self._quitar(id)
+            if fila is not None:
+                entrada = self.entradas[id] = self._entrada(fila)
+                for clave in entrada.claves:
+                    bisect.insort(self.pares, (clave, id))
+            self.version = version
+
+    def metricas(self):
+        with self.lock:
+            return {
+                'entradas': len(self.entradas),
+                'claves': len(self.pares),
+                'version': self.version,
+                'recargas': self.recargas,
+                'busquedas': self.busquedas
+            }
+
+def indices_autocompletar():
+    """Índices de autocompletado del tenant de la petición"""
+    return estado_tenant().autocompletar
+
+def version_tabla(conn, tabla):
+    """Versión actual de una tabla dentro de la transacción de `conn`"""
+    fila = conn.execute('SELECT version FROM versiones_tablas WHERE tabla = ?', (tabla,)).fetchone()
+    return fila[0] if fila else 0
+
+def leer_versionado(tabla, sql):
+    """
+    (versión de `tabla`, filas de `sql`) leídas en una misma transacción de una
+    conexión nueva del pool: nunca del snapshot de /api/batch, que puede ser
+    anterior a la versión actual y dejaría la cache marcada con datos viejos
+    """
+    conn = estado_tenant().conectar()
+    try:
+        conn.execute('BEGIN')
+        version = version_tabla(conn, tabla)
+        filas = conn.execute(sql).fetchall()
+    finally:
+        conn.rollback()
+        conn.close()
+    return version, filas
+
+@app.route('/api/autocomplete/<string:entidad>', methods=['GET'])
+def autocompletar(entidad):
+    """Sugerencias por prefijo para los selectores de productos y clientes"""
+    indices = indices_autocompletar()
+    indice = indices.get(entidad)
+    if indice is None:
+        return jsonify({'error': f'Entidad inválida. Entidades válidas: {", ".join(indices)}'}), 400
+    
+    prefijo = request.args.get('prefix', '')
+    if not normalizar_texto(prefijo):
+        return respuesta_json([])
+    limite = min(request.args.get('limit', 10, type=int), AUTOCOMPLETAR_MAX_RESULTADOS)
+    return respuesta_json(indice.buscar(prefijo, limite))
+
+# -------------------- CATÁLOGO DE PRODUCTOS (CACHE EN MEMORIA) --------------------
+# Copia completa de id -> (nombre, tipo, precio) para las rutas de ventas y
+# pedidos. Igual que el autocompletado, se valida contra la versión de la tabla
+# productos: las rutas CRUD de productos la actualizan en el momento y cualquier
+# otro cambio fuerza una recarga en la siguiente consulta.
+ProductoCatalogo = namedtuple('ProductoCatalogo', ['nombre', 'tipo', 'precio'])
+
+class _CatalogoProductos:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.productos = {}
+        self.version = None
+        self.aciertos = 0
+        self.fallos = 0
+        self.recargas = 0
+
+    def _vigentes(self):
+        """Diccionario id -> ProductoCatalogo vigente (recarga si la tabla cambió)"""
+        version = (get_versiones_tablas() or {}).get('productos', 0)
+        with self.lock:
+            if version != self.version:
+                version, filas = leer_versionado('productos', 'SELECT id, nombre, tipo, precio FROM productos')
+                self.productos = {fila[0]: ProductoCatalogo(fila[1], fila[2], fila[3]) for fila in filas}
+                self.version = version
+                self.recargas += 1
+                self.fallos += 1
+            else:
+                self.aciertos += 1
+            return self.productos
+
+    def obtener(self, producto_id):
+        """ProductoCatalogo del id, o None si no existe"""
+        return self._vigentes().get(producto_id)
+
+    def todos(self):
+        """Snapshot completo para resolver muchas filas con una sola validación"""
+        return self._vigentes()
+
+    def aplicar(self, producto_id, fila, version):
+        """Aplica el alta/cambio (fila) o la baja (fila=None) de una ruta CRUD de productos"""
+        with self.lock:
+            if self.version is None or version != self.version + 1:
+                self.version = None
+                return
+            # Copia para que los lectores que ya tienen el snapshot no lo vean mutar
+            productos = dict(self.productos)
+            if fila is None:
+                productos.pop(producto_id, None)
+            else:
+                productos[producto_id] = ProductoCatalogo(fila['nombre'], fila['tipo'], fila['precio'])
+            self.productos = productos
+            self.version = version
+
+    def metricas(self):
+        with self.lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'productos': len(self.productos),
+                'version': self.version,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'recargas': self.recargas,
+                'tasa_aciertos': round(self.aciertos / consultas, 4) if consultas else None
+            }
+
+def catalogo_productos():
+    """Catálogo de productos del tenant de la petición"""
+    return estado_tenant().catalogo
+
+def productos_modificados(producto_id, fila, version):
+    """Propaga un cambio de producto hecho por una ruta CRUD a las caches en memoria"""
+    indices_autocompletar()['productos'].aplicar(producto_id, fila, version)
+    catalogo_productos().aplicar(producto_id, fila, version)
+
 # -------------------- RUTAS DE AUTENTICACIÓN --------------------
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -110,24 +1160,35 @@ def verify_token():
     return jsonify({'valid': False}), 401
 
 @app.route('/api/usuarios', methods=['GET'])
+@condicional('usuarios')
 def get_usuarios():
     conn = get_db_connection()
-    usuarios = conn.execute('''
+    usuarios = consultar_dicts(conn, '''
         SELECT id, name, email, role, created_at 
         FROM usuarios
-    ''').fetchall()
+    ''')
     conn.close()
-    return jsonify([dict(usuario) for usuario in usuarios])
+    return respuesta_json(usuarios)
 
 # -------------------- RUTAS PARA PRODUCTOS --------------------
 @app.route('/api/productos', methods=['GET'])
+@condicional('productos')
 def get_productos():
+    try:
+        ids = param_ids()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     conn = get_db_connection()
-    productos = conn.execute('SELECT * FROM productos').fetchall()
+    if ids is not None:
+        productos = consultar_por_ids(conn, 'productos', ids)
+    else:
+        productos = consultar_dicts(conn, 'SELECT * FROM productos')
     conn.close()
-    return jsonify([dict(producto) for producto in productos])
+    return respuesta_json(productos)
 
 @app.route('/api/productos/<int:id>', methods=['GET'])
+@condicional('productos')
 def get_producto(id):
     conn = get_db_connection()
     producto = conn.execute('SELECT * FROM productos WHERE id = ?', (id,)).fetchone()
@@ -138,100 +1199,206 @@ def get_producto(id):
 def agregar_producto():
     data = request.json
     conn = get_db_connection()
-    conn.execute('INSERT INTO productos (nombre, tipo, precio, descripcion) VALUES (?, ?, ?, ?)', 
-                 (data['nombre'], data['tipo'], data['precio'], data.get('descripcion', '')))
+    cursor = conn.execute('INSERT INTO productos (nombre, tipo, precio, descripcion) VALUES (?, ?, ?, ?)', 
+                          (data['nombre'], data['tipo'], data['precio'], data.get('descripcion', '')))
+    producto_id = cursor.lastrowid
+    version = version_tabla(conn, 'productos')
+    # La fila tal como quedó guardada (precio ya convertido a REAL), no el body
+    producto = dict(conn.execute('SELECT * FROM productos WHERE id = ?', (producto_id,)).fetchone())
     conn.commit()
     conn.close()
+    productos_modificados(producto_id, producto, version)
     return jsonify({'mensaje': 'Producto creado'}), 201
 
 @app.route('/api/productos/<int:id>', methods=['PUT'])
 def actualizar_producto(id):
     data = request.json
     conn = get_db_connection()
-    conn.execute('UPDATE productos SET nombre = ?, tipo = ?, precio = ?, descripcion = ? WHERE id = ?',
-                 (data['nombre'], data['tipo'], data['precio'], data.get('descripcion', ''), id))
+    cursor = conn.execute('UPDATE productos SET nombre = ?, tipo = ?, precio = ?, descripcion = ? WHERE id = ?',
+                          (data['nombre'], data['tipo'], data['precio'], data.get('descripcion', ''), id))
+    if cursor.rowcount:
+        version = version_tabla(conn, 'productos')
+        producto = dict(conn.execute('SELECT * FROM productos WHERE id = ?', (id,)).fetchone())
     conn.commit()
     conn.close()
+    if cursor.rowcount:
+        productos_modificados(id, producto, version)
     return jsonify({'mensaje': 'Producto actualizado'})
 
 @app.route('/api/productos/<int:id>', methods=['DELETE'])
 def eliminar_producto(id):
     conn = get_db_connection()
-    conn.execute('DELETE FROM productos WHERE id = ?', (id,))
+    cursor = conn.execute('DELETE FROM productos WHERE id = ?', (id,))
+    if cursor.rowcount:
+        version = version_tabla(conn, 'productos')
     conn.commit()
     conn.close()
+    if cursor.rowcount:
+        productos_modificados(id, None, version)
     return jsonify({'mensaje': 'Producto eliminado'})
 
 # -------------------- RUTAS PARA CLIENTES --------------------
 @app.route('/api/clientes', methods=['GET'])
+@condicional('clientes')
 def get_clientes():
+    try:
+        ids = param_ids()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     conn = get_db_connection()
-    clientes = conn.execute('SELECT * FROM clientes').fetchall()
+    if ids is not None:
+        clientes = consultar_por_ids(conn, 'clientes', ids)
+    else:
+        clientes = consultar_dicts(conn, 'SELECT * FROM clientes')
     conn.close()
-    return jsonify([dict(cliente) for cliente in clientes])
+    return respuesta_json(clientes)
+
+def metricas_cliente(fila):
+    """Métricas acumuladas de un cliente desde su fila de cliente_metricas (None = sin movimientos)"""
+    num_ventas = fila['num_ventas'] if fila else 0
+    ingresos = fila['ingresos'] if fila else 0
+    return {
+        'num_ventas': num_ventas,
+        'ingresos': round(ingresos, 2),
+        'ticket_promedio': round(ingresos / num_ventas, 2) if num_ventas > 0 else 0,
+        'primera_compra': fila['primera_compra'] if fila else None,
+        'ultima_compra': fila['ultima_compra'] if fila else None,
+        'saldo_pendiente': round(fila['saldo_pendiente'], 2) if fila else 0,
+        'facturas_pendientes': fila['facturas_pendientes'] if fila else 0
+    }
 
 @app.route('/api/clientes/<int:id>', methods=['GET'])
+@condicional('clientes', 'ventas', 'cuentas_por_cobrar')
 def get_cliente(id):
     conn = get_db_connection()
     cliente = conn.execute('SELECT * FROM clientes WHERE id = ?', (id,)).fetchone()
+    metricas = conn.execute('SELECT * FROM cliente_metricas WHERE cliente_id = ?', (id,)).fetchone()
     conn.close()
-    return jsonify(dict(cliente)) if cliente else ('', 404)
+    if not cliente:
+        return '', 404
+    return jsonify({**dict(cliente), 'metricas': metricas_cliente(metricas)})
 
 @app.route('/api/clientes', methods=['POST'])
 def agregar_cliente():
     data = request.json
     conn = get_db_connection()
-    conn.execute('INSERT INTO clientes (nombre, email, telefono, direccion, notas) VALUES (?, ?, ?, ?, ?)',
-                 (data['nombre'], data.get('email', ''), data.get('telefono', ''), 
-                  data.get('direccion', ''), data.get('notas', '')))
+    cursor = conn.execute('INSERT INTO clientes (nombre, email, telefono, direccion, notas) VALUES (?, ?, ?, ?, ?)',
+                          (data['nombre'], data.get('email', ''), data.get('telefono', ''), 
+                           data.get('direccion', ''), data.get('notas', '')))
+    cliente_id = cursor.lastrowid
+    version = version_tabla(conn, 'clientes')
     conn.commit()
     conn.close()
+    indices_autocompletar()['clientes'].aplicar(
+        cliente_id, {'id': cliente_id, 'nombre': data['nombre'], 'email': data.get('email', '')}, version)
     return jsonify({'mensaje': 'Cliente agregado'}), 201
 
 @app.route('/api/clientes/<int:id>', methods=['PUT'])
 def actualizar_cliente(id):
     data = request.json
     conn = get_db_connection()
-    conn.execute('UPDATE clientes SET nombre = ?, email = ?, telefono = ?, direccion = ?, notas = ? WHERE id = ?',
-                 (data['nombre'], data.get('email', ''), data.get('telefono', ''), 
-                  data.get('direccion', ''), data.get('notas', ''), id))
+    cursor = conn.execute('UPDATE clientes SET nombre = ?, email = ?, telefono = ?, direccion = ?, notas = ? WHERE id = ?',
+                          (data['nombre'], data.get('email', ''), data.get('telefono', ''), 
+                           data.get('direccion', ''), data.get('notas', ''), id))
+    if cursor.rowcount:
+        version = version_tabla(conn, 'clientes')
     conn.commit()
     conn.close()
+    if cursor.rowcount:
+        indices_autocompletar()['clientes'].aplicar(
+            id, {'id': id, 'nombre': data['nombre'], 'email': data.get('email', '')}, version)
     return jsonify({'mensaje': 'Cliente actualizado'})
 
 @app.route('/api/clientes/<int:id>', methods=['DELETE'])
 def eliminar_cliente(id):
     conn = get_db_connection()
-    conn.execute('DELETE FROM clientes WHERE id = ?', (id,))
+    cursor = conn.execute('DELETE FROM clientes WHERE id = ?', (id,))
+    if cursor.rowcount:
+        version = version_tabla(conn, 'clientes')
     conn.commit()
     conn.close()
+    if cursor.rowcount:
+        indices_autocompletar()['clientes'].aplicar(id, None, version)
     return jsonify({'mensaje': 'Cliente eliminado'})
 
 # -------------------- RUTAS PARA PEDIDOS --------------------
 @app.route('/api/pedidos', methods=['GET'])
+@condicional('pedidos', 'pedido_productos', 'productos', 'clientes')
 def get_pedidos():
     conn = get_db_connection()
-    pedidos = conn.execute('''
-        SELECT p.*, c.nombre as cliente_nombre 
-        FROM pedidos p 
-        LEFT JOIN clientes c ON p.cliente_id = c.id
-    ''').fetchall()
-    
-    # Obtener productos para cada pedido
-    pedidos_con_productos = []
-    for pedido in pedidos:
-        pedido_dict = dict(pedido)
-        productos = conn.execute('''
-            SELECT pp.cantidad, pr.nombre, pr.precio, pr.tipo
-            FROM pedido_productos pp
-            JOIN productos pr ON pp.producto_id = pr.id
-            WHERE pp.pedido_id = ?
-        ''', (pedido['id'],)).fetchall()
-        pedido_dict['productos'] = [dict(producto) for producto in productos]
-        pedidos_con_productos.append(pedido_dict)
+    try:
+        ids = param_ids()
+        desde, hasta = rango_fechas()
+        campos, incluir, select, joins = construir_proyeccion(conn, 'pedidos', 'p', {
+            'cliente': ('c.nombre as cliente_nombre', 'LEFT JOIN clientes c ON p.cliente_id = c.id'),
+            'productos': (None, None),
+        }, relaciones_default=['cliente', 'productos'])
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+    
+    # Los productos se asocian por id, así que se necesita aunque no se haya pedido
+    embebe_productos = 'productos' in incluir
+    agrega_id = embebe_productos and campos is not None and 'id' not in campos
+    if agrega_id:
+        select = 'p.id, ' + select
+    
+    if ids is not None:
+        # Búsqueda por lista de ids: un solo JOIN contra json_each, en el orden pedido
+        # (los ids pueden ser de pedidos archivados de cualquier año)
+        origen_lineas = fuente('pedido_productos')
+        pedidos = consultar_dicts(conn, f'''
+            SELECT {select}
+            FROM json_each(?) AS j
+            JOIN {fuente('pedidos')} p ON p.id = j.value
+            {joins}
+            ORDER BY j.key
+        ''', (json.dumps(ids),))
+        filtro_lineas, params_lineas = 'WHERE pp.pedido_id IN (SELECT value FROM json_each(?))', (json.dumps(ids),)
+    else:
+        # Con ?desde/?hasta solo se leen las particiones de archivo del rango
+        origen = fuente('pedidos', desde, hasta)
+        origen_lineas = fuente('pedido_productos', desde, hasta)
+        condiciones, params = filtro_rango('p.fecha', desde, hasta)
+        where = 'WHERE ' + ' AND '.join(condiciones) if condiciones else ''
+        pedidos = consultar_dicts(conn, f'''
+            SELECT {select}
+            FROM {origen} p 
+            {joins}
+            {where}
+        ''', params)
+        if condiciones:
+            filtro_lineas = f'WHERE pp.pedido_id IN (SELECT p.id FROM {origen} p {where})'
+        else:
+            filtro_lineas = ''
+        params_lineas = params
+    
+    if embebe_productos:
+        # Obtener las líneas de todos los pedidos en una sola consulta; nombre,
+        # precio y tipo salen del catálogo en memoria en vez de un JOIN por fila
+        catalogo = catalogo_productos().todos()
+        productos_por_pedido = {}
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        for pedido_id, producto_id, cantidad in cursor.execute(f'''
+            SELECT pp.pedido_id, pp.producto_id, pp.cantidad
+            FROM {origen_lineas} pp
+            {filtro_lineas}
+            ORDER BY pp.id
+        ''', params_lineas):
+            producto = catalogo.get(producto_id)
+            if producto is None:
+                continue
+            productos_por_pedido.setdefault(pedido_id, []).append({
+                'cantidad': cantidad, 'nombre': producto.nombre, 'precio': producto.precio, 'tipo': producto.tipo
+            })
+        
+        for pedido in pedidos:
+            pedido['productos'] = productos_por_pedido.get(pedido.pop('id') if agrega_id else pedido['id'], [])
     
     conn.close()
-    return jsonify(pedidos_con_productos)
+    return respuesta_json(pedidos)
 
 @app.route('/api/pedidos', methods=['POST'])
 def crear_pedido():
@@ -256,46 +1423,152 @@ def crear_pedido():
     
     # Agregar productos al pedido
     if 'productos' in data:
-        for producto in data['productos']:
-            cursor.execute('''
-                INSERT INTO pedido_productos (pedido_id, producto_id, cantidad) 
-                VALUES (?, ?, ?)
-            ''', (pedido_id, producto['producto_id'], producto.get('cantidad', 1)))
+        cursor.executemany('''
+            INSERT INTO pedido_productos (pedido_id, producto_id, cantidad) 
+            VALUES (?, ?, ?)
+        ''', [(pedido_id, producto['producto_id'], producto.get('cantidad', 1)) for producto in data['productos']])
     
     conn.commit()
     conn.close()
     return jsonify({'mensaje': 'Pedido creado', 'id': pedido_id}), 201
 
+BULK_MAX_PEDIDOS = int(os.getenv('BULK_MAX_PEDIDOS', '5000'))
+
+def _validar_pedido_bulk(pedido):
+    """Devuelve una lista de errores de un pedido del bulk (vacía si es válido)"""
+    if not isinstance(pedido, dict):
+        return ['el pedido debe ser un objeto']
+    errores = []
+    if pedido.get('cliente_id') is not None and not es_entero(pedido['cliente_id']):
+        errores.append('cliente_id debe ser entero')
+    productos = pedido.get('productos', [])
+    if not isinstance(productos, list):
+        return errores + ['productos debe ser una lista']
+    for i, producto in enumerate(productos):
+        if not isinstance(producto, dict) or not es_entero(producto.get('producto_id')):
+            errores.append(f'productos[{i}].producto_id debe ser entero')
+        elif not es_entero(producto.get('cantidad', 1)) or producto.get('cantidad', 1) < 1:
+            errores.append(f'productos[{i}].cantidad debe ser un entero >= 1')
+    return errores
+
+@app.route('/api/pedidos/bulk', methods=['POST'])
+def crear_pedidos_bulk():
+    """Crear muchos pedidos con sus productos en una sola transacción"""
+    data = request.json
+    pedidos = data.get('pedidos') if isinstance(data, dict) else data
+    if not isinstance(pedidos, list) or not pedidos:
+        return jsonify({'error': "Se esperaba una lista 'pedidos' con al menos un pedido"}), 400
+    if len(pedidos) > BULK_MAX_PEDIDOS:
+        return jsonify({'error': f'Máximo {BULK_MAX_PEDIDOS} pedidos por petición'}), 400
+    
+    # Validar todo antes de escribir: o entran todos o ninguno
+    errores = []
+    for indice, pedido in enumerate(pedidos):
+        for error in _validar_pedido_bulk(pedido):
+            errores.append({'indice': indice, 'error': error})
+    if errores:
+        return jsonify({'error': 'Pedidos inválidos', 'errores': errores}), 400
+    
+    ahora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        # RETURNING devuelve el id de cada pedido sin suponer que quedan consecutivos
+        ids = [cursor.execute('''
+            INSERT INTO pedidos (cliente_id, fecha, encargado_principal, pago_realizado, notas, estado) 
+            VALUES (?, ?, ?, ?, ?, ?)
+            RETURNING id
+        ''', (
+            pedido.get('cliente_id'),
+            pedido.get('fecha', ahora),
+            pedido.get('encargado_principal', ''),
+            pedido.get('pago_realizado', False),
+            pedido.get('notas', ''),
+            pedido.get('estado', 'pendiente')
+        )).fetchone()[0] for pedido in pedidos]
+        
+        cursor.executemany('''
+            INSERT INTO pedido_productos (pedido_id, producto_id, cantidad) 
+            VALUES (?, ?, ?)
+        ''', [
+            (pedido_id, producto['producto_id'], producto.get('cantidad', 1))
+            for pedido_id, pedido in zip(ids, pedidos)
+            for producto in pedido.get('productos', [])
+        ])
+        
+        conn.commit()
+        conn.close()
+        return jsonify({'mensaje': 'Pedidos creados', 'creados': len(ids), 'ids': ids}), 201
+    
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+def diff_lineas_pedido(existentes, nuevas):
+    """
+    Compara las líneas actuales de un pedido con las nuevas.
+    `existentes`: [(id, producto_id, cantidad)], `nuevas`: [(producto_id, cantidad)].
+    Empareja por producto_id y devuelve (actualizar [(cantidad, id)],
+    insertar [(producto_id, cantidad)], eliminar [id]).
+    """
+    disponibles = {}
+    for linea_id, producto_id, cantidad in existentes:
+        disponibles.setdefault(producto_id, []).append((linea_id, cantidad))
+    
+    actualizar, insertar = [], []
+    for producto_id, cantidad in nuevas:
+        candidatas = disponibles.get(producto_id)
+        if candidatas:
+            linea_id, cantidad_actual = candidatas.pop(0)
+            if cantidad_actual != cantidad:
+                actualizar.append((cantidad, linea_id))
+        else:
+            insertar.append((producto_id, cantidad))
+    
+    eliminar = [linea_id for candidatas in disponibles.values() for linea_id, _ in candidatas]
+    return actualizar, insertar, eliminar
+
 @app.route('/api/pedidos/<int:id>', methods=['PUT'])
 def actualizar_pedido(id):
     data = request.json
     conn = get_db_connection()
     
-    # Actualizar el pedido principal
-    conn.execute('''
-        UPDATE pedidos 
-        SET cliente_id = ?, fecha = ?, encargado_principal = ?, pago_realizado = ?, notas = ?, estado = ?
-        WHERE id = ?
-    ''', (
+    valores = (
         data.get('cliente_id'),
         data.get('fecha'),
         data.get('encargado_principal', ''),
         data.get('pago_realizado', False),
         data.get('notas', ''),
-        data.get('estado', 'pendiente'),
-        id
-    ))
+        data.get('estado', 'pendiente')
+    )
+    # Actualizar el pedido principal (solo si algo cambió, para no disparar escrituras ni triggers)
+    conn.execute('''
+        UPDATE pedidos 
+        SET cliente_id = ?, fecha = ?, encargado_principal = ?, pago_realizado = ?, notas = ?, estado = ?
+        WHERE id = ?
+          AND (cliente_id IS NOT ? OR fecha IS NOT ? OR encargado_principal IS NOT ?
+               OR pago_realizado IS NOT ? OR notas IS NOT ? OR estado IS NOT ?)
+    ''', valores + (id,) + valores)
     
-    # Actualizar productos si se proporcionan
+    # Actualizar productos si se proporcionan: solo se tocan las líneas que cambiaron
     if 'productos' in data:
-        # Eliminar productos existentes
-        conn.execute('DELETE FROM pedido_productos WHERE pedido_id = ?', (id,))
-        # Agregar nuevos productos
-        for producto in data['productos']:
-            conn.execute('''
+        existentes = conn.execute('''
+            SELECT id, producto_id, cantidad FROM pedido_productos WHERE pedido_id = ? ORDER BY id
+        ''', (id,)).fetchall()
+        nuevas = [(producto['producto_id'], producto.get('cantidad', 1)) for producto in data['productos']]
+        actualizar, insertar, eliminar = diff_lineas_pedido([tuple(fila) for fila in existentes], nuevas)
+        
+        if eliminar:
+            conn.executemany('DELETE FROM pedido_productos WHERE id = ?', [(linea_id,) for linea_id in eliminar])
+        if actualizar:
+            conn.executemany('UPDATE pedido_productos SET cantidad = ? WHERE id = ?', actualizar)
+        if insertar:
+            conn.executemany('''
                 INSERT INTO pedido_productos (pedido_id, producto_id, cantidad) 
                 VALUES (?, ?, ?)
-            ''', (id, producto['producto_id'], producto.get('cantidad', 1)))
+            ''', [(id, producto_id, cantidad) for producto_id, cantidad in insertar])
     
     conn.commit()
     conn.close()
@@ -305,11 +1578,80 @@ def actualizar_pedido(id):
 def actualizar_estado_pedido(id):
     data = request.json
     conn = get_db_connection()
+    generacion = generacion_contadores()
+    anterior = conn.execute('SELECT estado FROM pedidos WHERE id = ?', (id,)).fetchone()
     conn.execute('UPDATE pedidos SET estado = ? WHERE id = ?', (data['estado'], id))
     conn.commit()
     conn.close()
+    
+    if anterior:
+        # Igual que en SQL, un estado NULL no cuenta como pendiente
+        estaba_pendiente = anterior['estado'] is not None and anterior['estado'] not in ESTADOS_PEDIDO_CERRADOS
+        queda_pendiente = data['estado'] is not None and data['estado'] not in ESTADOS_PEDIDO_CERRADOS
+        ajustar_contadores(generacion, entregas_pendientes=int(queda_pendiente) - int(estaba_pendiente))
+        publicar_evento('pedido_estado', {
+            'pedido_id': id,
+            'estado_anterior': anterior['estado'],
+            'estado': data['estado']
+        })
     return jsonify({'mensaje': 'Estado del pedido actualizado'})
 
+@app.route('/api/pedidos/estado', methods=['PUT'])
+def actualizar_estado_pedidos_batch():
+    """Cambiar el estado de muchos pedidos con un solo UPDATE"""
+    data = request.json
+    try:
+        ids = ids_del_body(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    estado = data.get('estado')
+    if not isinstance(estado, str) or not estado:
+        return jsonify({'error': "Se esperaba 'estado'"}), 400
+    
+    ids_json = json.dumps(ids)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    generacion = generacion_contadores()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        anteriores = dict(cursor.execute('''
+            SELECT id, estado FROM pedidos WHERE id IN (SELECT value FROM json_each(?))
+        ''', (ids_json,)).fetchall())
+        cursor.execute('''
+            UPDATE pedidos SET estado = ?
+            WHERE id IN (SELECT value FROM json_each(?)) AND estado IS NOT ?
+        ''', (estado, ids_json, estado))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+    
+    resultados = {}
+    cambiados = []
+    for pedido_id in ids:
+        if pedido_id not in anteriores:
+            resultados[pedido_id] = 'no_encontrado'
+        elif anteriores[pedido_id] == estado:
+            resultados[pedido_id] = 'sin_cambios'
+        else:
+            resultados[pedido_id] = 'actualizado'
+            cambiados.append(pedido_id)
+    
+    if cambiados:
+        queda_pendiente = estado not in ESTADOS_PEDIDO_CERRADOS
+        estaban_pendientes = sum(1 for pedido_id in cambiados
+                                 if anteriores[pedido_id] is not None
+                                 and anteriores[pedido_id] not in ESTADOS_PEDIDO_CERRADOS)
+        ajustar_contadores(generacion, entregas_pendientes=len(cambiados) * int(queda_pendiente) - estaban_pendientes)
+        publicar_evento('pedidos_estado', {'pedido_ids': cambiados, 'estado': estado})
+    
+    return jsonify({
+        'mensaje': f'{len(cambiados)} pedidos actualizados',
+        'resultados': [{'id': pedido_id, 'resultado': resultados[pedido_id]} for pedido_id in ids]
+    })
+
 @app.route('/api/pedidos/<int:id>/pago', methods=['PUT'])
 def actualizar_pago_pedido(id):
     data = request.json
@@ -331,10 +1673,11 @@ def eliminar_pedido(id):
     return jsonify({'mensaje': 'Pedido eliminado'})
 
 @app.route('/api/pedidos/pendientes', methods=['GET'])
+@condicional('pedidos', 'clientes', 'ventas')
 def get_pedidos_pendientes():
     """Obtener pedidos que no tienen venta asociada y están listos para facturar"""
     conn = get_db_connection()
-    pedidos = conn.execute('''
+    pedidos = consultar_dicts(conn, '''
         SELECT p.*, c.nombre as cliente_nombre
         FROM pedidos p
         LEFT JOIN clientes c ON p.cliente_id = c.id
@@ -342,33 +1685,58 @@ def get_pedidos_pendientes():
         WHERE v.id IS NULL
         AND p.estado = 'completado'
         ORDER BY p.fecha DESC
-    ''').fetchall()
+    ''')
     conn.close()
-    return jsonify([dict(pedido) for pedido in pedidos])
+    return respuesta_json(pedidos)
 
 # -------------------- RUTAS PARA VENTAS --------------------
 @app.route('/api/ventas', methods=['GET'])
+@condicional('ventas', 'clientes', 'productos', 'pedidos')
 def get_ventas():
     conn = get_db_connection()
-    ventas = conn.execute('''
-        SELECT v.*, 
-               c.nombre as cliente_nombre, 
-               p.nombre as producto_nombre,
-               ped.id as pedido_numero
-        FROM ventas v 
-        LEFT JOIN clientes c ON v.cliente_id = c.id
-        LEFT JOIN productos p ON v.producto_id = p.id
-        LEFT JOIN pedidos ped ON v.pedido_id = ped.id
+    try:
+        desde, hasta = rango_fechas()
+        # Las ventas archivadas apuntan a pedidos archivados de cualquier fecha (ver archivo.py)
+        origen = fuente('ventas', desde, hasta)
+        origen_pedidos = 'pedidos' if origen == 'ventas' else fuente('pedidos')
+        campos, incluir, select, joins = construir_proyeccion(conn, 'ventas', 'v', {
+            'cliente': ('c.nombre as cliente_nombre', 'LEFT JOIN clientes c ON v.cliente_id = c.id'),
+            'producto': (None, None),
+            'pedido': ('ped.id as pedido_numero', f'LEFT JOIN {origen_pedidos} ped ON v.pedido_id = ped.id'),
+        }, relaciones_default=['cliente', 'producto', 'pedido'])
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+    
+    # El nombre del producto sale del catálogo en memoria, así que se necesita producto_id
+    embebe_producto = 'producto' in incluir
+    agrega_producto_id = embebe_producto and campos is not None and 'producto_id' not in campos
+    if agrega_producto_id:
+        select = 'v.producto_id, ' + select
+    
+    condiciones, params = filtro_rango('v.fecha', desde, hasta)
+    ventas = consultar_dicts(conn, f'''
+        SELECT {select}
+        FROM {origen} v 
+        {joins}
+        {'WHERE ' + ' AND '.join(condiciones) if condiciones else ''}
         ORDER BY v.id DESC
-    ''').fetchall()
+    ''', params)
     conn.close()
-    return jsonify([dict(venta) for venta in ventas])
+    
+    if embebe_producto:
+        catalogo = catalogo_productos().todos()
+        for venta in ventas:
+            producto = catalogo.get(venta.pop('producto_id') if agrega_producto_id else venta['producto_id'])
+            venta['producto_nombre'] = producto.nombre if producto else None
+    return respuesta_json(ventas)
 
 @app.route('/api/ventas', methods=['POST'])
 def registrar_venta():
     data = request.json
     conn = get_db_connection()
     cursor = conn.cursor()
+    generacion = generacion_contadores()
     
     try:
         # Si viene pedido_id, obtener datos del pedido
@@ -382,23 +1750,21 @@ def registrar_venta():
             # Usar datos del pedido
             cliente_id = pedido['cliente_id']
             # Para el total, usar el monto del pedido o calcular desde productos
-            productos_pedido = cursor.execute('''
-                SELECT pp.cantidad, p.precio 
-                FROM pedido_productos pp 
-                JOIN productos p ON pp.producto_id = p.id 
-                WHERE pp.pedido_id = ?
+            lineas = cursor.execute('''
+                SELECT producto_id, cantidad FROM pedido_productos WHERE pedido_id = ?
             ''', (pedido_id,)).fetchall()
             
-            total = sum(prod['cantidad'] * prod['precio'] for prod in productos_pedido)
+            catalogo = catalogo_productos().todos()
+            total = sum(linea['cantidad'] * catalogo[linea['producto_id']].precio
+                        for linea in lineas if linea['producto_id'] in catalogo)
         else:
             # Método tradicional - calcular desde producto individual
-            producto = cursor.execute('SELECT precio FROM productos WHERE id = ?', 
-                                   (data['producto_id'],)).fetchone()
+            producto = catalogo_productos().obtener(data['producto_id'])
             if not producto:
                 conn.close()
                 return jsonify({'error': 'Producto no encontrado'}), 404
             
-            total = producto['precio'] * data['cantidad']
+            total = producto.precio * data['cantidad']
             cliente_id = data.get('cliente_id')
         
         # Determinar estado de pago
@@ -446,6 +1812,17 @@ def registrar_venta():
         
         conn.commit()
         conn.close()
+        
+        cuenta_generada = estado_pago == 'pendiente'
+        ajustar_contadores(generacion, ganancias_totales=total,
+                           total_por_cobrar=total if cuenta_generada else 0)
+        publicar_evento('venta_registrada', {
+            'venta_id': venta_id,
+            'cliente_id': cliente_id,
+            'pedido_id': pedido_id,
+            'total': total,
+            'estado_pago': estado_pago
+        })
         return jsonify({
             'mensaje': 'Venta registrada',
             'venta_id': venta_id,
@@ -460,6 +1837,11 @@ def registrar_venta():
 @app.route('/api/ventas/<int:id>', methods=['DELETE'])
 def eliminar_venta(id):
     conn = get_db_connection()
+    try:
+        proteger_periodo(conn, 'ventas', id)
+    except PeriodoCerrado as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 409
     conn.execute('DELETE FROM ventas WHERE id = ?', (id,))
     conn.commit()
     conn.close()
@@ -467,22 +1849,33 @@ def eliminar_venta(id):
 
 # -------------------- RUTAS PARA CUENTAS POR COBRAR --------------------
 @app.route('/api/cuentas-por-cobrar', methods=['GET'])
+@condicional('cuentas_por_cobrar', 'clientes', 'pedidos')
 def get_cuentas_por_cobrar():
+    try:
+        desde, hasta = rango_fechas()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Con ?desde/?hasta solo se incluyen las cuentas archivadas del rango (y sus pedidos)
+    origen = fuente('cuentas_por_cobrar', desde, hasta)
+    origen_pedidos = 'pedidos' if origen == 'cuentas_por_cobrar' else fuente('pedidos')
+    condiciones, params = filtro_rango('c.fecha_creacion', desde, hasta)
     conn = get_db_connection()
-    cuentas = conn.execute('''
+    cuentas = consultar_dicts(conn, f'''
         SELECT c.*, 
                cl.nombre as cliente_nombre,
                p.id as pedido_numero
-        FROM cuentas_por_cobrar c
+        FROM {origen} c
         LEFT JOIN clientes cl ON c.cliente_id = cl.id
-        LEFT JOIN pedidos p ON c.pedido_id = p.id
+        LEFT JOIN {origen_pedidos} p ON c.pedido_id = p.id
+        {'WHERE ' + ' AND '.join(condiciones) if condiciones else ''}
         ORDER BY c.fecha_vencimiento ASC
-    ''').fetchall()
+    ''', params)
     
     # Calcular días vencidos para cada cuenta
     cuentas_con_datos = []
     for cuenta in cuentas:
-        cuenta_dict = dict(cuenta)
+        cuenta_dict = cuenta
         
         # Calcular días vencidos
         from datetime import datetime, date
@@ -504,7 +1897,7 @@ def get_cuentas_por_cobrar():
         cuentas_con_datos.append(cuenta_dict)
     
     conn.close()
-    return jsonify(cuentas_con_datos)
+    return respuesta_json(cuentas_con_datos)
 
 @app.route('/api/cuentas-por-cobrar', methods=['POST'])
 def crear_cuenta_por_cobrar():
@@ -566,7 +1959,12 @@ def actualizar_cuenta_por_cobrar(id):
             WHERE id = ?
         ''', (nuevo_monto_pagado, nuevo_saldo, nuevo_estado, data.get('notas', cuenta_actual['notas']), id))
     else:
-        # Actualización completa
+        # Actualización completa (los pagos no cambian los agregados de un periodo cerrado)
+        try:
+            proteger_periodo(conn, 'cuentas_por_cobrar', id)
+        except PeriodoCerrado as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 409
         monto = data.get('monto')
         monto_pagado = data.get('monto_pagado', 0)
         saldo = monto - monto_pagado
@@ -590,12 +1988,18 @@ def actualizar_cuenta_por_cobrar(id):
 @app.route('/api/cuentas-por-cobrar/<int:id>', methods=['DELETE'])
 def eliminar_cuenta_por_cobrar(id):
     conn = get_db_connection()
+    try:
+        proteger_periodo(conn, 'cuentas_por_cobrar', id)
+    except PeriodoCerrado as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 409
     conn.execute('DELETE FROM cuentas_por_cobrar WHERE id = ?', (id,))
     conn.commit()
     conn.close()
     return jsonify({'mensaje': 'Cuenta por cobrar eliminada'})
 
 @app.route('/api/cuentas-por-cobrar/stats', methods=['GET'])
+@condicional('cuentas_por_cobrar')
 def estadisticas_cuentas_por_cobrar():
     conn = get_db_connection()
     
@@ -612,7 +2016,7 @@ def estadisticas_cuentas_por_cobrar():
     facturas_vencidas = vencidas_result[0] or 0
     
     # Total de facturas
-    total_facturas_result = conn.execute('SELECT COUNT(*) FROM cuentas_por_cobrar').fetchone()
+    total_facturas_result = conn.execute(f"SELECT COUNT(*) FROM {fuente('cuentas_por_cobrar')}").fetchone()
     total_facturas = total_facturas_result[0] or 0
     
     conn.close()
@@ -628,6 +2032,7 @@ def estadisticas_cuentas_por_cobrar():
 def marcar_cuenta_como_pagada(id):
     conn = get_db_connection()
     cursor = conn.cursor()
+    generacion = generacion_contadores()
     
     try:
         # Obtener cuenta actual
@@ -661,6 +2066,17 @@ def marcar_cuenta_como_pagada(id):
         
         conn.commit()
         conn.close()
+        
+        if cuenta['estado'] == 'pendiente':
+            ajustar_contadores(generacion, total_por_cobrar=-(cuenta['saldo'] or 0))
+        publicar_evento('cuenta_cobrar_pagada', {
+            'cuenta_id': id,
+            'numero_factura': cuenta['numero_factura'],
+            'cliente_id': cuenta['cliente_id'],
+            'venta_id': cuenta['venta_id'],
+            'pedido_id': cuenta['pedido_id'],
+            'monto': cuenta['monto']
+        })
         return jsonify({
             'mensaje': 'Cuenta marcada como pagada',
             'venta_actualizada': bool(cuenta['venta_id']),
@@ -672,20 +2088,98 @@ def marcar_cuenta_como_pagada(id):
         conn.close()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cuentas-por-cobrar/marcar-pagado', methods=['PUT'])
+def marcar_cuentas_como_pagadas_batch():
+    """Marcar muchas cuentas por cobrar como pagadas, con cascada a ventas y pedidos"""
+    try:
+        ids = ids_del_body(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    ids_json = json.dumps(ids)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    generacion = generacion_contadores()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cuentas = {fila['id']: fila for fila in cursor.execute('''
+            SELECT id, estado, saldo, venta_id, pedido_id FROM cuentas_por_cobrar
+            WHERE id IN (SELECT value FROM json_each(?))
+        ''', (ids_json,)).fetchall()}
+        
+        # Igual que la versión individual, pero con una sentencia por tabla
+        cursor.execute('''
+            UPDATE cuentas_por_cobrar 
+            SET monto_pagado = monto, saldo = 0, estado = 'pagado'
+            WHERE id IN (SELECT value FROM json_each(?))
+        ''', (ids_json,))
+        cursor.execute('''
+            UPDATE ventas SET estado_pago = 'pagado'
+            WHERE id IN (SELECT venta_id FROM cuentas_por_cobrar
+                         WHERE id IN (SELECT value FROM json_each(?)) AND venta_id IS NOT NULL)
+        ''', (ids_json,))
+        ventas_actualizadas = cursor.rowcount
+        cursor.execute('''
+            UPDATE pedidos SET estado_pago = 'pagado'
+            WHERE id IN (SELECT pedido_id FROM cuentas_por_cobrar
+                         WHERE id IN (SELECT value FROM json_each(?)) AND pedido_id IS NOT NULL)
+        ''', (ids_json,))
+        pedidos_actualizados = cursor.rowcount
+        
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+    
+    resultados = []
+    pagadas = []
+    for cuenta_id in ids:
+        cuenta = cuentas.get(cuenta_id)
+        if cuenta is None:
+            resultado = 'no_encontrada'
+        elif cuenta['estado'] == 'pagado':
+            resultado = 'ya_pagada'
+        else:
+            resultado = 'pagada'
+            pagadas.append(cuenta_id)
+        resultados.append({'id': cuenta_id, 'resultado': resultado})
+    
+    saldo_pendiente = sum(cuentas[c]['saldo'] or 0 for c in pagadas if cuentas[c]['estado'] == 'pendiente')
+    ajustar_contadores(generacion, total_por_cobrar=-saldo_pendiente)
+    if pagadas:
+        publicar_evento('cuentas_cobrar_pagadas', {'cuenta_ids': pagadas})
+    
+    return jsonify({
+        'mensaje': f'{len(pagadas)} cuentas marcadas como pagadas',
+        'ventas_actualizadas': ventas_actualizadas,
+        'pedidos_actualizados': pedidos_actualizados,
+        'resultados': resultados
+    })
+
 # -------------------- RUTAS PARA CUENTAS POR PAGAR --------------------
 @app.route('/api/cuentas-por-pagar', methods=['GET'])
+@condicional('cuentas_por_pagar')
 def get_cuentas_por_pagar():
+    try:
+        desde, hasta = rango_fechas()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    condiciones, params = filtro_rango('fecha_creacion', desde, hasta)
     conn = get_db_connection()
-    cuentas = conn.execute('''
+    cuentas = consultar_dicts(conn, f'''
         SELECT *
-        FROM cuentas_por_pagar
+        FROM {fuente('cuentas_por_pagar', desde, hasta)}
+        {'WHERE ' + ' AND '.join(condiciones) if condiciones else ''}
         ORDER BY fecha_vencimiento ASC
-    ''').fetchall()
+    ''', params)
     
     # Calcular días vencidos para cada cuenta
     cuentas_con_datos = []
     for cuenta in cuentas:
-        cuenta_dict = dict(cuenta)
+        cuenta_dict = cuenta
         
         # Calcular días vencidos
         from datetime import datetime, date
@@ -707,7 +2201,7 @@ def get_cuentas_por_pagar():
         cuentas_con_datos.append(cuenta_dict)
     
     conn.close()
-    return jsonify(cuentas_con_datos)
+    return respuesta_json(cuentas_con_datos)
 
 @app.route('/api/cuentas-por-pagar', methods=['POST'])
 def crear_cuenta_por_pagar():
@@ -802,7 +2296,8 @@ def actualizar_cuenta_por_pagar(id):
             ''', (nuevo_monto_pagado, nuevo_saldo, nuevo_estado, fecha_pago, 
                   data.get('descripcion', cuenta_actual['descripcion']), id))
         else:
-            # Actualización completa
+            # Actualización completa (los pagos no cambian los agregados de un periodo cerrado)
+            proteger_periodo(conn, 'cuentas_por_pagar', id)
             monto = data.get('monto')
             monto_pagado = data.get('monto_pagado', 0)
             saldo = monto - monto_pagado
@@ -822,6 +2317,10 @@ def actualizar_cuenta_por_pagar(id):
         conn.close()
         return jsonify({'mensaje': 'Cuenta por pagar actualizada'})
         
+    except PeriodoCerrado as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         conn.rollback()
         conn.close()
@@ -830,12 +2329,18 @@ def actualizar_cuenta_por_pagar(id):
 @app.route('/api/cuentas-por-pagar/<int:id>', methods=['DELETE'])
 def eliminar_cuenta_por_pagar(id):
     conn = get_db_connection()
+    try:
+        proteger_periodo(conn, 'cuentas_por_pagar', id)
+    except PeriodoCerrado as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 409
     conn.execute('DELETE FROM cuentas_por_pagar WHERE id = ?', (id,))
     conn.commit()
     conn.close()
     return jsonify({'mensaje': 'Cuenta por pagar eliminada'})
 
 @app.route('/api/cuentas-por-pagar/stats', methods=['GET'])
+@condicional('cuentas_por_pagar')
 def estadisticas_cuentas_por_pagar():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -879,6 +2384,7 @@ def estadisticas_cuentas_por_pagar():
 def marcar_cuenta_por_pagar_como_pagada(id):
     conn = get_db_connection()
     cursor = conn.cursor()
+    generacion = generacion_contadores()
     
     try:
         # Obtener cuenta actual
@@ -891,27 +2397,100 @@ def marcar_cuenta_por_pagar_como_pagada(id):
         cursor.execute('''
             UPDATE cuentas_por_pagar 
             SET monto_pagado = monto, saldo = 0, estado = 'pagado', fecha_pago = ?
-            WHERE id = ?
-        ''', (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), id))
-        
+            WHERE id = ?
+        ''', (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), id))
+        
+        conn.commit()
+        conn.close()
+        
+        if cuenta['estado'] == 'pendiente':
+            vencida = (cuenta['fecha_vencimiento'] or '') < datetime.now().strftime('%Y-%m-%d')
+            ajustar_contadores(generacion, total_por_pagar=-(cuenta['saldo'] or 0),
+                               facturas_vencidas=-1 if vencida else 0)
+        publicar_evento('cuenta_pagar_pagada', {
+            'cuenta_id': id,
+            'codigo_factura': cuenta['codigo_factura'],
+            'proveedor': cuenta['proveedor'],
+            'monto': cuenta['monto']
+        })
+        return jsonify({'mensaje': 'Cuenta marcada como pagada'})
+        
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cuentas-por-pagar/marcar-pagado', methods=['PUT'])
+def marcar_cuentas_por_pagar_como_pagadas_batch():
+    """Marcar muchas cuentas por pagar como pagadas con un solo UPDATE"""
+    try:
+        ids = ids_del_body(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    ids_json = json.dumps(ids)
+    ahora = datetime.now()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    generacion = generacion_contadores()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cuentas = {fila['id']: fila for fila in cursor.execute('''
+            SELECT id, estado, saldo, fecha_vencimiento FROM cuentas_por_pagar
+            WHERE id IN (SELECT value FROM json_each(?))
+        ''', (ids_json,)).fetchall()}
+        cursor.execute('''
+            UPDATE cuentas_por_pagar 
+            SET monto_pagado = monto, saldo = 0, estado = 'pagado', fecha_pago = ?
+            WHERE id IN (SELECT value FROM json_each(?))
+        ''', (ahora.strftime("%Y-%m-%d %H:%M:%S"), ids_json))
         conn.commit()
         conn.close()
-        return jsonify({'mensaje': 'Cuenta marcada como pagada'})
-        
     except Exception as e:
         conn.rollback()
         conn.close()
         return jsonify({'error': str(e)}), 500
+    
+    resultados = []
+    pagadas = []
+    for cuenta_id in ids:
+        cuenta = cuentas.get(cuenta_id)
+        if cuenta is None:
+            resultado = 'no_encontrada'
+        elif cuenta['estado'] == 'pagado':
+            resultado = 'ya_pagada'
+        else:
+            resultado = 'pagada'
+            pagadas.append(cuenta_id)
+        resultados.append({'id': cuenta_id, 'resultado': resultado})
+    
+    hoy = ahora.strftime('%Y-%m-%d')
+    pendientes = [cuentas[c] for c in pagadas if cuentas[c]['estado'] == 'pendiente']
+    ajustar_contadores(generacion,
+                       total_por_pagar=-sum(c['saldo'] or 0 for c in pendientes),
+                       facturas_vencidas=-sum(1 for c in pendientes if (c['fecha_vencimiento'] or '') < hoy))
+    if pagadas:
+        publicar_evento('cuentas_pagar_pagadas', {'cuenta_ids': pagadas})
+    
+    return jsonify({
+        'mensaje': f'{len(pagadas)} cuentas marcadas como pagadas',
+        'resultados': resultados
+    })
 
 @app.route('/api/cuentas-por-cobrar/all', methods=['DELETE'])
 def delete_all_receivables():
     """Eliminar todas las cuentas por cobrar"""
     conn = get_db_connection()
     try:
+        proteger_periodo(conn, 'cuentas_por_cobrar')
         conn.execute('DELETE FROM cuentas_por_cobrar')
         conn.commit()
         conn.close()
         return jsonify({'mensaje': 'Todas las cuentas por cobrar han sido eliminadas'})
+    except PeriodoCerrado as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         conn.rollback()
         conn.close()
@@ -922,10 +2501,15 @@ def delete_all_payables():
     """Eliminar todas las cuentas por pagar"""
     conn = get_db_connection()
     try:
+        proteger_periodo(conn, 'cuentas_por_pagar')
         conn.execute('DELETE FROM cuentas_por_pagar')
         conn.commit()
         conn.close()
         return jsonify({'mensaje': 'Todas las cuentas por pagar han sido eliminadas'})
+    except PeriodoCerrado as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         conn.rollback()
         conn.close()
@@ -989,7 +2573,13 @@ def reset_database_for_production():
     SOLO PARA PRODUCCION - Resetea completamente la base de datos
     Borra todos los datos y reinicia secuencias en 1
     """
+    conn = None
     try:
+        # Respaldo verificado antes de borrar: si falla, no se resetea
+        respaldo = respaldar_tenant(tenant_actual())
+        if respaldo is None:
+            return jsonify({'error': 'Hay un respaldo en curso, intenta de nuevo en unos segundos'}), 409
+        
         conn = get_db_connection()
         cursor = conn.cursor()
         
@@ -1001,6 +2591,9 @@ def reset_database_for_production():
         cursor.execute('DELETE FROM productos')
         cursor.execute('DELETE FROM cuentas_por_cobrar')
         cursor.execute('DELETE FROM cuentas_por_pagar')
+        eliminar_archivo(cursor)
+        eliminar_cierres(cursor)
+        cursor.execute('DELETE FROM cliente_metricas')
         
         # RESETEAR SECUENCIAS AUTOINCREMENT
         cursor.execute('DELETE FROM sqlite_sequence WHERE name="ventas"')
@@ -1038,7 +2631,8 @@ def reset_database_for_production():
             'mensaje': 'Base de datos reseteada para producción exitosamente',
             'productos_creados': 5,
             'clientes_creados': 3,
-            'secuencias_reiniciadas': ['clientes', 'productos', 'pedidos', 'ventas', 'cuentas_por_cobrar', 'cuentas_por_pagar']
+            'secuencias_reiniciadas': ['clientes', 'productos', 'pedidos', 'ventas', 'cuentas_por_cobrar', 'cuentas_por_pagar'],
+            'respaldo': respaldo['archivo']
         })
         
     except Exception as e:
@@ -1050,7 +2644,7 @@ def reset_database_for_production():
 # -------------------- RUTA DE INICIALIZACIÓN --------------------
 @app.route('/api/init-db', methods=['POST'])
 def initialize_database():
-    init_db()
+    init_db(estado_tenant().ruta)
     return jsonify({'mensaje': 'Base de datos inicializada correctamente'})
 
 
@@ -1075,7 +2669,9 @@ def reset_sequences():
         
         # Verificar cada tabla
         for table in tables_to_check:
-            count = cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            # Las filas archivadas conservan sus ids: la tabla no está vacía si quedan en el archivo
+            origen = fuente(table) if table in TABLAS_CON_ARCHIVO else table
+            count = cursor.execute(f'SELECT COUNT(*) FROM {origen}').fetchone()[0]
             if count == 0:
                 tables_to_reset.append(table)
             else:
@@ -1123,8 +2719,9 @@ def reset_single_sequence(table_name):
         data = request.json if request.json else {}
         force = data.get('force', False)
         
-        # Verificar si la tabla tiene datos
-        count = cursor.execute(f'SELECT COUNT(*) FROM {table_name}').fetchone()[0]
+        # Verificar si la tabla tiene datos (incluidas las filas archivadas)
+        origen = fuente(table_name) if table_name in TABLAS_CON_ARCHIVO else table_name
+        count = cursor.execute(f'SELECT COUNT(*) FROM {origen}').fetchone()[0]
         
         if count > 0 and not force:
             conn.close()
@@ -1162,8 +2759,9 @@ def get_sequences_status():
         # Obtener conteo de registros por tabla
         status = []
         for seq_name, seq_value in sequences:
-            count = cursor.execute(f'SELECT COUNT(*) FROM {seq_name}').fetchone()[0]
-            max_id = cursor.execute(f'SELECT MAX(id) FROM {seq_name}').fetchone()[0] or 0
+            origen = fuente(seq_name) if seq_name in TABLAS_CON_ARCHIVO else seq_name
+            count = cursor.execute(f'SELECT COUNT(*) FROM {origen}').fetchone()[0]
+            max_id = cursor.execute(f'SELECT MAX(id) FROM {origen}').fetchone()[0] or 0
             
             status.append({
                 'tabla': seq_name,
@@ -1225,6 +2823,42 @@ def get_periodo_fechas(periodo):
     
     return inicio.strftime('%Y-%m-%d'), fin.strftime('%Y-%m-%d'), periodo_anterior_inicio.strftime('%Y-%m-%d'), periodo_anterior_fin.strftime('%Y-%m-%d')
 
+# Motor para las agregaciones de /api/reportes/*: 'sqlite' (por defecto) o 'duckdb'
+ANALITICA_MOTOR = os.getenv('ANALITICA_MOTOR', 'sqlite').lower()
+ANALITICA_DELTA_MAX_FILAS = int(os.getenv('ANALITICA_DELTA_MAX_FILAS', '20000'))
+# Espera inicial antes de reintentar tras un fallo del motor (se duplica hasta 5 minutos)
+ANALITICA_REINTENTO_SEGUNDOS = float(os.getenv('ANALITICA_REINTENTO_SEGUNDOS', '5'))
+
+# Réplica local de solo lectura (ver replica.py): con REPLICA_HABILITADA los
+# reportes y las exportaciones leen de una copia mantenida por changelog cada
+# REPLICA_INTERVALO_MS, y las escrituras siguen yendo a la base principal
+REPLICA_HABILITADA = os.getenv('REPLICA_HABILITADA', 'false').lower() == 'true'
+REPLICA_DIR = os.getenv('REPLICA_DIR', 'replicas')
+REPLICA_INTERVALO_MS = int(os.getenv('REPLICA_INTERVALO_MS', '500'))
+
+def get_conexion_lectura():
+    """Conexión para lecturas pesadas de solo lectura: la réplica del tenant si está
+    habilitada y disponible, si no la base principal"""
+    # Dentro de /api/batch se mantiene el snapshot SQLite compartido
+    if REPLICA_HABILITADA and g.get('conexion_batch') is None:
+        conn = estado_tenant().replica_lectura().conexion()
+        if conn is not None:
+            return conn
+    return get_db_connection()
+
+def get_conexion_reportes():
+    """
+    Conexión para los reportes: el snapshot DuckDB del tenant si ANALITICA_MOTOR=duckdb
+    y está disponible; si no, la réplica o la base SQLite (get_conexion_lectura). Las
+    consultas de los reportes usan SQL común a ambos motores (substr en lugar de
+    strftime/DATE).
+    """
+    if ANALITICA_MOTOR == 'duckdb' and g.get('conexion_batch') is None:
+        conn = estado_tenant().motor_analitico().conexion()
+        if conn is not None:
+            return conn
+    return get_conexion_lectura()
+
 def calcular_crecimiento(actual, anterior):
     """Calcula el porcentaje de crecimiento entre dos periodos"""
     if anterior == 0:
@@ -1233,18 +2867,21 @@ def calcular_crecimiento(actual, anterior):
 
 # -------------------- ENDPOINTS DE REPORTES --------------------
 @app.route('/api/reportes/dashboard', methods=['GET'])
+@condicional('ventas', 'pedidos', 'clientes')
+@coalescer()
 def get_reporte_dashboard():
     """Estadisticas para modulo reportes"""
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_conexion_reportes()
         cursor = conn.cursor()
         
-        # Ventas totales de TODA la tabla (sin filtro de fecha)
-        cursor.execute('SELECT COALESCE(SUM(total), 0) FROM ventas')
+        # Ventas totales de TODA la tabla (sin filtro de fecha, incluido el archivo;
+        # los meses cerrados salen de sus agregados congelados)
+        cursor.execute(f"SELECT COALESCE(SUM(total), 0) FROM {ventas_agregadas('producto_id')}")
         ventas_totales = cursor.fetchone()[0]
         
         # Total pedidos de TODA la tabla
-        cursor.execute('SELECT COUNT(*) FROM pedidos')
+        cursor.execute(f"SELECT COUNT(*) FROM {fuente('pedidos')}")
         total_pedidos = cursor.fetchone()[0]
         
         # Valor promedio
@@ -1278,19 +2915,21 @@ def get_reporte_dashboard():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/reportes/ingresos-tipo', methods=['GET'])
+@condicional('ventas', 'pedidos', 'productos')
+@coalescer()
 def get_ingresos_tipo():
     """Endpoint para ingresos por tipo GFX/VFX"""
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_conexion_reportes()
         cursor = conn.cursor()
         
-        # PRIMERO: Intentar con VENTAS
-        cursor.execute('''
+        # PRIMERO: Intentar con VENTAS (por producto, con los meses cerrados ya agregados)
+        cursor.execute(f'''
             SELECT 
                 UPPER(p.tipo) as tipo,
                 COALESCE(SUM(v.total), 0) as total_ingresos,
-                COUNT(v.id) as cantidad
-            FROM ventas v
+                SUM(v.num_ventas) as cantidad
+            FROM {ventas_agregadas('producto_id')} v
             JOIN productos p ON v.producto_id = p.id
             GROUP BY UPPER(p.tipo)
             ORDER BY total_ingresos DESC
@@ -1299,12 +2938,12 @@ def get_ingresos_tipo():
         
         # FALLBACK: Si no hay ventas, usar PEDIDOS
         if not ingresos_data:
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT 
                     UPPER(p.tipo) as tipo,
                     COALESCE(SUM(pe.total), 0) as total_ingresos,
                     COUNT(pe.id) as cantidad
-                FROM pedidos pe
+                FROM {fuente('pedidos')} pe
                 JOIN productos p ON pe.producto_id = p.id
                 GROUP BY UPPER(p.tipo)
                 ORDER BY total_ingresos DESC
@@ -1341,72 +2980,103 @@ def get_ingresos_tipo():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/reportes/tendencia', methods=['GET'])
+@condicional('ventas', 'pedidos', 'pedido_productos', 'productos')
+@coalescer()
 def get_tendencia():
     """Endpoint para tendencia temporal"""
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_conexion_reportes()
         cursor = conn.cursor()
         
         periodo = request.args.get('periodo', 'mes')
         
-        # Simplificamos para mostrar datos sin filtros de fecha complicados
+        # Simplificamos para mostrar datos sin filtros de fecha complicados. Se
+        # consulta primero solo la tabla activa: el archivo hace falta únicamente
+        # si los periodos devueltos no alcanzan a cubrir el límite (ver más abajo)
         if periodo == 'semana':
             # Agrupar por fecha simple
             query = '''
                 SELECT 
-                    DATE(v.fecha) as fecha,
+                    substr(v.fecha, 1, 10) as fecha,
                     COALESCE(SUM(CASE WHEN UPPER(p.tipo) = 'VFX' THEN v.total ELSE 0 END), 0) as vfx,
                     COALESCE(SUM(CASE WHEN UPPER(p.tipo) = 'GFX' THEN v.total ELSE 0 END), 0) as gfx,
                     COALESCE(SUM(v.total), 0) as total
-                FROM ventas v
+                FROM {ventas} v
                 JOIN productos p ON v.producto_id = p.id
-                GROUP BY DATE(v.fecha)
-                ORDER BY DATE(v.fecha) DESC
+                GROUP BY substr(v.fecha, 1, 10)
+                ORDER BY substr(v.fecha, 1, 10) DESC
                 LIMIT 7
             '''
         else:
             # Agrupar por mes (formato simple)
             query = '''
                 SELECT 
-                    strftime('%Y-%m', v.fecha) as mes,
+                    substr(v.fecha, 1, 7) as mes,
                     COALESCE(SUM(CASE WHEN UPPER(p.tipo) = 'VFX' THEN v.total ELSE 0 END), 0) as vfx,
                     COALESCE(SUM(CASE WHEN UPPER(p.tipo) = 'GFX' THEN v.total ELSE 0 END), 0) as gfx,
                     COALESCE(SUM(v.total), 0) as total
-                FROM ventas v
+                FROM {ventas} v
                 JOIN productos p ON v.producto_id = p.id
-                GROUP BY strftime('%Y-%m', v.fecha)
-                ORDER BY strftime('%Y-%m', v.fecha) DESC
+                GROUP BY substr(v.fecha, 1, 7)
+                ORDER BY substr(v.fecha, 1, 7) DESC
                 LIMIT 6
             '''
         
-        cursor.execute(query)
+        cerrados = periodo != 'semana' and estado_tenant().periodos_cerrados()[0] is not None
+        if cerrados:
+            # Los meses cerrados salen de sus agregados congelados (por mes y producto)
+            cursor.execute(f'''
+                SELECT 
+                    v.mes,
+                    COALESCE(SUM(CASE WHEN UPPER(p.tipo) = 'VFX' THEN v.total ELSE 0 END), 0) as vfx,
+                    COALESCE(SUM(CASE WHEN UPPER(p.tipo) = 'GFX' THEN v.total ELSE 0 END), 0) as gfx,
+                    COALESCE(SUM(v.total), 0) as total
+                FROM {ventas_agregadas('producto_id', por_mes=True)} v
+                JOIN productos p ON v.producto_id = p.id
+                GROUP BY v.mes
+                ORDER BY v.mes DESC
+                LIMIT 6
+            ''')
+        else:
+            cursor.execute(query.format(ventas='ventas'))
         resultados = cursor.fetchall()
         
+        # Con ventas archivadas, los periodos más antiguos del resultado pueden estar
+        # incompletos (o faltar) si no son posteriores a la última venta archivada
+        archivadas = estado_tenant().particiones().get('ventas')
+        if archivadas and not cerrados:
+            limite = 7 if periodo == 'semana' else 6
+            ultima_archivada = max(fecha_max for _, _, fecha_max in archivadas)
+            mas_antiguo = (resultados[-1][0] or '') if resultados else ''
+            if len(resultados) < limite or mas_antiguo <= ultima_archivada[:len(mas_antiguo)]:
+                cursor.execute(query.format(ventas=fuente('ventas')))
+                resultados = cursor.fetchall()
+        
         # Si no hay ventas, usar pedidos como fallback
         if not resultados:
             if periodo == 'semana':
-                query_pedidos = '''
+                query_pedidos = f'''
                     SELECT 
                         DATE(p.fecha) as fecha,
                         COALESCE(SUM(CASE WHEN UPPER(pr.tipo) = 'VFX' THEN pp.assigned_payment ELSE 0 END), 0) as vfx,
                         COALESCE(SUM(CASE WHEN UPPER(pr.tipo) = 'GFX' THEN pp.assigned_payment ELSE 0 END), 0) as gfx,
                         COALESCE(SUM(pp.assigned_payment), 0) as total
-                    FROM pedidos p
-                    JOIN pedido_productos pp ON p.id = pp.pedido_id
+                    FROM {fuente('pedidos')} p
+                    JOIN {fuente('pedido_productos')} pp ON p.id = pp.pedido_id
                     JOIN productos pr ON pp.producto_id = pr.id
                     GROUP BY DATE(p.fecha)
                     ORDER BY DATE(p.fecha) DESC
                     LIMIT 7
                 '''
             else:
-                query_pedidos = '''
+                query_pedidos = f'''
                     SELECT 
                         strftime('%Y-%m', p.fecha) as mes,
                         COALESCE(SUM(CASE WHEN UPPER(pr.tipo) = 'VFX' THEN pp.assigned_payment ELSE 0 END), 0) as vfx,
                         COALESCE(SUM(CASE WHEN UPPER(pr.tipo) = 'GFX' THEN pp.assigned_payment ELSE 0 END), 0) as gfx,
                         COALESCE(SUM(pp.assigned_payment), 0) as total
-                    FROM pedidos p
-                    JOIN pedido_productos pp ON p.id = pp.pedido_id
+                    FROM {fuente('pedidos')} p
+                    JOIN {fuente('pedido_productos')} pp ON p.id = pp.pedido_id
                     JOIN productos pr ON pp.producto_id = pr.id
                     GROUP BY strftime('%Y-%m', p.fecha)
                     ORDER BY strftime('%Y-%m', p.fecha) DESC
@@ -1453,20 +3123,22 @@ def get_tendencia():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/reportes/productos-top', methods=['GET'])
+@condicional('ventas', 'pedidos', 'productos')
+@coalescer()
 def get_productos_top():
     """Endpoint para productos más vendidos"""
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_conexion_reportes()
         cursor = conn.cursor()
         
         # PRIMERO: Intentar con VENTAS (datos reales)
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT 
                 p.nombre,
                 p.tipo,
-                COUNT(v.id) as pedidos,
+                SUM(v.num_ventas) as pedidos,
                 COALESCE(SUM(v.total), 0) as ingresos
-            FROM ventas v
+            FROM {ventas_agregadas('producto_id')} v
             JOIN productos p ON v.producto_id = p.id
             GROUP BY p.id, p.nombre, p.tipo
             ORDER BY ingresos DESC
@@ -1476,13 +3148,13 @@ def get_productos_top():
         
         # FALLBACK: Si no hay ventas, usar PEDIDOS
         if not productos_data:
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT 
                     p.nombre,
                     p.tipo,
                     COUNT(pe.id) as pedidos,
                     COALESCE(SUM(pe.total), 0) as ingresos
-                FROM pedidos pe
+                FROM {fuente('pedidos')} pe
                 JOIN productos p ON pe.producto_id = p.id
                 GROUP BY p.id, p.nombre, p.tipo
                 ORDER BY ingresos DESC
@@ -1510,36 +3182,40 @@ def get_productos_top():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/reportes/clientes-top', methods=['GET'])
+@condicional('ventas', 'pedidos', 'clientes')
+@coalescer()
 def get_clientes_top():
     """Endpoint para mejores clientes"""
     try:
-        conn = sqlite3.connect('database.db')
+        # cliente_metricas vive en SQLite (primaria o réplica): el índice por ingresos
+        # devuelve los 10 primeros sin recorrer las ventas
+        conn = get_conexion_lectura()
         cursor = conn.cursor()
         
         # PRIMERO: Intentar con VENTAS (datos reales)
         cursor.execute('''
             SELECT 
                 c.nombre,
-                COUNT(v.id) as pedidos,
-                COALESCE(SUM(v.total), 0) as ingresos,
-                MAX(v.fecha) as ultimo_pedido
-            FROM ventas v
-            JOIN clientes c ON v.cliente_id = c.id
-            GROUP BY c.id, c.nombre
-            ORDER BY ingresos DESC
+                m.num_ventas as pedidos,
+                m.ingresos,
+                m.ultima_compra as ultimo_pedido
+            FROM cliente_metricas m
+            JOIN clientes c ON m.cliente_id = c.id
+            WHERE m.num_ventas > 0
+            ORDER BY m.ingresos DESC
             LIMIT 10
         ''')
         clientes_data = cursor.fetchall()
         
         # FALLBACK: Si no hay ventas, usar PEDIDOS
         if not clientes_data:
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT 
                     c.nombre,
                     COUNT(pe.id) as pedidos,
                     COALESCE(SUM(pe.total), 0) as ingresos,
                     MAX(pe.fecha) as ultimo_pedido
-                FROM pedidos pe
+                FROM {fuente('pedidos')} pe
                 JOIN clientes c ON pe.cliente_id = c.id
                 GROUP BY c.id, c.nombre
                 ORDER BY ingresos DESC
@@ -1581,7 +3257,11 @@ def exportar_reporte():
         
         # Obtener datos para todas las hojas
         inicio, fin, _, _ = get_periodo_fechas(periodo)
-        conn = get_db_connection()
+        conn = get_conexion_reportes()
+        # Solo se agregan las particiones de archivo que se solapan con el periodo
+        ventas = fuente('ventas', inicio, fin)
+        pedidos = fuente('pedidos', inicio, fin)
+        pedido_productos = fuente('pedido_productos', inicio, fin)
         
         # Hoja 1: Resumen general
         ws1 = wb.active
@@ -1599,39 +3279,39 @@ def exportar_reporte():
         ws1['B1'].fill = header_fill
         
         # Obtener datos del dashboard - PRIMERO INTENTAR CON VENTAS
-        dashboard_data = conn.execute('''
+        dashboard_data = conn.execute(f'''
             SELECT 
                 COALESCE(SUM(total), 0) as ventas_totales,
                 COUNT(*) as total_pedidos
-            FROM ventas 
+            FROM {ventas}
             WHERE fecha >= ? AND fecha <= ?
         ''', (inicio, fin)).fetchone()
         
         # FALLBACK: Si no hay ventas, usar pedidos
         if dashboard_data['total_pedidos'] == 0:
-            dashboard_data = conn.execute('''
+            dashboard_data = conn.execute(f'''
                 SELECT 
                     COALESCE(SUM(pp.assigned_payment), 0) as ventas_totales,
                     COUNT(DISTINCT p.id) as total_pedidos
-                FROM pedidos p
-                LEFT JOIN pedido_productos pp ON p.id = pp.pedido_id
+                FROM {pedidos} p
+                LEFT JOIN {pedido_productos} pp ON p.id = pp.pedido_id
                 WHERE p.fecha >= ? AND p.fecha <= ?
             ''', (inicio, fin)).fetchone()
             
         valor_promedio = dashboard_data['ventas_totales'] / dashboard_data['total_pedidos'] if dashboard_data['total_pedidos'] > 0 else 0
         
         # Clientes únicos - PRIMERO VENTAS, LUEGO PEDIDOS
-        nuevos_clientes_query = conn.execute('''
+        nuevos_clientes_query = conn.execute(f'''
             SELECT COUNT(DISTINCT cliente_id) as nuevos
-            FROM ventas 
+            FROM {ventas}
             WHERE fecha >= ? AND fecha <= ?
         ''', (inicio, fin)).fetchone()
         
         nuevos_clientes = nuevos_clientes_query['nuevos']
         if nuevos_clientes == 0:
-            nuevos_clientes_query = conn.execute('''
+            nuevos_clientes_query = conn.execute(f'''
                 SELECT COUNT(DISTINCT cliente_id) as nuevos
-                FROM pedidos 
+                FROM {pedidos}
                 WHERE fecha >= ? AND fecha <= ?
             ''', (inicio, fin)).fetchone()
             nuevos_clientes = nuevos_clientes_query['nuevos']
@@ -1655,11 +3335,11 @@ def exportar_reporte():
         ws2['C1'].font = header_font
         
         # Ingresos por tipo - PRIMERO VENTAS, LUEGO PEDIDOS
-        ingresos_tipo = conn.execute('''
+        ingresos_tipo = conn.execute(f'''
             SELECT 
                 p.tipo,
                 COALESCE(SUM(v.total), 0) as total_ingresos
-            FROM ventas v
+            FROM {ventas} v
             JOIN productos p ON v.producto_id = p.id
             WHERE v.fecha >= ? AND v.fecha <= ?
             GROUP BY p.tipo
@@ -1667,12 +3347,12 @@ def exportar_reporte():
         
         # FALLBACK: Si no hay datos en ventas, usar pedidos
         if not ingresos_tipo:
-            ingresos_tipo = conn.execute('''
+            ingresos_tipo = conn.execute(f'''
                 SELECT 
                     pr.tipo,
                     COALESCE(SUM(pp.assigned_payment), 0) as total_ingresos
-                FROM pedidos p
-                JOIN pedido_productos pp ON p.id = pp.pedido_id
+                FROM {pedidos} p
+                JOIN {pedido_productos} pp ON p.id = pp.pedido_id
                 JOIN productos pr ON pp.producto_id = pr.id
                 WHERE p.fecha >= ? AND p.fecha <= ?
                 GROUP BY pr.tipo
@@ -1698,13 +3378,13 @@ def exportar_reporte():
             ws3[col].font = header_font
         
         # Productos top - PRIMERO VENTAS, LUEGO PEDIDOS
-        productos_top = conn.execute('''
+        productos_top = conn.execute(f'''
             SELECT 
                 p.nombre,
                 p.tipo,
                 COUNT(v.id) as pedidos,
                 COALESCE(SUM(v.total), 0) as ingresos
-            FROM ventas v
+            FROM {ventas} v
             JOIN productos p ON v.producto_id = p.id
             WHERE v.fecha >= ? AND v.fecha <= ?
             GROUP BY p.id, p.nombre, p.tipo
@@ -1714,14 +3394,14 @@ def exportar_reporte():
         
         # FALLBACK: Si no hay ventas, usar pedidos
         if not productos_top:
-            productos_top = conn.execute('''
+            productos_top = conn.execute(f'''
                 SELECT 
                     pr.nombre,
                     pr.tipo,
                     COUNT(p.id) as pedidos,
                     COALESCE(SUM(pp.assigned_payment), 0) as ingresos
-                FROM pedidos p
-                JOIN pedido_productos pp ON p.id = pp.pedido_id
+                FROM {pedidos} p
+                JOIN {pedido_productos} pp ON p.id = pp.pedido_id
                 JOIN productos pr ON pp.producto_id = pr.id
                 WHERE p.fecha >= ? AND p.fecha <= ?
                 GROUP BY pr.id, pr.nombre, pr.tipo
@@ -1750,13 +3430,13 @@ def exportar_reporte():
             ws4[col].font = header_font
         
         # Mejores clientes - PRIMERO VENTAS, LUEGO PEDIDOS
-        clientes_top = conn.execute('''
+        clientes_top = conn.execute(f'''
             SELECT 
                 c.nombre,
                 COUNT(v.id) as pedidos,
                 COALESCE(SUM(v.total), 0) as ingresos,
                 MAX(v.fecha) as ultimo_pedido
-            FROM ventas v
+            FROM {ventas} v
             JOIN clientes c ON v.cliente_id = c.id
             WHERE v.fecha >= ? AND v.fecha <= ?
             GROUP BY c.id, c.nombre
@@ -1766,14 +3446,14 @@ def exportar_reporte():
         
         # FALLBACK: Si no hay ventas, usar pedidos
         if not clientes_top:
-            clientes_top = conn.execute('''
+            clientes_top = conn.execute(f'''
                 SELECT 
                     c.nombre,
                     COUNT(p.id) as pedidos,
                     COALESCE(SUM(pp.assigned_payment), 0) as ingresos,
                     MAX(p.fecha) as ultimo_pedido
-                FROM pedidos p
-                LEFT JOIN pedido_productos pp ON p.id = pp.pedido_id
+                FROM {pedidos} p
+                LEFT JOIN {pedido_productos} pp ON p.id = pp.pedido_id
                 JOIN clientes c ON p.cliente_id = c.id
                 WHERE p.fecha >= ? AND p.fecha <= ?
                 GROUP BY c.id, c.nombre
@@ -1810,6 +3490,908 @@ def exportar_reporte():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# -------------------- BÚSQUEDA DE TEXTO COMPLETO (FTS5) --------------------
+BUSQUEDA_MAX_RESULTADOS = int(os.getenv('BUSQUEDA_MAX_RESULTADOS', '100'))
+
+# entidad -> expresión del título (las columnas 0 de clientes_fts/productos_fts son 'nombre')
+TITULOS_BUSQUEDA = {
+    'clientes': "highlight(clientes_fts, 0, '<b>', '</b>')",
+    'productos': "highlight(productos_fts, 0, '<b>', '</b>')",
+    'pedidos': "'Pedido #' || rowid",
+}
+
+def consulta_fts(texto):
+    """Convierte el texto del usuario en una consulta FTS5 segura; el último término es prefijo"""
+    terminos = [f'"{t}"' for t in re.findall(r'\w+', texto or '')]
+    if terminos:
+        # Solo el término que se está escribiendo va como prefijo: los prefijos largos
+        # sobre términos ya completos obligan a FTS5 a fusionar muchas listas
+        terminos[-1] += '*'
+    return ' '.join(terminos)
+
+@app.route('/api/buscar', methods=['GET'])
+@condicional('clientes', 'productos', 'pedidos')
+def buscar():
+    """Búsqueda ranqueada y paginada sobre clientes, productos y pedidos"""
+    consulta = consulta_fts(request.args.get('q'))
+    if not consulta:
+        return jsonify({'error': "Se esperaba un texto de búsqueda en 'q'"}), 400
+    
+    entidades = param_lista('entidades') or list(TABLAS_FTS)
+    invalidas = [e for e in entidades if e not in TABLAS_FTS]
+    if invalidas:
+        return jsonify({'error': f'Entidades inválidas: {", ".join(invalidas)}'}), 400
+    
+    limite = min(request.args.get('limit', 20, type=int), BUSQUEDA_MAX_RESULTADOS)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    
+    conn = get_db_connection()
+    try:
+        # Cada tabla FTS devuelve solo sus mejores offset+limit filas (ORDER BY rank
+        # usa el bm25 ponderado configurado en models.create_fts); luego se mezclan
+        por_entidad = []
+        total = 0
+        for entidad in entidades:
+            fts = f'{entidad}_fts'
+            filas = conn.execute(f'''
+                SELECT rowid, rank, {TITULOS_BUSQUEDA[entidad]},
+                       snippet({fts}, -1, '<b>', '</b>', '…', 12)
+                FROM {fts} WHERE {fts} MATCH ?
+                ORDER BY rank LIMIT ?
+            ''', (consulta, offset + limite)).fetchall()
+            por_entidad.append([(fila[1], entidad, fila[0], fila[2], fila[3]) for fila in filas])
+            total += conn.execute(f'SELECT COUNT(*) FROM {fts} WHERE {fts} MATCH ?', (consulta,)).fetchone()[0]
+        conn.close()
+    except sqlite3.OperationalError as e:
+        conn.close()
+        return jsonify({'error': f'Consulta inválida: {e}'}), 400
+    
+    mejores = list(heapq.merge(*por_entidad))[offset:offset + limite]
+    return respuesta_json({
+        'q': request.args.get('q'),
+        'total': total,
+        'limit': limite,
+        'offset': offset,
+        'resultados': [
+            {'entidad': entidad, 'id': fila_id, 'titulo': titulo, 'fragmento': fragmento, 'rank': rank}
+            for rank, entidad, fila_id, titulo, fragmento in mejores
+        ]
+    })
+
+# -------------------- EXPORTACIÓN MASIVA (NDJSON / CSV) --------------------
+EXPORT_CHUNK_FILAS = int(os.getenv('EXPORT_CHUNK_FILAS', '2000'))
+
+# entidad -> (consulta base, columna de fecha para desde/hasta). {tabla} se
+# reemplaza por la tabla activa más las particiones de archivo del rango
+ENTIDADES_EXPORTABLES = {
+    'ventas': ('SELECT * FROM {ventas}', 'fecha'),
+    'pedidos': ('SELECT * FROM {pedidos}', 'fecha'),
+    'pedido-productos': ('''
+        SELECT pp.*, p.fecha AS pedido_fecha
+        FROM {pedido_productos} pp
+        JOIN {pedidos} p ON pp.pedido_id = p.id
+    ''', 'p.fecha'),
+    'clientes': ('SELECT * FROM clientes', None),
+    'productos': ('SELECT * FROM productos', None),
+    'cuentas-por-cobrar': ('SELECT * FROM {cuentas_por_cobrar}', 'fecha_creacion'),
+    'cuentas-por-pagar': ('SELECT * FROM {cuentas_por_pagar}', 'fecha_creacion'),
+}
+
+def validar_fecha(valor, nombre):
+    """Normaliza un parámetro YYYY-MM-DD opcional; ValueError si es inválido"""
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"'{nombre}' debe tener formato YYYY-MM-DD")
+
+def _generar_exportacion(conn, sql, params, formato):
+    """Generador que recorre el cursor con fetchmany y produce bytes por lotes"""
+    try:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        columnas = [d[0] for d in cursor.description]
+        
+        if formato == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columnas)
+            yield buffer.getvalue().encode('utf-8')
+        
+        while True:
+            filas = cursor.fetchmany(EXPORT_CHUNK_FILAS)
+            if not filas:
+                break
+            if formato == 'csv':
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(filas)
+                yield buffer.getvalue().encode('utf-8')
+            else:
+                yield b''.join(dumps_json(dict(zip(columnas, fila))) + b'\n' for fila in filas)
+    finally:
+        conn.close()
+
+@app.route('/api/export/<string:entidad>', methods=['GET'])
+def exportar_entidad(entidad):
+    """Exportar una entidad completa en streaming (memoria constante)"""
+    if entidad not in ENTIDADES_EXPORTABLES:
+        return jsonify({'error': f'Entidad inválida. Entidades válidas: {", ".join(ENTIDADES_EXPORTABLES)}'}), 400
+    
+    formato = request.args.get('formato', 'ndjson')
+    if formato not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Formato inválido. Formatos válidos: ndjson, csv'}), 400
+    
+    try:
+        desde, hasta = rango_fechas()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    sql, columna_fecha = ENTIDADES_EXPORTABLES[entidad]
+    if not columna_fecha and (desde or hasta):
+        return jsonify({'error': f'La entidad {entidad} no admite filtro por fecha'}), 400
+    condiciones, params = filtro_rango(columna_fecha, desde, hasta)
+    # Las tablas archivables se leen junto con las particiones de archivo del rango
+    sql = sql.format(**{tabla: fuente(tabla, desde, hasta) for tabla in TABLAS_CON_ARCHIVO})
+    
+    if condiciones:
+        sql += ' WHERE ' + ' AND '.join(condiciones)
+    # Sin ORDER BY: las filas salen en el orden del recorrido (por id, o por fecha
+    # con rango) y ordenarlas obligaría a leer todo el rango antes del primer byte
+    
+    mimetype = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    nombre = f"{entidad}_{datetime.now().strftime('%Y%m%d')}.{formato}"
+    return Response(
+        # La conexión se abre aquí: el generador corre fuera del contexto de la petición
+        _generar_exportacion(get_conexion_lectura(), sql, params, formato),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={nombre}'}
+    )
+
+# -------------------- IMPORTACIÓN MASIVA (CSV / XLSX) --------------------
+IMPORT_CHUNK_FILAS = int(os.getenv('IMPORT_CHUNK_FILAS', '5000'))
+IMPORT_MAX_ERRORES = int(os.getenv('IMPORT_MAX_ERRORES', '1000'))
+
+@app.route('/api/import/<string:entidad>', methods=['POST'])
+def importar_entidad(entidad):
+    """Importar clientes, productos o ventas desde un CSV/XLSX subido (campo 'archivo')"""
+    if entidad not in ESQUEMAS_IMPORTACION:
+        return jsonify({'error': f'Entidad inválida. Entidades válidas: {", ".join(ESQUEMAS_IMPORTACION)}'}), 400
+    
+    archivo = request.files.get('archivo')
+    if archivo is None:
+        return jsonify({'error': "Se esperaba un archivo en el campo 'archivo'"}), 400
+    
+    formato = request.args.get('formato') or formato_de_archivo(archivo.filename)
+    if formato not in FORMATOS_IMPORTACION:
+        return jsonify({'error': f'Formato inválido. Formatos válidos: {", ".join(FORMATOS_IMPORTACION)}'}), 400
+    
+    diferir_indices = request.args.get('diferir_indices', '1') != '0'
+    separador_decimal = request.args.get('separador_decimal') or None
+    if separador_decimal not in (None,) + SEPARADORES_DECIMALES:
+        return jsonify({'error': f"Separador decimal inválido. Separadores válidos: {', '.join(SEPARADORES_DECIMALES)}"}), 400
+    delimitador = request.args.get('delimitador') or None
+    if delimitador not in (None,) + DELIMITADORES_CSV:
+        return jsonify({'error': f"Delimitador inválido. Delimitadores válidos: {', '.join(map(repr, DELIMITADORES_CSV))}"}), 400
+    
+    conn = get_db_connection()
+    try:
+        resumen = importar(conn, entidad, leer_filas(archivo.stream, formato, delimitador),
+                           chunk=IMPORT_CHUNK_FILAS, max_errores=IMPORT_MAX_ERRORES,
+                           diferir_indices=diferir_indices, bloquear_cerrados=CIERRE_BLOQUEAR_EDICIONES,
+                           separador_decimal=separador_decimal)
+        conn.close()
+        print(f"📥 Importación {entidad}: {resumen['insertadas']} filas en {resumen['segundos']}s "
+              f"({resumen['filas_por_segundo']} filas/s, {resumen['rechazadas']} rechazadas)")
+        return jsonify(resumen), 201 if resumen['insertadas'] else 200
+    except Exception as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+# -------------------- SNAPSHOTS COLUMNARES (PARQUET) --------------------
+# Copia Parquet particionada por mes de las tablas de hechos en
+# SNAPSHOTS_DIR/<tenant>, para análisis offline sin consultar la base en vivo.
+# Se genera con POST /api/snapshots, con el CLI snapshots_columnar.py (cron) o
+# cada SNAPSHOTS_INTERVALO_MINUTOS en un hilo del servidor (0 = deshabilitado)
+SNAPSHOTS_DIR = os.getenv('SNAPSHOTS_DIR', 'snapshots')
+SNAPSHOTS_INTERVALO_MINUTOS = int(os.getenv('SNAPSHOTS_INTERVALO_MINUTOS', '0'))
+_snapshot_locks = {}  # tenant -> Lock (sobrevive a la expulsión del tenant del LRU)
+
+def snapshot_tenant(tenant, completo=False):
+    """Genera el snapshot de un tenant; None si ya hay una corrida en curso"""
+    lock = _snapshot_locks.setdefault(tenant, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        return generar_snapshot(ruta_tenant(tenant), os.path.join(SNAPSHOTS_DIR, tenant), completo=completo)
+    finally:
+        lock.release()
+
+def snapshot_programado(tenant):
+    resultado = snapshot_tenant(tenant)
+    if resultado:
+        filas = sum(t['filas_escritas'] for t in resultado['tablas'].values())
+        print(f"🗂️ Snapshot de {tenant}: {filas} filas escritas en {resultado['segundos']}s")
+
+@app.route('/api/snapshots', methods=['POST'])
+def crear_snapshot():
+    """Agregar al snapshot Parquet las filas nuevas (?completo=1 lo reescribe)"""
+    try:
+        resultado = snapshot_tenant(tenant_actual(), completo=request.args.get('completo') == '1')
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if resultado is None:
+        return jsonify({'error': 'Ya hay un snapshot en curso para este tenant'}), 409
+    return jsonify(resultado)
+
+@app.route('/api/snapshots', methods=['GET'])
+def get_snapshot():
+    """Estado del último snapshot Parquet del tenant"""
+    directorio = os.path.join(SNAPSHOTS_DIR, tenant_actual())
+    return jsonify({
+        'directorio': directorio,
+        'intervalo_minutos': SNAPSHOTS_INTERVALO_MINUTOS,
+        'en_curso': _snapshot_locks.get(tenant_actual(), threading.Lock()).locked(),
+        **leer_estado(directorio)
+    })
+
+# -------------------- RESPALDOS EN CALIENTE (API DE BACKUP DE SQLITE) --------------------
+# Copia consistente de la base de cada tenant en RESPALDOS_DIR/<tenant>, por pasos
+# de RESPALDOS_PAGINAS_POR_PASO páginas con una pausa entre pasos para no frenar
+# a los escritores. Se crean cada RESPALDOS_INTERVALO_MINUTOS, con POST
+# /api/backups y antes de /api/reset-database; se restauran con el CLI respaldos.py
+RESPALDOS_DIR = os.getenv('RESPALDOS_DIR', 'backups')
+RESPALDOS_INTERVALO_MINUTOS = int(os.getenv('RESPALDOS_INTERVALO_MINUTOS', '1440'))
+RESPALDOS_RETENER = int(os.getenv('RESPALDOS_RETENER', '7'))
+RESPALDOS_PAGINAS_POR_PASO = int(os.getenv('RESPALDOS_PAGINAS_POR_PASO', '256'))
+RESPALDOS_PAUSA_MS = int(os.getenv('RESPALDOS_PAUSA_MS', '5'))
+_respaldo_locks = {}  # tenant -> Lock
+_metricas_respaldos = {}  # tenant -> {'respaldos', 'errores', 'ultimo', 'ultimo_error'}
+
+def respaldo_en_curso(tenant):
+    lock = _respaldo_locks.get(tenant)
+    return lock is not None and lock.locked()
+
+def respaldar_tenant(tenant):
+    """Crea un respaldo verificado del tenant; None si ya hay uno en curso"""
+    lock = _respaldo_locks.setdefault(tenant, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return None
+    metricas = _metricas_respaldos.setdefault(tenant, {'respaldos': 0, 'errores': 0, 'ultimo': None, 'ultimo_error': None})
+    try:
+        manifiesto = crear_respaldo(ruta_tenant(tenant), os.path.join(RESPALDOS_DIR, tenant),
+                                    retener=RESPALDOS_RETENER, paginas=RESPALDOS_PAGINAS_POR_PASO,
+                                    pausa=RESPALDOS_PAUSA_MS / 1000)
+        metricas['respaldos'] += 1
+        metricas['ultimo'] = manifiesto
+        return manifiesto
+    except Exception as e:
+        metricas['errores'] += 1
+        metricas['ultimo_error'] = {'error': str(e), 'fecha': datetime.now().isoformat()}
+        raise
+    finally:
+        lock.release()
+
+def respaldo_programado(tenant):
+    manifiesto = respaldar_tenant(tenant)
+    if manifiesto:
+        print(f"💾 Respaldo de {tenant}: {manifiesto['archivo']} ({manifiesto['bytes'] / 1024 / 1024:.1f} MB, "
+              f"{manifiesto['segundos_total']}s)")
+
+def get_metricas_respaldos():
+    with _tenants_lock:
+        estados = list(_tenants.values())
+    return {
+        'intervalo_minutos': RESPALDOS_INTERVALO_MINUTOS,
+        'retener': RESPALDOS_RETENER,
+        'paginas_por_paso': RESPALDOS_PAGINAS_POR_PASO,
+        'por_tenant': _metricas_respaldos,
+        # Latencia de las peticiones servidas mientras corría un respaldo vs. el resto
+        'latencia': {estado.tenant: estado.metricas_latencia_respaldo() for estado in estados}
+    }
+
+@app.route('/api/backups', methods=['POST'])
+def crear_backup():
+    """Crear ahora un respaldo verificado de la base del tenant"""
+    try:
+        manifiesto = respaldar_tenant(tenant_actual())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if manifiesto is None:
+        return jsonify({'error': 'Ya hay un respaldo en curso para este tenant'}), 409
+    return jsonify(manifiesto), 201
+
+@app.route('/api/backups', methods=['GET'])
+def get_backups():
+    """Respaldos disponibles del tenant y métricas de los últimos respaldos"""
+    tenant = tenant_actual()
+    estado = _tenants.get(tenant)
+    return jsonify({
+        'directorio': os.path.join(RESPALDOS_DIR, tenant),
+        'en_curso': respaldo_en_curso(tenant),
+        'respaldos': listar_respaldos(os.path.join(RESPALDOS_DIR, tenant)),
+        'metricas': _metricas_respaldos.get(tenant),
+        'latencia': estado.metricas_latencia_respaldo() if estado else None
+    })
+
+# -------------------- ARCHIVO DE REGISTROS CERRADOS --------------------
+# Las ventas pagadas, los pedidos cerrados y pagados y las cuentas pagadas con más
+# de ARCHIVO_HORIZONTE_MESES se mueven a tablas <tabla>_archivo_<año> (ver
+# archivo.py). Los listados y exportaciones con ?desde/?hasta solo leen las
+# particiones que se solapan con el rango; sin rango, y en los reportes de todo el
+# historial, se leen todas (ver fuente()). Se ejecuta con POST
+# /api/archivo, con el CLI archivo.py o cada ARCHIVO_INTERVALO_MINUTOS (0 = deshabilitado)
+ARCHIVO_HORIZONTE_MESES = int(os.getenv('ARCHIVO_HORIZONTE_MESES', '24'))
+ARCHIVO_INTERVALO_MINUTOS = int(os.getenv('ARCHIVO_INTERVALO_MINUTOS', '0'))
+ARCHIVO_CHUNK_FILAS = int(os.getenv('ARCHIVO_CHUNK_FILAS', '5000'))
+_archivo_locks = {}  # tenant -> Lock
+
+def archivar_tenant(tenant, antes=None):
+    """Archiva los registros cerrados del tenant anteriores a `antes`; None si ya hay una corrida en curso"""
+    lock = _archivo_locks.setdefault(tenant, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        conn = sqlite3.connect(ruta_tenant(tenant))
+        try:
+            return archivar(conn, antes or horizonte_meses(ARCHIVO_HORIZONTE_MESES), chunk=ARCHIVO_CHUNK_FILAS)
+        finally:
+            conn.close()
+    finally:
+        lock.release()
+
+def archivo_programado(tenant):
+    resultado = archivar_tenant(tenant)
+    if resultado and resultado['movidas']:
+        filas = sum(sum(anios.values()) for anios in resultado['movidas'].values())
+        print(f"📦 Archivo de {tenant}: {filas} filas anteriores a {resultado['antes_de']} en {resultado['segundos']}s")
+
+@app.route('/api/archivo', methods=['POST'])
+def ejecutar_archivo():
+    """Archivar ahora los registros cerrados (?antes_de=YYYY-MM-DD, por defecto el horizonte configurado)"""
+    try:
+        antes = validar_fecha(request.args.get('antes_de'), 'antes_de')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        resultado = archivar_tenant(tenant_actual(), antes)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if resultado is None:
+        return jsonify({'error': 'Ya hay un archivo en curso para este tenant'}), 409
+    return jsonify(resultado)
+
+@app.route('/api/archivo', methods=['GET'])
+def get_archivo():
+    """Particiones de archivo del tenant"""
+    conn = get_db_connection()
+    particiones = consultar_dicts(conn, 'SELECT * FROM archivo_particiones ORDER BY tabla, anio')
+    conn.close()
+    return jsonify({
+        'horizonte_meses': ARCHIVO_HORIZONTE_MESES,
+        'antes_de': horizonte_meses(ARCHIVO_HORIZONTE_MESES),
+        'intervalo_minutos': ARCHIVO_INTERVALO_MINUTOS,
+        'en_curso': _archivo_locks.get(tenant_actual(), threading.Lock()).locked(),
+        'particiones': particiones
+    })
+
+# -------------------- CIERRE DE PERIODOS --------------------
+# Cerrar un mes congela sus agregados de ventas (por producto y por cliente) y de
+# cuentas por cobrar y por pagar (ver cierres.py); los reportes de todo el
+# historial leen los meses cerrados de esos agregados. Con
+# CIERRE_BLOQUEAR_EDICIONES las escrituras sobre filas de un mes cerrado se
+# rechazan con 409; si no, se permiten y el mes queda desactualizado (los
+# reportes lo recalculan desde las filas) hasta que se vuelva a cerrar
+CIERRE_BLOQUEAR_EDICIONES = os.getenv('CIERRE_BLOQUEAR_EDICIONES', 'true').lower() == 'true'
+_cierre_locks = {}  # tenant -> Lock
+
+def proteger_periodo(conn, tabla, id=None):
+    """Aplica CIERRE_BLOQUEAR_EDICIONES a una escritura sobre la fila `id` de `tabla` (o toda la tabla)"""
+    return verificar_periodo(conn, tabla, id, bloquear=CIERRE_BLOQUEAR_EDICIONES)
+
+@app.route('/api/periodos/cerrar', methods=['POST'])
+def cerrar_periodo():
+    """Cerrar todos los meses hasta ?hasta=YYYY-MM inclusive (por defecto el mes anterior)"""
+    try:
+        hasta = validar_mes(request.args.get('hasta') or mes_anterior())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if hasta >= datetime.now().strftime('%Y-%m'):
+        return jsonify({'error': 'Solo se pueden cerrar meses ya terminados'}), 400
+    
+    tenant = tenant_actual()
+    lock = _cierre_locks.setdefault(tenant, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return jsonify({'error': 'Ya hay un cierre en curso para este tenant'}), 409
+    try:
+        conn = sqlite3.connect(ruta_tenant(tenant))
+        try:
+            resultado = cerrar_periodos(conn, hasta)
+        finally:
+            conn.close()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        lock.release()
+    print(f"🔒 Periodos de {tenant} cerrados hasta {hasta}: "
+          f"{len(resultado['meses_calculados'])} meses calculados en {resultado['segundos']}s")
+    return jsonify(resultado)
+
+@app.route('/api/periodos/<string:mes>', methods=['DELETE'])
+def reabrir_periodo(mes):
+    """Reabrir un mes cerrado y todos los posteriores"""
+    try:
+        validar_mes(mes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    conn = get_db_connection()
+    try:
+        meses = reabrir_periodos(conn, mes)
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+    if not meses:
+        return jsonify({'error': f'El periodo {mes} no está cerrado'}), 404
+    return jsonify({'mensaje': f'{len(meses)} periodos reabiertos', 'meses': meses})
+
+@app.route('/api/periodos', methods=['GET'])
+def get_periodos():
+    """Periodos cerrados con sus agregados congelados"""
+    conn = get_db_connection()
+    corte = corte_cierre(conn)
+    periodos = listar_periodos(conn)
+    conn.close()
+    return jsonify({
+        'corte': corte,
+        'bloquear_ediciones': CIERRE_BLOQUEAR_EDICIONES,
+        'en_curso': _cierre_locks.get(tenant_actual(), threading.Lock()).locked(),
+        'periodos': periodos
+    })
+
+# -------------------- FLUJO DE CAJA PROYECTADO --------------------
+# Entradas y salidas de las cuentas abiertas por fecha de vencimiento (ver
+# flujo_caja.py); desde FLUJO_CAJA_NUMPY_MIN_FILAS cuentas se agregan con NumPy
+# si está instalado
+FLUJO_CAJA_MAX_DIAS = int(os.getenv('FLUJO_CAJA_MAX_DIAS', '730'))
+FLUJO_CAJA_NUMPY_MIN_FILAS = int(os.getenv('FLUJO_CAJA_NUMPY_MIN_FILAS', '20000'))
+
+@app.route('/api/finanzas/flujo-caja', methods=['GET'])
+@coalescer()
+def get_flujo_caja():
+    """Proyección de cobros y pagos (?dias=90&granularidad=semana&saldo_inicial=0&ponderar=false)"""
+    dias = request.args.get('dias', 90, type=int)
+    granularidad = request.args.get('granularidad', 'semana')
+    saldo_inicial = request.args.get('saldo_inicial', 0.0, type=float)
+    ponderar = request.args.get('ponderar', 'false').lower() == 'true'
+    if not 1 <= dias <= FLUJO_CAJA_MAX_DIAS:
+        return jsonify({'error': f"'dias' debe estar entre 1 y {FLUJO_CAJA_MAX_DIAS}"}), 400
+    if granularidad not in GRANULARIDADES:
+        return jsonify({'error': f'Granularidad inválida. Granularidades válidas: {", ".join(GRANULARIDADES)}'}), 400
+    
+    try:
+        conn = get_conexion_lectura()
+        try:
+            resultado = proyectar_flujo(conn, dias, granularidad, saldo_inicial, ponderar,
+                                        umbral_numpy=FLUJO_CAJA_NUMPY_MIN_FILAS)
+        finally:
+            conn.close()
+        return jsonify(resultado)
+    except Exception as e:
+        print(f"❌ Error en flujo de caja: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# -------------------- ESTADOS DE CUENTA POR CLIENTE --------------------
+# Ventas, pedidos y cuentas por cobrar de un cliente con su resumen (ver
+# estados_cuenta.py). El lote genera un XLSX por cliente con saldo pendiente en
+# ESTADOS_CUENTA_DIR/<tenant>/<fecha> usando ESTADOS_CUENTA_PROCESOS procesos
+# (0 = uno por núcleo)
+ESTADOS_CUENTA_DIR = os.getenv('ESTADOS_CUENTA_DIR', 'estados_cuenta')
+ESTADOS_CUENTA_PROCESOS = int(os.getenv('ESTADOS_CUENTA_PROCESOS', '0'))
+_estados_cuenta_locks = {}  # tenant -> Lock
+
+@app.route('/api/clientes/<int:id>/estado-cuenta', methods=['GET'])
+def get_estado_cuenta(id):
+    """Estado de cuenta de un cliente (?desde=&hasta=&formato=json|xlsx)"""
+    formato = request.args.get('formato', 'json')
+    if formato not in ('json', 'xlsx'):
+        return jsonify({'error': 'Formato inválido. Formatos válidos: json, xlsx'}), 400
+    try:
+        desde, hasta = rango_fechas()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        conn = get_conexion_lectura()
+        try:
+            estados = consultar_estados(conn, [id], estado_tenant().particiones(), desde, hasta)
+        finally:
+            conn.close()
+        if id not in estados:
+            return jsonify({'error': 'Cliente no encontrado'}), 404
+        if formato == 'json':
+            return respuesta_json(estados[id])
+        return send_file(
+            io.BytesIO(xlsx_estado_cuenta(estados[id])),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'estado_cuenta_{id}.xlsx'
+        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/estados-cuenta/lote', methods=['POST'])
+def generar_estados_cuenta():
+    """Generar los XLSX de todos los clientes con saldo pendiente (?desde=&hasta=)"""
+    try:
+        desde, hasta = rango_fechas()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    tenant = tenant_actual()
+    lock = _estados_cuenta_locks.setdefault(tenant, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return jsonify({'error': 'Ya hay un lote de estados de cuenta en curso para este tenant'}), 409
+    try:
+        directorio = os.path.join(ESTADOS_CUENTA_DIR, tenant, datetime.now().strftime('%Y-%m-%d'))
+        conn = get_conexion_lectura()
+        try:
+            resultado = generar_lote(conn, directorio, desde=desde, hasta=hasta,
+                                     procesos=ESTADOS_CUENTA_PROCESOS or None)
+        finally:
+            conn.close()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        lock.release()
+    print(f"🧾 Estados de cuenta de {tenant}: {resultado['clientes']} clientes con "
+          f"{resultado['procesos']} procesos en {resultado['segundos']}s")
+    return jsonify(resultado)
+
+# -------------------- SINCRONIZACIÓN INCREMENTAL (CHANGELOG) --------------------
+SYNC_MAX_CAMBIOS = int(os.getenv('SYNC_MAX_CAMBIOS', '5000'))
+CHANGELOG_RETENCION_DIAS = int(os.getenv('CHANGELOG_RETENCION_DIAS', '30'))
+
+def ultimo_seq_changelog(conn):
+    """Secuencia más alta asignada en el changelog (0 si nunca hubo cambios)"""
+    fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'").fetchone()
+    return fila[0] if fila else 0
+
+def cambios_desde(conn, desde, tablas, limite):
+    """
+    Cambios con seq > desde, compactados a la última operación por fila.
+    Devuelve ({tabla: {fila_id: op}}, último seq incluido, hay_mas).
+    """
+    marcadores = ','.join('?' * len(tablas))
+    filas = conn.execute(f'''
+        SELECT seq, tabla, fila_id, op FROM changelog
+        WHERE seq > ? AND tabla IN ({marcadores})
+        ORDER BY seq
+        LIMIT ?
+    ''', (desde, *tablas, limite + 1)).fetchall()
+    
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    por_tabla = {}
+    for seq, tabla, fila_id, op in filas:
+        por_tabla.setdefault(tabla, {})[fila_id] = op
+    hasta = filas[-1][0] if filas else desde
+    return por_tabla, hasta, hay_mas
+
+@app.route('/api/sync', methods=['GET'])
+@condicional(*TABLAS_CHANGELOG)
+def sincronizar():
+    """Upserts y deletes desde una secuencia dada (since=0 devuelve todo)"""
+    since = request.args.get('since', '0')
+    if not since.isdigit():
+        return jsonify({'error': "'since' debe ser un entero >= 0"}), 400
+    since = int(since)
+    
+    tablas = param_lista('tablas') or TABLAS_CHANGELOG
+    invalidas = [t for t in tablas if t not in TABLAS_CHANGELOG]
+    if invalidas:
+        return jsonify({'error': f'Tablas inválidas: {", ".join(invalidas)}. Tablas válidas: {", ".join(TABLAS_CHANGELOG)}'}), 400
+    
+    conn = get_db_connection()
+    try:
+        # Todas las lecturas en una misma transacción para ver un estado consistente
+        if not conn.in_transaction:
+            conn.execute('BEGIN')
+        actual = ultimo_seq_changelog(conn)
+        
+        if since > 0:
+            # Si el cliente pide un seq ya podado (o de otra base de datos) debe resincronizar
+            minimo = conn.execute('SELECT MIN(seq) FROM changelog').fetchone()[0]
+            primero_disponible = minimo if minimo is not None else actual + 1
+            if since > actual or since < primero_disponible - 1:
+                conn.rollback()
+                conn.close()
+                return jsonify({
+                    'error': 'La secuencia solicitada ya no está disponible, se requiere sincronización completa',
+                    'reiniciar': True,
+                    'hasta': actual
+                }), 410
+        
+        cambios = {}
+        if since == 0:
+            # Sincronización inicial: estado completo de cada tabla
+            for tabla in tablas:
+                cambios[tabla] = {'upserts': consultar_dicts(conn, f'SELECT * FROM {tabla}'), 'deletes': []}
+            hasta, hay_mas = actual, False
+        else:
+            por_tabla, hasta, hay_mas = cambios_desde(conn, since, tablas, SYNC_MAX_CAMBIOS)
+            if not hay_mas:
+                hasta = actual
+            for tabla, operaciones in por_tabla.items():
+                ids_vivos = [fila_id for fila_id, op in operaciones.items() if op != 'D']
+                upserts = consultar_dicts(conn, f'''
+                    SELECT * FROM {tabla} WHERE id IN (SELECT value FROM json_each(?))
+                ''', (json.dumps(ids_vivos),)) if ids_vivos else []
+                encontrados = {fila['id'] for fila in upserts}
+                # Una fila modificada que ya no existe se borró en un cambio posterior a esta página
+                deletes = [fila_id for fila_id in operaciones if fila_id not in encontrados]
+                cambios[tabla] = {'upserts': upserts, 'deletes': deletes}
+        
+        conn.rollback()
+        conn.close()
+        return respuesta_json({
+            'desde': since,
+            'hasta': hasta,
+            'hay_mas': hay_mas,
+            'completo': since == 0,
+            'cambios': cambios
+        })
+    
+    except Exception as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+# -------------------- EVENTOS EN VIVO (SERVER-SENT EVENTS) --------------------
+# Los dashboards abiertos se suscriben a /api/events y reciben eventos compactos
+# cuando se registra una venta, cambia el estado de un pedido o se paga una cuenta,
+# junto con los contadores del dashboard ya actualizados. Los contadores se
+# calculan una vez desde la base de datos y luego se ajustan con deltas.
+SSE_MAX_CLIENTES = int(os.getenv('SSE_MAX_CLIENTES', '50'))
+SSE_HEARTBEAT_SEGUNDOS = 15
+
+# Rutas que publican eventos y mantienen los contadores con deltas
+ENDPOINTS_CON_EVENTOS = {
+    'registrar_venta', 'actualizar_estado_pedido', 'actualizar_estado_pedidos_batch',
+    'marcar_cuenta_como_pagada', 'marcar_cuentas_como_pagadas_batch',
+    'marcar_cuenta_por_pagar_como_pagada', 'marcar_cuentas_por_pagar_como_pagadas_batch'
+}
+
+class _BrokerEventos:
+    """Pub/sub en memoria con un buffer de eventos recientes para reconexiones"""
+
+    def __init__(self, historial=200):
+        self.lock = threading.Lock()
+        self.suscriptores = set()
+        self.recientes = deque(maxlen=historial)
+        self.ultimo_id = 0
+
+    def suscribir(self):
+        with self.lock:
+            if len(self.suscriptores) >= SSE_MAX_CLIENTES:
+                return None
+            cola = queue.Queue(maxsize=100)
+            self.suscriptores.add(cola)
+            return cola
+
+    def desuscribir(self, cola):
+        with self.lock:
+            self.suscriptores.discard(cola)
+
+    def publicar(self, tipo, datos):
+        with self.lock:
+            self.ultimo_id += 1
+            evento = (self.ultimo_id, tipo, dumps_json(datos).decode('utf-8'))
+            self.recientes.append(evento)
+            for cola in list(self.suscriptores):
+                try:
+                    cola.put_nowait(evento)
+                except queue.Full:
+                    # Cliente demasiado lento: se desconecta y recupera con Last-Event-ID.
+                    # Nunca se bloquea con el lock tomado: se descarta un evento para
+                    # hacer lugar a la marca de cierre
+                    self.suscriptores.discard(cola)
+                    try:
+                        cola.get_nowait()
+                    except queue.Empty:
+                        pass
+                    try:
+                        cola.put_nowait(None)
+                    except queue.Full:
+                        pass
+
+    def desde(self, ultimo_visto):
+        with self.lock:
+            return [e for e in self.recientes if e[0] > ultimo_visto]
+
+def _calcular_contadores_dashboard(conn, estado):
+    cursor = conn.cursor()
+    hoy = datetime.now().strftime('%Y-%m-%d')
+    return {
+        'ganancias_totales': float(cursor.execute(
+            f"SELECT COALESCE(SUM(total), 0) FROM {ventas_agregadas('producto_id', estado=estado)}").fetchone()[0]),
+        'entregas_pendientes': cursor.execute(
+            'SELECT COUNT(*) FROM pedidos WHERE estado NOT IN (?, ?, ?)', ESTADOS_PEDIDO_CERRADOS).fetchone()[0],
+        'servicios_disponibles': cursor.execute('SELECT COUNT(*) FROM productos').fetchone()[0],
+        'total_por_pagar': float(cursor.execute(
+            "SELECT COALESCE(SUM(saldo), 0) FROM cuentas_por_pagar WHERE estado = 'pendiente'").fetchone()[0]),
+        'total_por_cobrar': float(cursor.execute(
+            "SELECT COALESCE(SUM(saldo), 0) FROM cuentas_por_cobrar WHERE estado = 'pendiente'").fetchone()[0]),
+        'facturas_vencidas': cursor.execute(
+            "SELECT COUNT(*) FROM cuentas_por_pagar WHERE estado = 'pendiente' AND fecha_vencimiento < ?",
+            (hoy,)).fetchone()[0]
+    }
+
+def contadores_dashboard(estado=None):
+    """Contadores actuales del tenant; se recalculan solo si se invalidaron o cambió el día"""
+    estado = estado or estado_tenant()
+    with estado.contadores_lock:
+        contadores = estado.contadores
+        hoy = datetime.now().date()
+        if contadores['valores'] is None or contadores['fecha'] != hoy:
+            conn = estado.conectar()
+            try:
+                contadores['valores'] = _calcular_contadores_dashboard(conn, estado)
+            finally:
+                conn.close()
+            contadores['fecha'] = hoy
+            contadores['generacion'] += 1
+        return dict(contadores['valores'])
+
+def generacion_contadores():
+    estado = estado_tenant()
+    with estado.contadores_lock:
+        return estado.contadores['generacion']
+
+def ajustar_contadores(generacion, **deltas):
+    """
+    Aplica deltas si nadie recalculó los contadores desde `generacion` (leída antes
+    del commit). Si se recalcularon en medio, podrían incluir ya el cambio o no:
+    se invalidan para recalcularlos en la próxima lectura.
+    """
+    estado = estado_tenant()
+    with estado.contadores_lock:
+        contadores = estado.contadores
+        if contadores['valores'] is None:
+            return
+        if contadores['generacion'] != generacion:
+            contadores['valores'] = None
+            return
+        for clave, delta in deltas.items():
+            contadores['valores'][clave] += delta
+
+def invalidar_contadores():
+    estado = estado_tenant()
+    with estado.contadores_lock:
+        estado.contadores['valores'] = None
+
+def publicar_evento(tipo, datos):
+    """Publica un evento con los contadores del dashboard (solo si hay suscriptores)"""
+    estado = estado_tenant()
+    if not estado.broker.suscriptores:
+        return
+    estado.broker.publicar(tipo, {**datos, 'contadores': contadores_dashboard(estado)})
+
+def _formatear_sse(evento):
+    id_evento, tipo, datos = evento
+    return f"id: {id_evento}\nevent: {tipo}\ndata: {datos}\n\n".encode('utf-8')
+
+@app.route('/api/events', methods=['GET'])
+def stream_eventos():
+    """Stream SSE con eventos de ventas, pedidos y pagos"""
+    # El generador corre fuera del contexto de la petición: se fija el tenant aquí
+    estado = estado_tenant()
+    broker = estado.broker
+    cola = broker.suscribir()
+    if cola is None:
+        return jsonify({'error': 'Demasiados clientes conectados al stream de eventos'}), 503
+    
+    ultimo_visto = request.headers.get('Last-Event-ID', '')
+    pendientes = broker.desde(int(ultimo_visto)) if ultimo_visto.isdigit() else []
+    
+    def generar():
+        try:
+            # Estado inicial para que el dashboard no tenga que consultar /api/dashboard/stats
+            inicial = dumps_json(contadores_dashboard(estado)).decode('utf-8')
+            yield f"retry: 3000\nevent: contadores\ndata: {inicial}\n\n".encode('utf-8')
+            for evento in pendientes:
+                yield _formatear_sse(evento)
+            while True:
+                try:
+                    evento = cola.get(timeout=SSE_HEARTBEAT_SEGUNDOS)
+                except queue.Empty:
+                    yield b': ping\n\n'
+                    continue
+                if evento is None:
+                    break
+                yield _formatear_sse(evento)
+        finally:
+            broker.desuscribir(cola)
+    
+    return Response(generar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# -------------------- BATCH DE LECTURAS --------------------
+BATCH_MAX_PETICIONES = int(os.getenv('BATCH_MAX_PETICIONES', '20'))
+
+# Endpoints que no pueden ejecutarse dentro de un batch (streaming, archivos, el propio batch)
+ENDPOINTS_NO_BATCH = {'stream_eventos', 'exportar_entidad', 'exportar_reporte', 'ejecutar_batch'}
+
+def _ejecutar_subpeticion(adaptador, ruta):
+    """Ejecuta un GET interno y devuelve (status, cuerpo)"""
+    try:
+        endpoint, view_args = adaptador.match(ruta.split('?', 1)[0], method='GET')
+    except NotFound:
+        return 404, {'error': 'Ruta no encontrada'}
+    except MethodNotAllowed:
+        return 405, {'error': 'Solo se permiten GET dentro de un batch'}
+    
+    if endpoint in ENDPOINTS_NO_BATCH:
+        return 400, {'error': f'{ruta} no puede ejecutarse dentro de un batch'}
+    
+    with app.test_request_context(ruta, method='GET'):
+        g.pop('firma_versiones', None)
+        try:
+            respuesta = app.make_response(app.view_functions[endpoint](**view_args))
+        except Exception as e:
+            return 500, {'error': str(e)}
+    
+    datos = respuesta.get_data()
+    if respuesta.is_json:
+        return respuesta.status_code, json.loads(datos) if datos else None
+    return respuesta.status_code, datos.decode('utf-8', errors='replace')
+
+@app.route('/api/batch', methods=['POST'])
+def ejecutar_batch():
+    """Ejecutar varios GET en una sola petición sobre una conexión y snapshot compartidos"""
+    data = request.json
+    peticiones = data.get('requests') if isinstance(data, dict) else data
+    if not isinstance(peticiones, list) or not peticiones:
+        return jsonify({'error': "Se esperaba una lista 'requests' con al menos una petición"}), 400
+    if len(peticiones) > BATCH_MAX_PETICIONES:
+        return jsonify({'error': f'Máximo {BATCH_MAX_PETICIONES} peticiones por batch'}), 400
+    
+    rutas = []
+    for peticion in peticiones:
+        ruta = peticion if isinstance(peticion, str) else (peticion or {}).get('path')
+        metodo = 'GET' if isinstance(peticion, str) else (peticion or {}).get('method', 'GET').upper()
+        if not isinstance(ruta, str) or not ruta.startswith('/api/'):
+            return jsonify({'error': f'Ruta inválida: {ruta!r}'}), 400
+        if metodo != 'GET':
+            return jsonify({'error': 'Solo se permiten GET dentro de un batch'}), 400
+        rutas.append(ruta)
+    
+    conn = get_db_connection()
+    try:
+        # Una transacción de lectura: todas las sub-peticiones ven el mismo estado
+        conn.execute('BEGIN')
+        conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone()
+        g.conexion_batch = _ConexionCompartida(conn)
+        
+        adaptador = app.url_map.bind('')
+        resultados = []
+        for ruta in rutas:
+            status, cuerpo = _ejecutar_subpeticion(adaptador, ruta)
+            resultados.append({'path': ruta, 'status': status, 'body': cuerpo})
+    finally:
+        g.pop('conexion_batch', None)
+        conn.rollback()
+        conn.close()
+    
+    return respuesta_json({'resultados': resultados})
+
 @app.route('/')
 def landing():
     """Landing page mientras se carga frontend"""
@@ -1861,10 +4443,12 @@ def landing():
     '''
 
 @app.route('/api/dashboard/stats', methods=['GET'])
+@condicional('ventas', 'pedidos', 'productos', 'clientes', 'cuentas_por_cobrar', 'cuentas_por_pagar')
+@coalescer()
 def get_dashboard_stats():
     """Estadisticas dashboard - DATOS REALES"""
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # Verificar si las tablas existen primero
@@ -1872,10 +4456,11 @@ def get_dashboard_stats():
         tables = [row[0] for row in cursor.fetchall()]
         print(f"📋 Tablas encontradas: {tables}")
         
-        # 1. Ganancias totales (suma de TODAS las ventas)
+        # 1. Ganancias totales (suma de TODAS las ventas, incluidas las archivadas y
+        # las de periodos cerrados)
         ganancias_totales = 0
         if 'ventas' in tables:
-            cursor.execute('SELECT COALESCE(SUM(total), 0) FROM ventas')
+            cursor.execute(f"SELECT COALESCE(SUM(total), 0) FROM {ventas_agregadas('producto_id')}")
             ganancias_totales = cursor.fetchone()[0]
         
         # 2. Entregas pendientes (pedidos NO completados)
@@ -1924,10 +4509,11 @@ def get_dashboard_stats():
         facturas_vencidas = 0
         if 'cuentas_por_pagar' in tables:
             try:
+                # Mismo día local que los contadores en vivo (date('now') de SQLite es UTC)
                 cursor.execute('''
                     SELECT COUNT(*) FROM cuentas_por_pagar 
-                    WHERE estado = "pendiente" AND fecha_vencimiento < date('now')
-                ''')
+                    WHERE estado = "pendiente" AND fecha_vencimiento < ?
+                ''', (datetime.now().strftime('%Y-%m-%d'),))
                 facturas_vencidas = cursor.fetchone()[0] or 0
             except Exception as e:
                 print(f"⚠️ Error calculando facturas vencidas: {str(e)}")
@@ -2016,7 +4602,7 @@ def debug_database():
 def system_diagnosis():
     """Diagnostico completo del sistema"""
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # Verificar todas las tablas y contenido
@@ -2100,6 +4686,26 @@ def system_diagnosis():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@app.route('/api/system/metricas', methods=['GET'])
+def system_metricas():
+    """Métricas internas de rendimiento del backend"""
+    return jsonify({
+        'coalescing': get_metricas_coalescing(),
+        'autocompletar': {entidad: indice.metricas() for entidad, indice in indices_autocompletar().items()},
+        'catalogo_productos': catalogo_productos().metricas(),
+        'analitica': {
+            'motor': ANALITICA_MOTOR,
+            **(estado_tenant().motor_analitico().metricas() if ANALITICA_MOTOR == 'duckdb' else {})
+        },
+        'replica': {
+            'habilitada': REPLICA_HABILITADA,
+            **(estado_tenant().replica_lectura().metricas() if REPLICA_HABILITADA else {})
+        },
+        'tenants': get_metricas_tenants(),
+        'respaldos': get_metricas_respaldos(),
+        'timestamp': datetime.now().isoformat()
+    })
+
 @app.route('/api/test')
 def api_test():
     """Endpoint de prueba para verificar funcionamiento"""
@@ -2115,7 +4721,24 @@ if __name__ == '__main__':
     if not verificar_variables_entorno():
         exit(1)
     
-    init_db()
+    # Migrar la base del tenant por defecto (init_db + poda del changelog); los
+    # demás tenants se migran en su primera petición
+    estado = estado_tenant(TENANT_DEFAULT)
+    
+    # Cargar los índices de autocompletado antes de recibir peticiones
+    for indice in estado.autocompletar.values():
+        indice.buscar('', 0)
+    
+    # Copiar la réplica de lectura antes del primer reporte
+    if REPLICA_HABILITADA:
+        estado.replica_lectura()
+    
+    if SNAPSHOTS_INTERVALO_MINUTOS > 0:
+        tarea_periodica(SNAPSHOTS_INTERVALO_MINUTOS, snapshot_programado)
+    if RESPALDOS_INTERVALO_MINUTOS > 0:
+        tarea_periodica(RESPALDOS_INTERVALO_MINUTOS, respaldo_programado)
+    if ARCHIVO_INTERVALO_MINUTOS > 0:
+        tarea_periodica(ARCHIVO_INTERVALO_MINUTOS, archivo_programado)
     
     # Configuracion simple para Render
     import os
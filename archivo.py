@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Archivo de registros cerrados: mueve las ventas pagadas, los pedidos cerrados
+y pagados (con sus líneas) y las cuentas pagadas anteriores a un horizonte a
+tablas de archivo por año (ventas_archivo_2023, pedidos_archivo_2023, ...) en
+la misma base. Las tablas activas quedan con el historial reciente y lo
+pendiente, y las consultas que necesitan un rango anterior al horizonte
+agregan las particiones con UNION ALL (ver union_archivo).
+
+Un registro solo se archiva junto con todo lo que lo referencia: un pedido
+se archiva cuando sus ventas y cuentas por cobrar también son archivables, y
+una venta o cuenta que apunta a un pedido que sigue activo se queda activa.
+
+Las filas se mueven en lotes de `chunk` ids, cada lote en su propia
+transacción. El borrado de la tabla activa dispara los triggers de siempre:
+versiones (ETag), changelog (los clientes de /api/sync las ven como borradas)
+y FTS (los pedidos archivados dejan de aparecer en /api/buscar). Los ids del
+lote quedan en archivo_lote mientras dura la transacción, para que los
+triggers de métricas por cliente distingan un archivo de un borrado.
+
+Uso:
+    python archivo.py --meses 24
+    python archivo.py --antes-de 2024-01-01 --db database.db
+"""
+
+import argparse
+import sqlite3
+import time
+from datetime import date
+
+ESTADOS_PEDIDO_CERRADOS = ('completado', 'entregado', 'finalizado')
+
+_CERRADOS = ', '.join(f"'{estado}'" for estado in ESTADOS_PEDIDO_CERRADOS)
+
+# tabla -> (columna de fecha, condición para archivar con :antes como horizonte).
+# El orden importa: los pedidos van primero para que sus ventas y cuentas ya
+# no apunten a un pedido activo
+TABLAS_ARCHIVABLES = {
+    'pedidos': ('fecha', f'''
+        t.fecha < :antes AND t.estado IN ({_CERRADOS})
+        AND (t.estado_pago = 'pagado' OR t.pago_realizado)
+        AND NOT EXISTS (SELECT 1 FROM ventas v WHERE v.pedido_id = t.id
+                        AND NOT (v.estado_pago = 'pagado' AND v.fecha < :antes))
+        AND NOT EXISTS (SELECT 1 FROM cuentas_por_cobrar c WHERE c.pedido_id = t.id
+                        AND NOT (c.estado = 'pagado' AND c.fecha_creacion < :antes))
+        AND (t.estado != 'completado' OR EXISTS (SELECT 1 FROM ventas v WHERE v.pedido_id = t.id))
+    '''),
+    'ventas': ('fecha', '''
+        t.fecha < :antes AND t.estado_pago = 'pagado'
+        AND (t.pedido_id IS NULL OR t.pedido_id NOT IN (SELECT id FROM pedidos))
+    '''),
+    'cuentas_por_cobrar': ('fecha_creacion', '''
+        t.fecha_creacion < :antes AND t.estado = 'pagado'
+        AND (t.pedido_id IS NULL OR t.pedido_id NOT IN (SELECT id FROM pedidos))
+        AND (t.venta_id IS NULL OR t.venta_id NOT IN (SELECT id FROM ventas))
+    '''),
+    'cuentas_por_pagar': ('fecha_creacion', '''
+        t.fecha_creacion < :antes AND t.estado = 'pagado'
+    '''),
+}
+
+# Tablas hijas que se archivan en la partición del año de su padre: hija -> (padre, fk)
+TABLAS_HIJAS_ARCHIVO = {
+    'pedido_productos': ('pedidos', 'pedido_id'),
+}
+
+# Tablas que pueden tener particiones de archivo
+TABLAS_CON_ARCHIVO = list(TABLAS_ARCHIVABLES) + list(TABLAS_HIJAS_ARCHIVO)
+
+def nombre_particion(tabla, anio):
+    return f'{tabla}_archivo_{int(anio)}'
+
+def horizonte_meses(meses, hoy=None):
+    """Primer día del mes de hace `meses` meses (YYYY-MM-DD)"""
+    hoy = hoy or date.today()
+    total = hoy.year * 12 + hoy.month - 1 - meses
+    return date(total // 12, total % 12 + 1, 1).isoformat()
+
+def particiones_archivo(conn):
+    """tabla -> [(nombre, fecha_min, fecha_max)] según el registro de particiones"""
+    particiones = {}
+    try:
+        filas = conn.execute('''
+            SELECT tabla, nombre, fecha_min, fecha_max FROM archivo_particiones
+            WHERE filas > 0 ORDER BY tabla, anio
+        ''').fetchall()
+    except sqlite3.OperationalError:
+        # Base sin migrar (sin registro de particiones)
+        return particiones
+    for tabla, nombre, fecha_min, fecha_max in filas:
+        particiones.setdefault(tabla, []).append((nombre, fecha_min, fecha_max))
+    return particiones
+
+def union_archivo(tabla, particiones, desde=None, hasta=None):
+    """Fuente para el FROM: la tabla activa sola, o un UNION ALL con las particiones
+    de archivo que se solapan con [desde, hasta] (fechas YYYY-MM-DD inclusivas)"""
+    nombres = [
+        nombre for nombre, fecha_min, fecha_max in particiones.get(tabla, [])
+        if (desde is None or fecha_max[:10] >= desde) and (hasta is None or fecha_min[:10] <= hasta)
+    ]
+    if not nombres:
+        return tabla
+    return '(' + ' UNION ALL '.join(f'SELECT * FROM {nombre}' for nombre in [tabla] + nombres) + ')'
+
+def firma_archivo(conn, esquema='main'):
+    """Cambia cada vez que una corrida de archivo mueve filas (para copias derivadas)"""
+    try:
+        return tuple(conn.execute(f'''
+            SELECT COUNT(*), COALESCE(SUM(filas), 0), COALESCE(MAX(actualizado), '')
+            FROM {esquema}.archivo_particiones
+        ''').fetchone())
+    except sqlite3.OperationalError:
+        return None
+
+def eliminar_archivo(conn):
+    """Elimina todas las particiones y vacía el registro (dentro de la transacción de `conn`)"""
+    for (nombre,) in conn.execute('SELECT nombre FROM archivo_particiones').fetchall():
+        conn.execute(f'DROP TABLE IF EXISTS {nombre}')
+    conn.execute('DELETE FROM archivo_particiones')
+
+def _crear_particion(conn, tabla, anio, columna_indice):
+    nombre = nombre_particion(tabla, anio)
+    # Mismas columnas y tipos declarados que la tabla activa (CREATE TABLE AS solo
+    # conserva la afinidad), sin restricciones: las filas llegan ya validadas
+    columnas = [f'{fila[1]} {fila[2]}' for fila in conn.execute(f'PRAGMA table_info({tabla})')]
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {nombre} ({", ".join(columnas)})')
+    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{nombre}_id ON {nombre}(id)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{nombre}_{columna_indice} ON {nombre}({columna_indice})')
+    return nombre
+
+def _registrar_particion(conn, tabla, anio, nombre, fecha_min, fecha_max):
+    filas = conn.execute(f'SELECT COUNT(*) FROM {nombre}').fetchone()[0]
+    conn.execute('''
+        INSERT INTO archivo_particiones (tabla, anio, nombre, filas, fecha_min, fecha_max, actualizado)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (tabla, anio) DO UPDATE SET
+            filas = excluded.filas,
+            fecha_min = MIN(COALESCE(fecha_min, excluded.fecha_min), excluded.fecha_min),
+            fecha_max = MAX(COALESCE(fecha_max, excluded.fecha_max), excluded.fecha_max),
+            actualizado = excluded.actualizado
+    ''', (tabla, anio, nombre, filas, fecha_min, fecha_max))
+
+def _mover_lote(conn, tabla, columna_fecha, condicion, antes, anio, chunk):
+    """Mueve hasta `chunk` filas archivables de un año; devuelve cuántas movió"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM archivo_lote')
+        conn.execute(f'''
+            INSERT INTO archivo_lote (tabla, id)
+            SELECT :tabla, t.id FROM {tabla} t
+            WHERE substr(t.{columna_fecha}, 1, 4) = :anio AND {condicion}
+            LIMIT :chunk
+        ''', {'tabla': tabla, 'antes': antes, 'anio': str(anio), 'chunk': chunk})
+        lote = f"(SELECT id FROM archivo_lote WHERE tabla = '{tabla}')"
+        movidas, fecha_min, fecha_max = conn.execute(f'''
+            SELECT COUNT(*), MIN({columna_fecha}), MAX({columna_fecha}) FROM {tabla}
+            WHERE id IN {lote}
+        ''').fetchone()
+        if not movidas:
+            conn.execute('ROLLBACK')
+            return 0
+
+        particion = _crear_particion(conn, tabla, anio, columna_fecha)
+        conn.execute(f'INSERT INTO {particion} SELECT * FROM {tabla} WHERE id IN {lote}')
+        for hija, (padre, fk) in TABLAS_HIJAS_ARCHIVO.items():
+            if padre != tabla:
+                continue
+            particion_hija = _crear_particion(conn, hija, anio, fk)
+            conn.execute(f'INSERT INTO {particion_hija} SELECT * FROM {hija} WHERE {fk} IN {lote}')
+            conn.execute(f'DELETE FROM {hija} WHERE {fk} IN {lote}')
+            _registrar_particion(conn, hija, anio, particion_hija, fecha_min, fecha_max)
+        conn.execute(f'DELETE FROM {tabla} WHERE id IN {lote}')
+        _registrar_particion(conn, tabla, anio, particion, fecha_min, fecha_max)
+        conn.execute('DELETE FROM archivo_lote')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return movidas
+
+def archivar(conn, antes, chunk=5000):
+    """Mueve a las particiones por año los registros cerrados anteriores a `antes`
+    (YYYY-MM-DD); devuelve {tabla: {año: filas movidas}} y la duración"""
+    nivel_aislamiento = conn.isolation_level
+    conn.isolation_level = None  # las transacciones se manejan a mano, una por lote
+    inicio = time.perf_counter()
+    movidas = {}
+    try:
+        for tabla, (columna_fecha, condicion) in TABLAS_ARCHIVABLES.items():
+            anios = [fila[0] for fila in conn.execute(f'''
+                SELECT DISTINCT substr(t.{columna_fecha}, 1, 4) FROM {tabla} t
+                WHERE {condicion}
+            ''', {'antes': antes}).fetchall() if fila[0] and fila[0].isdigit()]
+            for anio in sorted(anios):
+                total = 0
+                while True:
+                    lote = _mover_lote(conn, tabla, columna_fecha, condicion, antes, int(anio), chunk)
+                    total += lote
+                    if lote < chunk:
+                        break
+                if total:
+                    movidas.setdefault(tabla, {})[int(anio)] = total
+    finally:
+        conn.isolation_level = nivel_aislamiento
+    return {
+        'antes_de': antes,
+        'movidas': movidas,
+        'segundos': round(time.perf_counter() - inicio, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Archiva registros cerrados en tablas por año')
+    parser.add_argument('--db', default='database.db')
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument('--antes-de', help='Archivar lo anterior a esta fecha (YYYY-MM-DD)')
+    grupo.add_argument('--meses', type=int, default=24, help='Horizonte en meses (por defecto 24)')
+    parser.add_argument('--chunk', type=int, default=5000, help='Filas por transacción')
+    args = parser.parse_args()
+
+    antes = args.antes_de or horizonte_meses(args.meses)
+    conn = sqlite3.connect(args.db)
+    try:
+        resultado = archivar(conn, antes, chunk=args.chunk)
+    finally:
+        conn.close()
+
+    for tabla, anios in resultado['movidas'].items():
+        for anio, filas in anios.items():
+            print(f"OK {tabla} {anio}: {filas} filas archivadas")
+    print(f"Archivo hasta {antes} completado ({resultado['segundos']}s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los endpoints /api/reportes/* con el motor SQLite y con el motor
+analítico DuckDB (ANALITICA_MOTOR=duckdb) sobre el dataset sintético de
+generar_datos.py. Mide tiempo de pared por petición completa, sin cache de
+lecturas ni ETags, y verifica que ambos motores devuelvan lo mismo.
+
+Uso:
+    python benchmark_analitica.py
+    python benchmark_analitica.py --ventas 1000000 --repeticiones 10
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, RAIZ)
+
+from generar_datos import generar
+
+RUTAS = [
+    '/api/reportes/dashboard',
+    '/api/reportes/ingresos-tipo',
+    '/api/reportes/tendencia',
+    '/api/reportes/tendencia?periodo=semana',
+    '/api/reportes/productos-top',
+    '/api/reportes/clientes-top',
+]
+
+def medir(cliente, ruta, repeticiones):
+    """Mediana en milisegundos de `repeticiones` peticiones y el último cuerpo"""
+    tiempos = []
+    respuesta = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        respuesta = cliente.get(ruta)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos), respuesta.get_json()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de reportes: SQLite vs DuckDB')
+    parser.add_argument('--ventas', type=int, default=500000)
+    parser.add_argument('--clientes', type=int, default=5000)
+    parser.add_argument('--pedidos', type=int, default=20000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+    
+    directorio = tempfile.mkdtemp(prefix='bench_analitica_')
+    os.chdir(directorio)
+    # Sin cache de lecturas: cada petición ejecuta las consultas
+    os.environ['CACHE_TTL_SEGUNDOS'] = '0'
+    try:
+        print(f"Generando datos en {directorio} ...")
+        generar('database.db', clientes=args.clientes, pedidos=args.pedidos, ventas=args.ventas)
+        
+        import app as backend
+        import analitica
+        
+        backend.app.config['TESTING'] = True
+        cliente = backend.app.test_client()
+        
+        if analitica.duckdb is None:
+            print("\nduckdb no está instalado (pip install duckdb): solo se mide SQLite")
+        else:
+            # Carga inicial del snapshot (se paga una vez por proceso y tenant)
+            backend.ANALITICA_MOTOR = 'duckdb'
+            inicio = time.perf_counter()
+            cliente.get(RUTAS[0])
+            print(f"\nCarga inicial del snapshot DuckDB: {(time.perf_counter() - inicio) * 1000:.0f} ms")
+            if not backend.estado_tenant().motor_analitico().disponible():
+                print(f"Motor analítico no disponible: {backend.estado_tenant().motor_analitico().error}")
+        
+        print(f"{'endpoint':<42}{'sqlite ms':>11}{'duckdb ms':>11}{'x':>7}{'iguales':>9}")
+        for ruta in RUTAS:
+            backend.ANALITICA_MOTOR = 'sqlite'
+            sqlite_ms, esperado = medir(cliente, ruta, args.repeticiones)
+            if analitica.duckdb is None:
+                print(f"{ruta:<42}{sqlite_ms:>11.1f}{'-':>11}{'-':>7}{'-':>9}")
+                continue
+            backend.ANALITICA_MOTOR = 'duckdb'
+            duckdb_ms, obtenido = medir(cliente, ruta, args.repeticiones)
+            iguales = json.dumps(esperado, sort_keys=True) == json.dumps(obtenido, sort_keys=True)
+            print(f"{ruta:<42}{sqlite_ms:>11.1f}{duckdb_ms:>11.1f}{sqlite_ms / duckdb_ms:>7.1f}"
+                  f"{'sí' if iguales else 'NO':>9}")
+    finally:
+        os.chdir(RAIZ)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la capa de respuestas: bytes en el cable y CPU por petición para
+los endpoints de listas más grandes, comparando:
+  - serialización anterior: sqlite3.Row -> dict(row) -> jsonify()
+  - serialización actual: tuplas + nombres de columna -> orjson/json
+  - respuesta completa sin comprimir vs con gzip
+
+Uso:
+    python benchmark_respuestas.py                # genera datos sintéticos
+    python benchmark_respuestas.py --ventas 300000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, RAIZ)
+
+from generar_datos import generar
+
+CONSULTAS = {
+    '/api/ventas': '''
+        SELECT v.*, c.nombre as cliente_nombre, p.nombre as producto_nombre, ped.id as pedido_numero
+        FROM ventas v
+        LEFT JOIN clientes c ON v.cliente_id = c.id
+        LEFT JOIN productos p ON v.producto_id = p.id
+        LEFT JOIN pedidos ped ON v.pedido_id = ped.id
+        ORDER BY v.id DESC
+    ''',
+    '/api/pedidos': None,
+    '/api/clientes': 'SELECT * FROM clientes',
+    '/api/cuentas-por-cobrar': None,
+}
+
+def medir(funcion, repeticiones):
+    """CPU (process_time) media por ejecución en milisegundos y último resultado"""
+    resultado = None
+    inicio = time.process_time()
+    for _ in range(repeticiones):
+        resultado = funcion()
+    return (time.process_time() - inicio) / repeticiones * 1000, resultado
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de serialización y compresión')
+    parser.add_argument('--ventas', type=int, default=100000)
+    parser.add_argument('--clientes', type=int, default=5000)
+    parser.add_argument('--pedidos', type=int, default=20000)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+    
+    directorio = tempfile.mkdtemp(prefix='bench_respuestas_')
+    os.chdir(directorio)
+    try:
+        print(f"Generando datos en {directorio} ...")
+        generar('database.db', clientes=args.clientes, pedidos=args.pedidos, ventas=args.ventas)
+        
+        import app as backend
+        from flask import jsonify
+        
+        backend.app.config['TESTING'] = True
+        cliente = backend.app.test_client()
+        r = args.repeticiones
+        
+        print(f"\nJSON backend: {'orjson' if backend.orjson else 'json (stdlib)'}")
+        print("(serial = solo consulta + serialización; http = petición completa por test_client)")
+        print(f"{'endpoint':<26}{'filas':>8}{'serial legacy':>15}{'serial nuevo':>14}"
+              f"{'http ms':>9}{'http gzip ms':>14}{'bytes':>13}{'gzip bytes':>12}{'ratio':>7}")
+        
+        for ruta, sql in CONSULTAS.items():
+            legacy_ms = nuevo_ms = None
+            if sql:
+                def legacy():
+                    conn = sqlite3.connect('database.db')
+                    conn.row_factory = sqlite3.Row
+                    filas = conn.execute(sql).fetchall()
+                    conn.close()
+                    with backend.app.app_context():
+                        return jsonify([dict(f) for f in filas]).get_data()
+                
+                def nuevo():
+                    conn = sqlite3.connect('database.db')
+                    datos = backend.consultar_dicts(conn, sql)
+                    conn.close()
+                    return backend.dumps_json(datos)
+                
+                legacy_ms, _ = medir(legacy, r)
+                nuevo_ms, _ = medir(nuevo, r)
+            
+            plano_ms, plano = medir(lambda: cliente.get(ruta, headers={'Accept-Encoding': 'identity'}), r)
+            gzip_ms, comprimido = medir(lambda: cliente.get(ruta, headers={'Accept-Encoding': 'gzip'}), r)
+            filas = len(json.loads(plano.get_data())) if plano.status_code == 200 else 0
+            bytes_plano = len(plano.get_data())
+            bytes_gzip = len(comprimido.get_data())
+            
+            def ms(valor):
+                return '-' if valor is None else f'{valor:.1f}'
+            print(f"{ruta:<26}{filas:>8}{ms(legacy_ms):>15}{ms(nuevo_ms):>14}{ms(plano_ms):>9}{ms(gzip_ms):>14}"
+                  f"{bytes_plano:>13,}{bytes_gzip:>12,}{bytes_plano / max(bytes_gzip, 1):>7.1f}")
+    finally:
+        os.chdir(RAIZ)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
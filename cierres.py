@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Cierre de periodos: congela por mes los agregados de las ventas (por producto y
+por cliente; por tipo se obtiene uniendo con productos) y el monto y saldo de las
+cuentas por cobrar y por pagar creadas en el mes. Los reportes de todo el
+historial leen los meses cerrados de estas tablas (una fila por mes y producto o
+cliente) y solo recorren las ventas posteriores al último mes cerrado.
+
+El cierre es acumulativo: cerrar un mes cierra también todos los anteriores, así
+los meses cerrados son siempre los anteriores al corte (primer día del mes
+siguiente al último cerrado). Cada cierre solo calcula los meses nuevos y los
+marcados como desactualizados; las particiones de archivo (ver archivo.py) se
+incluyen en el cálculo.
+
+Las escrituras sobre filas de un mes cerrado (borrar una venta, editar o borrar
+una cuenta, importar ventas antiguas) se rechazan con PeriodoCerrado, o, si no se
+bloquean, marcan el mes como desactualizado: los reportes vuelven a calcularlo
+desde las filas hasta que se cierre de nuevo. Registrar pagos no cambia los
+agregados cerrados y siempre se permite.
+
+Uso:
+    python cierres.py cerrar --hasta 2025-06 --db database.db
+    python cierres.py listar
+    python cierres.py reabrir 2025-05
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+import time
+from datetime import date
+
+from archivo import particiones_archivo, union_archivo
+
+# Tablas del cierre (no pasan por el changelog)
+TABLAS_CIERRE = ['periodos_cerrados', 'cierre_ventas_producto', 'cierre_ventas_cliente', 'cierre_cuentas']
+
+# Tablas cuyas filas quedan congeladas por un cierre -> columna de fecha
+COLUMNAS_FECHA_CIERRE = {
+    'ventas': 'fecha',
+    'cuentas_por_cobrar': 'fecha_creacion',
+    'cuentas_por_pagar': 'fecha_creacion',
+}
+
+_PATRON_MES = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+class PeriodoCerrado(Exception):
+    """Escritura sobre filas de un mes cerrado cuando las ediciones están bloqueadas"""
+
+    def __init__(self, meses):
+        self.meses = meses
+        super().__init__(f"El periodo {', '.join(meses)} está cerrado; reábrelo para modificarlo")
+
+def validar_mes(mes):
+    """Devuelve `mes` si tiene formato YYYY-MM; ValueError si no"""
+    if not mes or not _PATRON_MES.match(mes):
+        raise ValueError(f"Mes inválido: {mes!r} (formato YYYY-MM)")
+    return mes
+
+def siguiente_mes(mes):
+    anio, numero = int(mes[:4]), int(mes[5:7])
+    return f'{anio + numero // 12:04d}-{numero % 12 + 1:02d}'
+
+def mes_anterior(hoy=None):
+    """Último mes completo (YYYY-MM), el que se cierra por defecto"""
+    hoy = hoy or date.today()
+    return f'{hoy.year - (hoy.month == 1):04d}-{(hoy.month - 2) % 12 + 1:02d}'
+
+def corte_cierre(conn):
+    """Primer día posterior al último mes cerrado (YYYY-MM-DD), o None si no hay cierres"""
+    try:
+        ultimo = conn.execute('SELECT MAX(mes) FROM periodos_cerrados').fetchone()[0]
+    except sqlite3.OperationalError:
+        # Base sin migrar
+        return None
+    return f'{siguiente_mes(ultimo)}-01' if ultimo else None
+
+def meses_desactualizados(conn):
+    try:
+        return [fila[0] for fila in conn.execute('''
+            SELECT mes FROM periodos_cerrados
+            WHERE desactualizado = 1 AND mes GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]'
+            ORDER BY mes
+        ''')]
+    except sqlite3.OperationalError:
+        return []
+
+def version_cierres(conn, esquema='main'):
+    """Cambia con cada cierre, reapertura o mes marcado (para copias derivadas)"""
+    try:
+        fila = conn.execute(
+            f"SELECT version FROM {esquema}.versiones_tablas WHERE tabla = 'periodos_cerrados'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return fila[0] if fila else None
+
+def marcar_desactualizados(conn, meses):
+    """Marca meses cerrados cuyas filas cambiaron después del cierre (dentro de la transacción de `conn`)"""
+    for mes in meses:
+        conn.execute('''
+            INSERT INTO periodos_cerrados (mes, desactualizado) VALUES (?, 1)
+            ON CONFLICT (mes) DO UPDATE SET desactualizado = 1
+        ''', (mes,))
+
+def verificar_periodo(conn, tabla, id=None, bloquear=True):
+    """
+    Aplica el cierre a una escritura sobre `tabla` (la fila `id`, o toda la tabla):
+    si alguna fila afectada es de un mes cerrado lanza PeriodoCerrado o, con
+    bloquear=False, marca esos meses como desactualizados. Devuelve los meses afectados.
+    """
+    corte = corte_cierre(conn)
+    if corte is None:
+        return []
+    columna = COLUMNAS_FECHA_CIERRE[tabla]
+    condicion, params = ('AND id = ?', (corte, id)) if id is not None else ('', (corte,))
+    meses = [fila[0] for fila in conn.execute(f'''
+        SELECT DISTINCT substr({columna}, 1, 7) FROM {tabla}
+        WHERE {columna} < ? {condicion}
+    ''', params)]
+    if meses and bloquear:
+        raise PeriodoCerrado(meses)
+    marcar_desactualizados(conn, meses)
+    return meses
+
+def cerrar_periodos(conn, hasta):
+    """
+    Cierra todos los meses hasta `hasta` (YYYY-MM) inclusive: calcula los agregados de
+    los meses posteriores al corte anterior y de los desactualizados, en una sola
+    transacción. Devuelve el corte resultante y los meses calculados.
+    """
+    validar_mes(hasta)
+    inicio = time.perf_counter()
+    nivel_aislamiento = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            corte_anterior = corte_cierre(conn)
+            corte = max(corte_anterior or '', f'{siguiente_mes(hasta)}-01')
+            desactualizados = meses_desactualizados(conn)
+            params = {
+                'corte': corte,
+                'desde': corte_anterior or '',
+                'desactualizados': json.dumps(desactualizados),
+                'hasta': hasta,
+            }
+            # Solo se leen las particiones de archivo que se solapan con lo que se recalcula
+            desde_archivo = min([corte_anterior] + [f'{mes}-01' for mes in desactualizados]) if corte_anterior else None
+            particiones = particiones_archivo(conn)
+
+            for tabla in TABLAS_CIERRE[1:]:
+                conn.execute(f'''
+                    DELETE FROM {tabla}
+                    WHERE mes >= substr(:desde, 1, 7) OR mes IN (SELECT value FROM json_each(:desactualizados))
+                ''', params)
+
+            def rango(columna):
+                return f'''
+                    {columna} < :corte AND ({columna} >= :desde
+                    OR substr({columna}, 1, 7) IN (SELECT value FROM json_each(:desactualizados)))
+                '''
+
+            ventas = union_archivo('ventas', particiones, desde_archivo, corte)
+            conn.execute(f'''
+                INSERT INTO cierre_ventas_producto (mes, producto_id, num_ventas, total)
+                SELECT substr(v.fecha, 1, 7), v.producto_id, COUNT(v.id), SUM(v.total)
+                FROM {ventas} v WHERE {rango('v.fecha')}
+                GROUP BY substr(v.fecha, 1, 7), v.producto_id
+            ''', params)
+            conn.execute(f'''
+                INSERT INTO cierre_ventas_cliente (mes, cliente_id, num_ventas, total, ultima_fecha)
+                SELECT substr(v.fecha, 1, 7), v.cliente_id, COUNT(v.id), SUM(v.total), MAX(v.fecha)
+                FROM {ventas} v WHERE {rango('v.fecha')}
+                GROUP BY substr(v.fecha, 1, 7), v.cliente_id
+            ''', params)
+            for tabla in ('cuentas_por_cobrar', 'cuentas_por_pagar'):
+                conn.execute(f'''
+                    INSERT INTO cierre_cuentas (mes, tabla, num_cuentas, monto, saldo)
+                    SELECT substr(c.fecha_creacion, 1, 7), '{tabla}', COUNT(*), SUM(c.monto), SUM(c.saldo)
+                    FROM {union_archivo(tabla, particiones, desde_archivo, corte)} c
+                    WHERE {rango('c.fecha_creacion')}
+                    GROUP BY substr(c.fecha_creacion, 1, 7)
+                ''', params)
+
+            # Un registro por mes con datos, más el mes pedido aunque no tenga movimientos
+            conn.execute('''
+                INSERT INTO periodos_cerrados (mes, cerrado_en, num_ventas, ventas_total, desactualizado)
+                SELECT m.mes, CURRENT_TIMESTAMP,
+                       COALESCE((SELECT SUM(c.num_ventas) FROM cierre_ventas_producto c WHERE c.mes = m.mes), 0),
+                       COALESCE((SELECT SUM(c.total) FROM cierre_ventas_producto c WHERE c.mes = m.mes), 0),
+                       0
+                FROM (
+                    SELECT mes FROM cierre_ventas_producto
+                    UNION SELECT mes FROM cierre_cuentas
+                    UNION SELECT value FROM json_each(:desactualizados)
+                    UNION SELECT :hasta
+                ) m
+                WHERE m.mes GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]' AND m.mes < substr(:corte, 1, 7)
+                  AND (m.mes >= substr(:desde, 1, 7) OR m.mes IN (SELECT value FROM json_each(:desactualizados)))
+                ON CONFLICT (mes) DO UPDATE SET
+                    cerrado_en = excluded.cerrado_en,
+                    num_ventas = excluded.num_ventas,
+                    ventas_total = excluded.ventas_total,
+                    desactualizado = 0
+            ''', params)
+            meses = [fila[0] for fila in conn.execute('''
+                SELECT mes FROM periodos_cerrados
+                WHERE mes >= substr(:desde, 1, 7) OR mes IN (SELECT value FROM json_each(:desactualizados))
+                ORDER BY mes
+            ''', params)]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.isolation_level = nivel_aislamiento
+    return {
+        'hasta': hasta,
+        'corte': corte,
+        'meses_calculados': meses,
+        'segundos': round(time.perf_counter() - inicio, 3)
+    }
+
+def reabrir_periodos(conn, mes):
+    """Reabre `mes` y todos los posteriores (dentro de la transacción de `conn`); devuelve los meses reabiertos"""
+    validar_mes(mes)
+    meses = [fila[0] for fila in conn.execute(
+        'SELECT mes FROM periodos_cerrados WHERE mes >= ? ORDER BY mes', (mes,))]
+    for tabla in TABLAS_CIERRE:
+        conn.execute(f'DELETE FROM {tabla} WHERE mes >= ?', (mes,))
+    return meses
+
+def eliminar_cierres(conn):
+    """Reabre todos los periodos (dentro de la transacción de `conn`)"""
+    for tabla in TABLAS_CIERRE:
+        conn.execute(f'DELETE FROM {tabla}')
+
+def listar_periodos(conn):
+    """Periodos cerrados con sus totales de ventas y cuentas, del más reciente al más antiguo"""
+    cuentas = {}
+    for mes, tabla, num_cuentas, monto, saldo in conn.execute(
+            'SELECT mes, tabla, num_cuentas, monto, saldo FROM cierre_cuentas'):
+        cuentas.setdefault(mes, {})[tabla] = {
+            'cantidad': num_cuentas,
+            'monto': round(monto or 0, 2),
+            'saldo': round(saldo or 0, 2)
+        }
+    vacio = {'cantidad': 0, 'monto': 0, 'saldo': 0}
+    periodos = []
+    for mes, cerrado_en, num_ventas, ventas_total, desactualizado in conn.execute('''
+        SELECT mes, cerrado_en, num_ventas, ventas_total, desactualizado
+        FROM periodos_cerrados ORDER BY mes DESC
+    '''):
+        periodos.append({
+            'mes': mes,
+            'cerrado_en': cerrado_en,
+            'ventas': {'cantidad': num_ventas, 'total': round(ventas_total or 0, 2)},
+            'cuentas_por_cobrar': cuentas.get(mes, {}).get('cuentas_por_cobrar', vacio),
+            'cuentas_por_pagar': cuentas.get(mes, {}).get('cuentas_por_pagar', vacio),
+            'desactualizado': bool(desactualizado)
+        })
+    return periodos
+
+def main():
+    parser = argparse.ArgumentParser(description='Cierre de periodos mensuales')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    cerrar = subparsers.add_parser('cerrar', help='Cerrar los meses hasta uno dado (inclusive)')
+    cerrar.add_argument('--hasta', default=None, help='Último mes a cerrar (YYYY-MM, por defecto el mes anterior)')
+    cerrar.add_argument('--db', default='database.db')
+
+    listar = subparsers.add_parser('listar', help='Listar los periodos cerrados')
+    listar.add_argument('--db', default='database.db')
+
+    reabrir = subparsers.add_parser('reabrir', help='Reabrir un mes y todos los posteriores')
+    reabrir.add_argument('mes')
+    reabrir.add_argument('--db', default='database.db')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.comando == 'cerrar':
+            hasta = args.hasta or mes_anterior()
+            if hasta >= date.today().strftime('%Y-%m'):
+                raise ValueError('Solo se pueden cerrar meses ya terminados')
+            resultado = cerrar_periodos(conn, hasta)
+            print(f"OK Periodos cerrados hasta {hasta}: {len(resultado['meses_calculados'])} meses calculados "
+                  f"({resultado['segundos']}s)")
+        elif args.comando == 'listar':
+            for p in listar_periodos(conn):
+                marca = ' (desactualizado)' if p['desactualizado'] else ''
+                print(f"{p['mes']}  {p['ventas']['cantidad']} ventas  {p['ventas']['total']:.2f}  "
+                      f"por cobrar {p['cuentas_por_cobrar']['saldo']:.2f}  "
+                      f"por pagar {p['cuentas_por_pagar']['saldo']:.2f}{marca}")
+        elif args.comando == 'reabrir':
+            meses = reabrir_periodos(conn, args.mes)
+            conn.commit()
+            print(f"OK {len(meses)} meses reabiertos desde {args.mes}")
+    except ValueError as e:
+        print(f"ERROR {e}")
+        raise SystemExit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
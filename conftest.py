@@ -0,0 +1,46 @@
+"""
+Fixtures compartidos de los tests: una base sintética chica (ver generar_datos.py)
+por test y la app de Flask apuntando a ella.
+"""
+
+import os
+
+import pytest
+
+# Los tests no deben tocar la base de desarrollo aunque algo se importe antes del fixture
+os.environ.setdefault('DATABASE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.db'))
+
+from generar_datos import generar
+
+@pytest.fixture
+def base_datos(tmp_path):
+    """Ruta de una base sintética recién generada (~2000 ventas en 3 años)"""
+    ruta = str(tmp_path / 'database.db')
+    generar(ruta, clientes=50, productos=10, pedidos=400, ventas=2000, cuentas=300)
+    return ruta
+
+def _olvidar_tenants(backend):
+    """Cierra los estados en memoria para que el próximo uso vuelva a abrir (y migrar) la base"""
+    with backend._tenants_lock:
+        estados = list(backend._tenants.values())
+        backend._tenants.clear()
+    for estado in estados:
+        estado.cerrar()
+    with backend._migracion_lock:
+        backend._tenants_migrados.clear()
+    backend.limpiar_cache_lecturas()
+
+@pytest.fixture
+def backend(base_datos, monkeypatch):
+    """Módulo app con el tenant por defecto en `base_datos`, sin réplica ni DuckDB"""
+    import app as backend
+    monkeypatch.setattr(backend, 'DATABASE_PATH', base_datos)
+    monkeypatch.setattr(backend, 'ANALITICA_MOTOR', 'sqlite')
+    monkeypatch.setattr(backend, 'REPLICA_HABILITADA', False)
+    _olvidar_tenants(backend)
+    yield backend
+    _olvidar_tenants(backend)
+
+@pytest.fixture
+def cliente(backend):
+    return backend.app.test_client()
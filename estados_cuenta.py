@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Estados de cuenta por cliente: sus ventas, pedidos y cuentas por cobrar con un
+resumen (vendido, facturado, pagado, saldo pendiente y vencido).
+
+Los datos de muchos clientes se leen con una consulta por tabla para todos a la
+vez (filtrada por json_each y ordenada por cliente) y se reparten recorriendo
+cada resultado una sola vez. En el lote de todos los clientes con saldo
+pendiente, los XLSX se generan en paralelo en un pool de procesos (openpyxl es
+Python puro, así que con hilos no escalaría con los núcleos); se usa 'spawn'
+porque el proceso de la app tiene hilos en curso.
+
+Uso:
+    python estados_cuenta.py --db database.db --directorio estados_cuenta
+    python estados_cuenta.py --clientes 3 7 12 --desde 2025-01-01 --procesos 4
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import groupby
+
+from openpyxl import Workbook
+from openpyxl.styles import Font, PatternFill
+
+from archivo import particiones_archivo, union_archivo
+
+def clientes_con_saldo(conn):
+    """Ids de los clientes con saldo pendiente en cuentas por cobrar"""
+    return [fila[0] for fila in conn.execute('''
+        SELECT cliente_id FROM cuentas_por_cobrar
+        WHERE estado != 'pagado' AND saldo > 0
+        GROUP BY cliente_id ORDER BY cliente_id
+    ''')]
+
+def _rango(columna, desde, hasta):
+    condiciones = []
+    params = []
+    if desde:
+        condiciones.append(f'{columna} >= ?')
+        params.append(desde)
+    if hasta:
+        condiciones.append(f"{columna} < date(?, '+1 day')")
+        params.append(hasta)
+    return ''.join(f' AND {c}' for c in condiciones), params
+
+def _por_cliente(cursor):
+    """{cliente_id: [dict]} desde un cursor ordenado por cliente_id (primera columna)"""
+    columnas = [d[0] for d in cursor.description]
+    return {
+        cliente_id: [dict(zip(columnas[1:], fila[1:])) for fila in filas]
+        for cliente_id, filas in groupby(cursor, key=lambda fila: fila[0])
+    }
+
+def consultar_estados(conn, cliente_ids, particiones=None, desde=None, hasta=None, hoy=None):
+    """
+    Estados de cuenta de `cliente_ids` ({cliente_id: estado}) con una consulta por
+    tabla. El rango [desde, hasta] filtra ventas, pedidos y cuentas por fecha; las
+    cuentas con saldo pendiente se incluyen siempre.
+    """
+    hoy = (hoy or date.today()).isoformat()
+    if particiones is None:
+        particiones = particiones_archivo(conn)
+    ids = json.dumps(list(cliente_ids))
+
+    clientes = _por_cliente(conn.execute('''
+        SELECT id, id, nombre, email, telefono, direccion FROM clientes
+        WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+    ''', (ids,)))
+
+    rango, params = _rango('v.fecha', desde, hasta)
+    ventas = _por_cliente(conn.execute(f'''
+        SELECT v.cliente_id, v.id, v.fecha, v.pedido_id, p.nombre AS producto,
+               v.cantidad, v.total, v.estado_pago
+        FROM {union_archivo('ventas', particiones, desde, hasta)} v
+        LEFT JOIN productos p ON v.producto_id = p.id
+        WHERE v.cliente_id IN (SELECT value FROM json_each(?)){rango}
+        ORDER BY v.cliente_id, v.fecha, v.id
+    ''', [ids] + params))
+
+    rango, params = _rango('pe.fecha', desde, hasta)
+    pedidos = _por_cliente(conn.execute(f'''
+        SELECT pe.cliente_id, pe.id, pe.fecha, pe.estado, pe.estado_pago, pe.encargado_principal
+        FROM {union_archivo('pedidos', particiones, desde, hasta)} pe
+        WHERE pe.cliente_id IN (SELECT value FROM json_each(?)){rango}
+        ORDER BY pe.cliente_id, pe.fecha, pe.id
+    ''', [ids] + params))
+
+    rango, params = _rango('c.fecha_creacion', desde, hasta)
+    cuentas = _por_cliente(conn.execute(f'''
+        SELECT c.cliente_id, c.id, c.numero_factura, c.fecha_creacion, c.fecha_vencimiento,
+               c.monto, c.monto_pagado, c.saldo, c.estado, c.venta_id, c.pedido_id
+        FROM {union_archivo('cuentas_por_cobrar', particiones, desde, hasta)} c
+        WHERE c.cliente_id IN (SELECT value FROM json_each(?))
+          AND ((1 = 1{rango}) OR (c.estado != 'pagado' AND c.saldo > 0))
+        ORDER BY c.cliente_id, c.fecha_creacion, c.id
+    ''', [ids] + params))
+
+    estados = {}
+    for cliente_id, (cliente,) in clientes.items():
+        cuentas_cliente = cuentas.get(cliente_id, [])
+        abiertas = [c for c in cuentas_cliente if c['estado'] != 'pagado' and (c['saldo'] or 0) > 0]
+        estados[cliente_id] = {
+            'cliente': cliente,
+            'desde': desde,
+            'hasta': hasta,
+            'generado': hoy,
+            'resumen': {
+                'total_ventas': round(sum(v['total'] or 0 for v in ventas.get(cliente_id, [])), 2),
+                'total_facturado': round(sum(c['monto'] or 0 for c in cuentas_cliente), 2),
+                'total_pagado': round(sum(c['monto_pagado'] or 0 for c in cuentas_cliente), 2),
+                'saldo_pendiente': round(sum(c['saldo'] for c in abiertas), 2),
+                'saldo_vencido': round(sum(c['saldo'] for c in abiertas if (c['fecha_vencimiento'] or '') < hoy), 2),
+                'facturas_pendientes': len(abiertas)
+            },
+            'ventas': ventas.get(cliente_id, []),
+            'pedidos': pedidos.get(cliente_id, []),
+            'cuentas_por_cobrar': cuentas_cliente
+        }
+    return estados
+
+# Hojas del XLSX: (título, clave del estado, [(encabezado, campo)])
+HOJAS_ESTADO = [
+    ('Facturas', 'cuentas_por_cobrar', [
+        ('Factura', 'numero_factura'), ('Fecha', 'fecha_creacion'), ('Vencimiento', 'fecha_vencimiento'),
+        ('Monto', 'monto'), ('Pagado', 'monto_pagado'), ('Saldo', 'saldo'), ('Estado', 'estado')
+    ]),
+    ('Ventas', 'ventas', [
+        ('Venta', 'id'), ('Fecha', 'fecha'), ('Producto', 'producto'), ('Cantidad', 'cantidad'),
+        ('Total', 'total'), ('Estado de pago', 'estado_pago'), ('Pedido', 'pedido_id')
+    ]),
+    ('Pedidos', 'pedidos', [
+        ('Pedido', 'id'), ('Fecha', 'fecha'), ('Estado', 'estado'), ('Estado de pago', 'estado_pago'),
+        ('Encargado', 'encargado_principal')
+    ]),
+]
+
+def libro_estado_cuenta(estado):
+    """Workbook de openpyxl con el resumen y una hoja por tabla"""
+    wb = Workbook()
+    header_font = Font(bold=True)
+    header_fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
+
+    ws = wb.active
+    ws.title = 'Resumen'
+    cliente = estado['cliente']
+    ws.append(['Estado de cuenta', cliente['nombre']])
+    ws['A1'].font = header_font
+    ws.append(['Email', cliente['email']])
+    ws.append(['Teléfono', cliente['telefono']])
+    ws.append(['Periodo', f"{estado['desde'] or 'inicio'} a {estado['hasta'] or estado['generado']}"])
+    ws.append([])
+    etiquetas = {
+        'total_ventas': 'Total ventas', 'total_facturado': 'Total facturado', 'total_pagado': 'Total pagado',
+        'saldo_pendiente': 'Saldo pendiente', 'saldo_vencido': 'Saldo vencido',
+        'facturas_pendientes': 'Facturas pendientes'
+    }
+    for clave, etiqueta in etiquetas.items():
+        ws.append([etiqueta, estado['resumen'][clave]])
+
+    for titulo, clave, columnas in HOJAS_ESTADO:
+        hoja = wb.create_sheet(titulo)
+        hoja.append([encabezado for encabezado, _ in columnas])
+        for celda in hoja[1]:
+            celda.font = header_font
+            celda.fill = header_fill
+        for fila in estado[clave]:
+            hoja.append([fila.get(campo) for _, campo in columnas])
+    return wb
+
+def xlsx_estado_cuenta(estado):
+    """Bytes del XLSX de un estado de cuenta"""
+    output = io.BytesIO()
+    libro_estado_cuenta(estado).save(output)
+    return output.getvalue()
+
+def _escribir_estado(tarea):
+    """Worker del pool: escribe el XLSX de un estado; devuelve (cliente_id, archivo, bytes)"""
+    estado, ruta = tarea
+    libro_estado_cuenta(estado).save(ruta)
+    return estado['cliente']['id'], os.path.basename(ruta), os.path.getsize(ruta)
+
+def generar_lote(conn, directorio, cliente_ids=None, desde=None, hasta=None, procesos=None):
+    """
+    Genera en `directorio` un XLSX por cliente (por defecto, los que tienen saldo
+    pendiente): una consulta por tabla para todos y los archivos en paralelo
+    """
+    inicio = time.perf_counter()
+    if cliente_ids is None:
+        cliente_ids = clientes_con_saldo(conn)
+    estados = consultar_estados(conn, cliente_ids, desde=desde, hasta=hasta)
+    segundos_consultas = time.perf_counter() - inicio
+
+    os.makedirs(directorio, exist_ok=True)
+    tareas = [(estado, os.path.join(directorio, f'estado_cuenta_{cliente_id}.xlsx'))
+              for cliente_id, estado in estados.items()]
+    procesos = max(1, min(procesos or os.cpu_count() or 1, len(tareas) or 1))
+    if procesos == 1:
+        archivos = [_escribir_estado(tarea) for tarea in tareas]
+    else:
+        contexto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+            archivos = list(pool.map(_escribir_estado, tareas, chunksize=max(1, len(tareas) // (procesos * 4))))
+
+    return {
+        'directorio': directorio,
+        'clientes': len(archivos),
+        'procesos': procesos,
+        'archivos': [{'cliente_id': c, 'archivo': a, 'bytes': b} for c, a, b in archivos],
+        'segundos_consultas': round(segundos_consultas, 3),
+        'segundos': round(time.perf_counter() - inicio, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera estados de cuenta XLSX por cliente')
+    parser.add_argument('--db', default='database.db')
+    parser.add_argument('--directorio', default='estados_cuenta')
+    parser.add_argument('--clientes', type=int, nargs='*', help='Ids de clientes (por defecto, los que tienen saldo)')
+    parser.add_argument('--desde', help='Fecha inicial (YYYY-MM-DD)')
+    parser.add_argument('--hasta', help='Fecha final (YYYY-MM-DD)')
+    parser.add_argument('--procesos', type=int, default=None, help='Procesos del pool (por defecto, los núcleos)')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        resultado = generar_lote(conn, args.directorio, args.clientes or None,
+                                 desde=args.desde, hasta=args.hasta, procesos=args.procesos)
+    finally:
+        conn.close()
+    print(f"OK {resultado['clientes']} estados de cuenta en {resultado['directorio']} "
+          f"({resultado['procesos']} procesos, consultas {resultado['segundos_consultas']}s, "
+          f"total {resultado['segundos']}s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Genera una base de datos sintética de tamaño configurable para benchmarks.
+Crea el esquema completo con init_db() y llena clientes, productos, pedidos,
+pedido_productos, ventas y ambas tablas de cuentas con datos aleatorios
+reproducibles (semilla fija).
+
+Uso:
+    python generar_datos.py bench.db
+    python generar_datos.py bench.db --ventas 1000000 --clientes 20000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from models import init_db
+
+ESTADOS_PEDIDO = ['pendiente', 'en_proceso', 'completado', 'entregado']
+
+def generar(ruta, clientes=2000, productos=50, pedidos=20000, ventas=100000, cuentas=5000, semilla=42):
+    """Crea (o sobrescribe) la base de datos en `ruta` con datos sintéticos"""
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    init_db(ruta)
+    
+    rnd = random.Random(semilla)
+    inicio = datetime.now() - timedelta(days=3 * 365)
+    segundos_rango = 3 * 365 * 24 * 3600
+    
+    def fecha_aleatoria():
+        return (inicio + timedelta(seconds=rnd.randrange(segundos_rango))).strftime('%Y-%m-%d %H:%M:%S')
+    
+    conn = sqlite3.connect(ruta)
+    cursor = conn.cursor()
+    t0 = time.perf_counter()
+    
+    cursor.executemany('INSERT INTO productos (nombre, tipo, precio, descripcion) VALUES (?, ?, ?, ?)', (
+        (f'PRODUCTO {i}', rnd.choice(['gfx', 'vfx']), round(rnd.uniform(20, 2500), 2), f'Descripción del producto {i}')
+        for i in range(1, productos + 1)
+    ))
+    precios = dict(cursor.execute('SELECT id, precio FROM productos').fetchall())
+    ids_productos = list(precios)
+    
+    cursor.executemany('INSERT INTO clientes (nombre, email, telefono, direccion, notas) VALUES (?, ?, ?, ?, ?)', (
+        (f'Cliente {i}', f'cliente{i}@ejemplo.com', f'+1 (555) {i:07d}', f'Calle {i}', 'Generado')
+        for i in range(1, clientes + 1)
+    ))
+    
+    cursor.executemany('''
+        INSERT INTO pedidos (cliente_id, fecha, encargado_principal, pago_realizado, notas, estado)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (
+        (rnd.randint(1, clientes), fecha_aleatoria(), rnd.choice(['Vex', 'Gilbert', 'Randy', 'Sergio']),
+         rnd.random() < 0.5, f'Pedido generado {i}', rnd.choice(ESTADOS_PEDIDO))
+        for i in range(1, pedidos + 1)
+    ))
+    
+    def lineas():
+        for pedido_id in range(1, pedidos + 1):
+            for _ in range(rnd.randint(1, 3)):
+                producto_id = rnd.choice(ids_productos)
+                cantidad = rnd.randint(1, 4)
+                yield (pedido_id, producto_id, cantidad, round(precios[producto_id] * cantidad, 2))
+    cursor.executemany('''
+        INSERT INTO pedido_productos (pedido_id, producto_id, cantidad, assigned_payment)
+        VALUES (?, ?, ?, ?)
+    ''', lineas())
+    
+    def filas_ventas():
+        for _ in range(ventas):
+            producto_id = rnd.choice(ids_productos)
+            cantidad = rnd.randint(1, 4)
+            pedido_id = rnd.randint(1, pedidos) if rnd.random() < 0.3 else None
+            yield (rnd.randint(1, clientes), producto_id, cantidad, round(precios[producto_id] * cantidad, 2),
+                   fecha_aleatoria(), pedido_id, rnd.choice(['pagado', 'pagado', 'pendiente']))
+    cursor.executemany('''
+        INSERT INTO ventas (cliente_id, producto_id, cantidad, total, fecha, pedido_id, estado_pago)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', filas_ventas())
+    
+    def filas_cobrar():
+        for i in range(1, cuentas + 1):
+            monto = round(rnd.uniform(50, 5000), 2)
+            pagado = round(monto * rnd.choice([0, 0, 0.5, 1]), 2)
+            vence = (datetime.now() + timedelta(days=rnd.randint(-120, 120))).strftime('%Y-%m-%d')
+            yield (f'FAC-{i:06d}', rnd.randint(1, clientes), rnd.randint(1, ventas), monto, pagado,
+                   round(monto - pagado, 2), vence, 'pagado' if pagado >= monto else 'pendiente')
+    cursor.executemany('''
+        INSERT INTO cuentas_por_cobrar
+        (numero_factura, cliente_id, venta_id, monto, monto_pagado, saldo, fecha_vencimiento, estado)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', filas_cobrar())
+    
+    def filas_pagar():
+        for i in range(1, cuentas + 1):
+            monto = round(rnd.uniform(50, 5000), 2)
+            pagado = round(monto * rnd.choice([0, 0, 0.5, 1]), 2)
+            vence = (datetime.now() + timedelta(days=rnd.randint(-120, 120))).strftime('%Y-%m-%d')
+            yield (f'BILL{i:06d}', f'Proveedor {rnd.randint(1, 200)}', monto, pagado, round(monto - pagado, 2),
+                   vence, 'pagado' if pagado >= monto else 'pendiente', 'Generado')
+    cursor.executemany('''
+        INSERT INTO cuentas_por_pagar
+        (codigo_factura, proveedor, monto, monto_pagado, saldo, fecha_vencimiento, estado, descripcion)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', filas_pagar())
+    
+    conn.commit()
+    conn.close()
+    return time.perf_counter() - t0
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera una base de datos sintética para benchmarks')
+    parser.add_argument('ruta', help='Archivo SQLite a crear (se sobrescribe)')
+    parser.add_argument('--clientes', type=int, default=2000)
+    parser.add_argument('--productos', type=int, default=50)
+    parser.add_argument('--pedidos', type=int, default=20000)
+    parser.add_argument('--ventas', type=int, default=100000)
+    parser.add_argument('--cuentas', type=int, default=5000)
+    args = parser.parse_args()
+    
+    segundos = generar(args.ruta, args.clientes, args.productos, args.pedidos, args.ventas, args.cuentas)
+    print(f"OK Base de datos sintética creada en {args.ruta} ({segundos:.1f}s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Importación masiva de clientes, productos y ventas históricas desde CSV o XLSX.
+Las filas se leen en streaming (csv.DictReader / openpyxl en modo read_only),
+se validan una a una y se insertan con executemany por lotes. Los índices
+secundarios de la tabla destino se eliminan al inicio y se recrean al final,
+dentro de la misma transacción, para no mantenerlos fila por fila.
+
+La primera fila del archivo debe contener los nombres de columna.
+
+Los importes aceptan '.' o ',' como separador decimal (1,234.50 o 1.234,50). Si
+no se indica con --separador-decimal se deduce de cada valor, y los ambiguos
+(1.234 / 1,234) se rechazan como error de fila en lugar de adivinar. El
+delimitador de los CSV (',', ';', tabulador o '|') se deduce del encabezado o se
+fija con --delimitador.
+
+Las ventas con fecha en un periodo cerrado (ver cierres.py) se rechazan fila por
+fila, o con bloquear_cerrados=False se insertan y su mes queda desactualizado.
+
+Uso:
+    python importar_datos.py clientes clientes.csv
+    python importar_datos.py ventas historico.xlsx --db database.db --chunk 10000
+    python importar_datos.py productos precios.csv --separador-decimal , --delimitador ';'
+"""
+
+import argparse
+import csv
+import io
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from functools import partial
+from itertools import chain
+
+from cierres import COLUMNAS_FECHA_CIERRE, corte_cierre, marcar_desactualizados
+
+FORMATOS_IMPORTACION = ('csv', 'xlsx')
+
+# Excel en configuración regional española guarda los CSV con ';' (la ',' es el decimal)
+DELIMITADORES_CSV = (',', ';', '\t', '|')
+
+def _texto(valor):
+    valor = str(valor).strip()
+    return valor or None
+
+def _entero(valor):
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return int(str(valor).strip())
+
+SEPARADORES_DECIMALES = ('.', ',')
+
+_DIGITOS = re.compile(r'[0-9]+')
+
+def _sin_miles(entero, miles):
+    """Parte entera sin separadores de miles; ValueError si los grupos no son de 3 dígitos"""
+    grupos = entero.split(miles)
+    if len(grupos) > 1 and not (1 <= len(grupos[0]) <= 3 and all(len(g) == 3 for g in grupos[1:])):
+        raise ValueError(f"separador de miles '{miles}' mal ubicado")
+    return ''.join(grupos)
+
+def _real(valor, separador_decimal=None):
+    """
+    Número con '.' o ',' como separador decimal (1,234.50 / 1.234,50 / 12,5). Sin
+    separador_decimal se deduce del texto; un solo separador seguido de exactamente
+    3 dígitos (1.234 / 1,234) es ambiguo y se rechaza.
+    """
+    if isinstance(valor, bool):
+        raise ValueError('número inválido')
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    texto = str(valor).strip().replace(' ', '')
+    signo = ''
+    if texto[:1] in ('-', '+'):
+        signo, texto = texto[0], texto[1:]
+    
+    if separador_decimal is None:
+        presentes = [c for c in SEPARADORES_DECIMALES if c in texto]
+        if len(presentes) == 2:
+            # El último separador es el decimal
+            separador_decimal = max(presentes, key=texto.rindex)
+        elif len(presentes) == 1:
+            separador = presentes[0]
+            entero, _, decimales = texto.rpartition(separador)
+            if texto.count(separador) > 1:
+                separador_decimal = SEPARADORES_DECIMALES[1 - SEPARADORES_DECIMALES.index(separador)]
+            elif len(decimales) != 3 or entero.lstrip('0') == '' or len(entero) > 3:
+                separador_decimal = separador
+            else:
+                raise ValueError(f"'{valor}' es ambiguo: indica el separador decimal")
+        else:
+            separador_decimal = '.'
+    
+    miles = SEPARADORES_DECIMALES[1 - SEPARADORES_DECIMALES.index(separador_decimal)]
+    entero, separador, decimales = texto.partition(separador_decimal)
+    entero = _sin_miles(entero, miles)
+    if not (entero or decimales) or not _DIGITOS.fullmatch(entero or '0') or (separador and not _DIGITOS.fullmatch(decimales)):
+        raise ValueError(f"'{valor}' no es un número válido")
+    return float(f"{signo}{entero or '0'}.{decimales or '0'}")
+
+def _fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    valor = str(valor).strip()
+    for formato in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(valor, formato).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            pass
+    raise ValueError('formato de fecha inválido (YYYY-MM-DD o YYYY-MM-DD HH:MM:SS)')
+
+# entidad -> (tabla, [(columna, conversión, requerida, valor por defecto)])
+ESQUEMAS_IMPORTACION = {
+    'clientes': ('clientes', [
+        ('nombre', _texto, True, None),
+        ('email', _texto, False, None),
+        ('telefono', _texto, False, None),
+        ('direccion', _texto, False, None),
+        ('notas', _texto, False, None),
+    ]),
+    'productos': ('productos', [
+        ('nombre', _texto, True, None),
+        ('tipo', _texto, True, None),
+        ('precio', _real, True, None),
+        ('descripcion', _texto, False, None),
+    ]),
+    'ventas': ('ventas', [
+        ('cliente_id', _entero, False, None),
+        ('producto_id', _entero, True, None),
+        ('cantidad', _entero, True, None),
+        ('total', _real, True, None),
+        ('fecha', _fecha, True, None),
+        ('pedido_id', _entero, False, None),
+        ('estado_pago', _texto, False, 'pagado'),
+    ]),
+}
+
+# Columnas de referencia que deben existir en otra tabla: columna -> tabla
+REFERENCIAS_IMPORTACION = {
+    'ventas': {'cliente_id': 'clientes', 'producto_id': 'productos', 'pedido_id': 'pedidos'},
+}
+
+def _detectar_delimitador(encabezado):
+    """Delimitador del CSV deducido de la fila de encabezados (',' si no se puede deducir)"""
+    try:
+        return csv.Sniffer().sniff(encabezado, delimiters=''.join(DELIMITADORES_CSV)).delimiter
+    except csv.Error:
+        # Una sola columna: cualquier delimitador da lo mismo
+        return ','
+
+def leer_filas(archivo, formato, delimitador=None):
+    """Genera dicts columna -> valor desde un archivo binario CSV o XLSX (delimitador
+    None = deducido del encabezado)"""
+    if delimitador is not None and delimitador not in DELIMITADORES_CSV:
+        raise ValueError(f"Delimitador inválido. Delimitadores válidos: {', '.join(map(repr, DELIMITADORES_CSV))}")
+    if formato == 'csv':
+        # utf-8-sig descarta el BOM que agrega Excel al guardar como CSV
+        texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+        try:
+            encabezado = texto.readline()
+            delimitador = delimitador or _detectar_delimitador(encabezado)
+            for fila in csv.DictReader(chain([encabezado], texto), delimiter=delimitador):
+                yield fila
+        finally:
+            texto.detach()
+    elif formato == 'xlsx':
+        from openpyxl import load_workbook
+        libro = load_workbook(archivo, read_only=True, data_only=True)
+        try:
+            filas = libro.active.iter_rows(values_only=True)
+            encabezados = [str(c).strip() if c is not None else '' for c in next(filas, ())]
+            for valores in filas:
+                if all(v is None for v in valores):
+                    continue
+                yield dict(zip(encabezados, valores))
+        finally:
+            libro.close()
+    else:
+        raise ValueError(f'Formato inválido. Formatos válidos: {", ".join(FORMATOS_IMPORTACION)}')
+
+def validar_fila(columnas, fila):
+    """Convierte una fila a la tupla a insertar; ValueError con el detalle si es inválida"""
+    valores = []
+    for columna, conversion, requerida, defecto in columnas:
+        crudo = fila.get(columna)
+        if crudo is None or (isinstance(crudo, str) and not crudo.strip()):
+            if requerida:
+                raise ValueError(f"'{columna}' es requerido")
+            valores.append(defecto)
+            continue
+        try:
+            valores.append(conversion(crudo))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"'{columna}': {e}")
+    return tuple(valores)
+
+def _indices_secundarios(cursor, tabla):
+    """(nombre, sql) de los índices creados explícitamente sobre `tabla`"""
+    return cursor.execute('''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+    ''', (tabla,)).fetchall()
+
+def importar(conn, entidad, filas, chunk=5000, max_errores=1000, diferir_indices=True, bloquear_cerrados=True,
+             separador_decimal=None):
+    """
+    Valida e inserta `filas` en la tabla de `entidad`; devuelve un resumen con errores
+    por fila. separador_decimal ('.' o ',') fija el formato de los importes; None lo
+    deduce valor por valor.
+    """
+    if entidad not in ESQUEMAS_IMPORTACION:
+        raise ValueError(f'Entidad inválida. Entidades válidas: {", ".join(ESQUEMAS_IMPORTACION)}')
+    if separador_decimal not in (None,) + SEPARADORES_DECIMALES:
+        raise ValueError(f"Separador decimal inválido. Separadores válidos: {', '.join(SEPARADORES_DECIMALES)}")
+    
+    tabla, columnas = ESQUEMAS_IMPORTACION[entidad]
+    if separador_decimal:
+        columnas = [
+            (columna, partial(_real, separador_decimal=separador_decimal) if conversion is _real else conversion,
+             requerida, defecto)
+            for columna, conversion, requerida, defecto in columnas
+        ]
+    nombres = [c[0] for c in columnas]
+    sql = f'INSERT INTO {tabla} ({", ".join(nombres)}) VALUES ({", ".join("?" * len(nombres))})'
+    referencias = REFERENCIAS_IMPORTACION.get(entidad, {})
+    posicion_fecha = nombres.index(COLUMNAS_FECHA_CIERRE[tabla]) if tabla in COLUMNAS_FECHA_CIERRE else None
+    
+    cursor = conn.cursor()
+    t0 = time.perf_counter()
+    insertadas = 0
+    total_errores = 0
+    errores = []
+    lote = []
+    meses_cerrados = set()
+    
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        corte = corte_cierre(cursor) if posicion_fecha is not None else None
+        
+        # Ids existentes para validar referencias sin una consulta por fila
+        ids_existentes = [
+            (nombres.index(columna), columna, {fila[0] for fila in cursor.execute(f'SELECT id FROM {destino}')})
+            for columna, destino in referencias.items()
+        ]
+        
+        indices = _indices_secundarios(cursor, tabla) if diferir_indices else []
+        for nombre, _ in indices:
+            cursor.execute(f'DROP INDEX {nombre}')
+        
+        # numero = línea del archivo (la 1 es el encabezado)
+        for numero, fila in enumerate(filas, start=2):
+            try:
+                valores = validar_fila(columnas, fila)
+                for posicion, columna, ids in ids_existentes:
+                    valor = valores[posicion]
+                    if valor is not None and valor not in ids:
+                        raise ValueError(f"'{columna}' {valor} no existe")
+                fecha = valores[posicion_fecha] if corte else None
+                if fecha and fecha < corte:
+                    if bloquear_cerrados:
+                        raise ValueError(f"el periodo {fecha[:7]} está cerrado")
+                    if fecha[:7] not in meses_cerrados:
+                        meses_cerrados.add(fecha[:7])
+                        marcar_desactualizados(cursor, [fecha[:7]])
+            except ValueError as e:
+                total_errores += 1
+                if len(errores) < max_errores:
+                    errores.append({'fila': numero, 'error': str(e)})
+                continue
+            
+            lote.append(valores)
+            if len(lote) >= chunk:
+                cursor.executemany(sql, lote)
+                insertadas += len(lote)
+                lote = []
+                if not diferir_indices:
+                    # Sin índices diferidos cada lote es su propia transacción
+                    conn.commit()
+                    cursor.execute('BEGIN IMMEDIATE')
+        
+        if lote:
+            cursor.executemany(sql, lote)
+            insertadas += len(lote)
+        
+        for _, sql_indice in indices:
+            cursor.execute(sql_indice)
+        
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    segundos = time.perf_counter() - t0
+    return {
+        'entidad': entidad,
+        'insertadas': insertadas,
+        'rechazadas': total_errores,
+        'errores': errores,
+        'segundos': round(segundos, 3),
+        'filas_por_segundo': round(insertadas / segundos) if segundos > 0 else insertadas
+    }
+
+def formato_de_archivo(nombre):
+    """Deduce el formato ('csv' / 'xlsx') a partir de la extensión del archivo"""
+    extension = os.path.splitext(nombre or '')[1].lower().lstrip('.')
+    return extension if extension in FORMATOS_IMPORTACION else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Importa clientes, productos o ventas desde CSV/XLSX')
+    parser.add_argument('entidad', choices=list(ESQUEMAS_IMPORTACION))
+    parser.add_argument('archivo', help='Archivo .csv o .xlsx con encabezados en la primera fila')
+    parser.add_argument('--db', default='database.db')
+    parser.add_argument('--formato', choices=FORMATOS_IMPORTACION)
+    parser.add_argument('--chunk', type=int, default=5000, help='Filas por executemany')
+    parser.add_argument('--sin-diferir-indices', action='store_true',
+                        help='Mantener los índices durante la carga y confirmar cada lote por separado')
+    parser.add_argument('--permitir-cerrados', action='store_true',
+                        help='Importar ventas de periodos cerrados marcando esos meses como desactualizados')
+    parser.add_argument('--separador-decimal', choices=SEPARADORES_DECIMALES,
+                        help='Separador decimal de los importes (por defecto se deduce de cada valor)')
+    parser.add_argument('--delimitador', choices=DELIMITADORES_CSV,
+                        help='Delimitador de columnas del CSV (por defecto se deduce del encabezado)')
+    args = parser.parse_args()
+    
+    formato = args.formato or formato_de_archivo(args.archivo)
+    if not formato:
+        parser.error('No se pudo deducir el formato; usa --formato')
+    
+    conn = sqlite3.connect(args.db)
+    try:
+        with open(args.archivo, 'rb') as archivo:
+            resumen = importar(conn, args.entidad, leer_filas(archivo, formato, args.delimitador),
+                               chunk=args.chunk, diferir_indices=not args.sin_diferir_indices,
+                               bloquear_cerrados=not args.permitir_cerrados,
+                               separador_decimal=args.separador_decimal)
+    finally:
+        conn.close()
+    
+    for error in resumen['errores']:
+        print(f"WARNING fila {error['fila']}: {error['error']}")
+    print(f"OK {resumen['insertadas']} filas importadas en {args.entidad} "
+          f"({resumen['segundos']}s, {resumen['filas_por_segundo']} filas/s, "
+          f"{resumen['rechazadas']} rechazadas)")
+
+if __name__ == '__main__':
+    main()
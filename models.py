@@ -1,9 +1,14 @@
 import sqlite3
 
-def init_db():
-    conn = sqlite3.connect('database.db')
+from archivo import particiones_archivo, union_archivo
+
+def init_db(ruta='database.db'):
+    conn = sqlite3.connect(ruta)
     cursor = conn.cursor()
     
+    # WAL: las lecturas largas (exportaciones, reportes) no bloquean a los escritores
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
     # Tabla de usuarios (NUEVA) - Simplificada
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS usuarios (
@@ -120,6 +125,30 @@ def init_db():
     # Agregar columnas faltantes
     add_missing_columns(cursor)
     
+    # Registro de particiones de archivo (ver archivo.py)
+    create_archivo(cursor)
+    
+    # Cierres de periodo: agregados mensuales congelados (ver cierres.py)
+    create_cierres(cursor)
+    
+    # Índices de cuentas abiertas para la proyección de flujo de caja
+    create_indices_finanzas(cursor)
+    
+    # Índices por cliente para los estados de cuenta
+    create_indices_clientes(cursor)
+    
+    # Métricas acumuladas por cliente mantenidas por triggers
+    create_metricas_clientes(cursor)
+    
+    # Contadores de cambios por tabla (para ETags / respuestas 304)
+    create_change_counters(cursor)
+    
+    # Log de cambios para sincronización incremental (/api/sync)
+    create_changelog(cursor)
+    
+    # Índices de texto completo para /api/buscar
+    create_fts(cursor)
+    
     # Insertar usuarios por defecto si no existen
     seed_users(cursor)
     
@@ -164,6 +193,359 @@ def add_missing_columns(cursor):
     except sqlite3.OperationalError:
         pass  # Ya existe
 
+def create_archivo(cursor):
+    """Crea el registro de particiones de archivo y alinea sus columnas con la tabla activa"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archivo_particiones (
+            tabla TEXT NOT NULL,
+            anio INTEGER NOT NULL,
+            nombre TEXT NOT NULL,
+            filas INTEGER NOT NULL DEFAULT 0,
+            fecha_min TEXT,
+            fecha_max TEXT,
+            actualizado TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (tabla, anio)
+        )
+    ''')
+    
+    # Ids del lote que se está archivando (vacía fuera de una transacción de archivo)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archivo_lote (
+            tabla TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            PRIMARY KEY (tabla, id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Las particiones se leen con UNION ALL junto a la tabla activa: las columnas
+    # agregadas después a la tabla activa se agregan también a cada partición
+    particiones = cursor.execute('SELECT tabla, nombre FROM archivo_particiones').fetchall()
+    for tabla, nombre in particiones:
+        existentes = {fila[1] for fila in cursor.execute(f'PRAGMA table_info({nombre})')}
+        for fila in cursor.execute(f'PRAGMA table_info({tabla})').fetchall():
+            if fila[1] not in existentes:
+                cursor.execute(f'ALTER TABLE {nombre} ADD COLUMN {fila[1]} {fila[2]}')
+
+def create_cierres(cursor):
+    """Crea las tablas de periodos cerrados y sus agregados congelados por mes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS periodos_cerrados (
+            mes TEXT PRIMARY KEY,
+            cerrado_en TEXT DEFAULT CURRENT_TIMESTAMP,
+            num_ventas INTEGER NOT NULL DEFAULT 0,
+            ventas_total REAL NOT NULL DEFAULT 0,
+            desactualizado INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cierre_ventas_producto (
+            mes TEXT NOT NULL,
+            producto_id INTEGER,
+            num_ventas INTEGER NOT NULL,
+            total REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cierre_ventas_producto_mes ON cierre_ventas_producto(mes)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cierre_ventas_cliente (
+            mes TEXT NOT NULL,
+            cliente_id INTEGER,
+            num_ventas INTEGER NOT NULL,
+            total REAL,
+            ultima_fecha TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cierre_ventas_cliente_mes ON cierre_ventas_cliente(mes)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cierre_cuentas (
+            mes TEXT NOT NULL,
+            tabla TEXT NOT NULL,
+            num_cuentas INTEGER NOT NULL,
+            monto REAL,
+            saldo REAL,
+            PRIMARY KEY (mes, tabla)
+        )
+    ''')
+    
+    # Las ventas posteriores al último mes cerrado se leen por rango de fecha
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas(fecha)')
+
+def create_indices_finanzas(cursor):
+    """Índices parciales de las cuentas abiertas ordenadas por vencimiento (ver flujo_caja.py)"""
+    for tabla in ('cuentas_por_cobrar', 'cuentas_por_pagar'):
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{tabla}_abiertas
+            ON {tabla}(fecha_vencimiento, saldo) WHERE estado != 'pagado'
+        ''')
+
+def create_indices_clientes(cursor):
+    """Índices (cliente, fecha) de las tablas que se leen por cliente (ver estados_cuenta.py)"""
+    for tabla, columna_fecha in (('ventas', 'fecha'), ('pedidos', 'fecha'), ('cuentas_por_cobrar', 'fecha_creacion')):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{tabla}_cliente ON {tabla}(cliente_id, {columna_fecha})')
+
+# Tablas cuyas filas alimentan cliente_metricas
+TABLAS_METRICAS_CLIENTES = ('ventas', 'cuentas_por_cobrar')
+
+def _menor(a, b):
+    """El menor de dos valores ignorando NULL (MIN escalar devuelve NULL si alguno lo es)"""
+    return f'COALESCE(MIN({a}, {b}), {a}, {b})'
+
+def _mayor(a, b):
+    return f'COALESCE(MAX({a}, {b}), {a}, {b})'
+
+def create_metricas_clientes(cursor):
+    """
+    Crea cliente_metricas (ventas, ingresos, primera y última compra, saldo pendiente
+    por cliente) y los triggers que la mantienen en cada venta, pago y borrado.
+    Las ventas que se mueven al archivo (ids en archivo_lote) no descuentan: sus
+    fechas quedan en primera_archivada / ultima_archivada para recalcular la primera
+    y última compra cuando se borra una venta activa.
+    """
+    existe = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cliente_metricas'").fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cliente_metricas (
+            cliente_id INTEGER PRIMARY KEY,
+            num_ventas INTEGER NOT NULL DEFAULT 0,
+            ingresos REAL NOT NULL DEFAULT 0,
+            primera_compra TEXT,
+            ultima_compra TEXT,
+            saldo_pendiente REAL NOT NULL DEFAULT 0,
+            facturas_pendientes INTEGER NOT NULL DEFAULT 0,
+            primera_archivada TEXT,
+            ultima_archivada TEXT
+        )
+    ''')
+    # Ranking de mejores clientes sin recorrer las ventas
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cliente_metricas_ingresos ON cliente_metricas(ingresos)')
+    
+    # Primera y última compra a partir de las ventas activas (índice cliente, fecha) y del archivo
+    primera = _menor('primera_archivada', '(SELECT MIN(fecha) FROM ventas WHERE cliente_id = old.cliente_id)')
+    ultima = _mayor('ultima_archivada', '(SELECT MAX(fecha) FROM ventas WHERE cliente_id = old.cliente_id)')
+    fechas = f'''
+        UPDATE cliente_metricas SET primera_compra = {primera}, ultima_compra = {ultima}
+        WHERE cliente_id = old.cliente_id;
+    '''
+    sumar_venta = f'''
+        INSERT INTO cliente_metricas (cliente_id, num_ventas, ingresos, primera_compra, ultima_compra)
+        SELECT new.cliente_id, 1, COALESCE(new.total, 0), new.fecha, new.fecha WHERE new.cliente_id IS NOT NULL
+        ON CONFLICT (cliente_id) DO UPDATE SET
+            num_ventas = num_ventas + 1,
+            ingresos = ingresos + excluded.ingresos,
+            primera_compra = {_menor('primera_compra', 'excluded.primera_compra')},
+            ultima_compra = {_mayor('ultima_compra', 'excluded.ultima_compra')};
+    '''
+    restar_venta = '''
+        UPDATE cliente_metricas SET num_ventas = num_ventas - 1, ingresos = ingresos - COALESCE(old.total, 0)
+        WHERE cliente_id = old.cliente_id;
+    '''
+    archivada = "EXISTS (SELECT 1 FROM archivo_lote WHERE tabla = 'ventas' AND id = old.id)"
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_metricas_ventas_insert AFTER INSERT ON ventas
+        WHEN new.cliente_id IS NOT NULL
+        BEGIN
+            {sumar_venta}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_metricas_ventas_update AFTER UPDATE OF cliente_id, total, fecha ON ventas
+        BEGIN
+            {restar_venta}
+            {sumar_venta}
+            {fechas}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_metricas_ventas_delete AFTER DELETE ON ventas
+        WHEN old.cliente_id IS NOT NULL AND NOT {archivada}
+        BEGIN
+            {restar_venta}
+            {fechas}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_metricas_ventas_archivo AFTER DELETE ON ventas
+        WHEN old.cliente_id IS NOT NULL AND {archivada}
+        BEGIN
+            UPDATE cliente_metricas SET
+                primera_archivada = {_menor('primera_archivada', 'old.fecha')},
+                ultima_archivada = {_mayor('ultima_archivada', 'old.fecha')}
+            WHERE cliente_id = old.cliente_id;
+        END
+    ''')
+    
+    # Saldo pendiente: cuentas por cobrar no pagadas con saldo (las archivadas ya están pagadas)
+    def pendiente(fila):
+        return f"({fila}.estado != 'pagado' AND {fila}.saldo > 0)"
+    sumar_cuenta = f'''
+        INSERT INTO cliente_metricas (cliente_id, saldo_pendiente, facturas_pendientes)
+        SELECT new.cliente_id, new.saldo, 1 WHERE new.cliente_id IS NOT NULL AND {pendiente('new')}
+        ON CONFLICT (cliente_id) DO UPDATE SET
+            saldo_pendiente = saldo_pendiente + excluded.saldo_pendiente,
+            facturas_pendientes = facturas_pendientes + 1;
+    '''
+    restar_cuenta = f'''
+        UPDATE cliente_metricas SET saldo_pendiente = saldo_pendiente - old.saldo, facturas_pendientes = facturas_pendientes - 1
+        WHERE cliente_id = old.cliente_id AND {pendiente('old')};
+    '''
+    for operacion, cuerpo in (('INSERT', sumar_cuenta),
+                              ('UPDATE OF cliente_id, saldo, estado', restar_cuenta + sumar_cuenta),
+                              ('DELETE', restar_cuenta)):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_metricas_cuentas_{operacion.split()[0].lower()}
+            AFTER {operacion} ON cuentas_por_cobrar
+            BEGIN
+                {cuerpo}
+            END
+        ''')
+    
+    if not existe:
+        recalcular_metricas_clientes(cursor)
+        print("OK Creada tabla cliente_metricas")
+
+def recalcular_metricas_clientes(cursor):
+    """Reconstruye cliente_metricas desde las ventas (activas y archivadas) y las cuentas por cobrar"""
+    particiones = particiones_archivo(cursor)
+    ventas = union_archivo('ventas', particiones)
+    archivadas = ' UNION ALL '.join(f'SELECT cliente_id, fecha FROM {nombre}' for nombre, _, _ in particiones.get('ventas', []))
+    cursor.execute('DELETE FROM cliente_metricas')
+    cursor.execute(f'''
+        INSERT INTO cliente_metricas (cliente_id, num_ventas, ingresos, primera_compra, ultima_compra)
+        SELECT cliente_id, COUNT(*), COALESCE(SUM(total), 0), MIN(fecha), MAX(fecha)
+        FROM {ventas} WHERE cliente_id IS NOT NULL
+        GROUP BY cliente_id
+    ''')
+    if archivadas:
+        cursor.execute(f'''
+            UPDATE cliente_metricas SET primera_archivada = a.primera, ultima_archivada = a.ultima
+            FROM (SELECT cliente_id, MIN(fecha) AS primera, MAX(fecha) AS ultima
+                  FROM ({archivadas}) GROUP BY cliente_id) a
+            WHERE cliente_metricas.cliente_id = a.cliente_id
+        ''')
+    cursor.execute('''
+        INSERT INTO cliente_metricas (cliente_id, saldo_pendiente, facturas_pendientes)
+        SELECT cliente_id, SUM(saldo), COUNT(*) FROM cuentas_por_cobrar
+        WHERE cliente_id IS NOT NULL AND estado != 'pagado' AND saldo > 0
+        GROUP BY cliente_id
+        ON CONFLICT (cliente_id) DO UPDATE SET
+            saldo_pendiente = excluded.saldo_pendiente,
+            facturas_pendientes = excluded.facturas_pendientes
+    ''')
+
+# Tablas cuyas escrituras incrementan un contador de versión
+TABLAS_VERSIONADAS = [
+    'usuarios', 'productos', 'clientes', 'pedidos', 'pedido_productos',
+    'ventas', 'cuentas_por_cobrar', 'cuentas_por_pagar', 'archivo_particiones',
+    'periodos_cerrados'
+]
+
+def create_change_counters(cursor):
+    """Crea la tabla versiones_tablas y los triggers que la mantienen"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS versiones_tablas (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    for tabla in TABLAS_VERSIONADAS:
+        cursor.execute('INSERT OR IGNORE INTO versiones_tablas (tabla, version) VALUES (?, 0)', (tabla,))
+        for operacion in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{operacion.lower()}
+                AFTER {operacion} ON {tabla}
+                BEGIN
+                    UPDATE versiones_tablas SET version = version + 1 WHERE tabla = '{tabla}';
+                END
+            ''')
+
+# Tablas cuyas filas se registran en el changelog
+TABLAS_CHANGELOG = [
+    'productos', 'clientes', 'pedidos', 'pedido_productos',
+    'ventas', 'cuentas_por_cobrar', 'cuentas_por_pagar'
+]
+
+def create_changelog(cursor):
+    """Crea la tabla changelog y los triggers que registran cada insert/update/delete"""
+    # AUTOINCREMENT garantiza que seq sea monotónico y nunca se reutilice
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changelog (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabla TEXT NOT NULL,
+            fila_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            fecha TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    for tabla in TABLAS_CHANGELOG:
+        for operacion, op, fila in (('INSERT', 'I', 'NEW'), ('UPDATE', 'U', 'NEW'), ('DELETE', 'D', 'OLD')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_changelog_{tabla}_{operacion.lower()}
+                AFTER {operacion} ON {tabla}
+                BEGIN
+                    INSERT INTO changelog (tabla, fila_id, op) VALUES ('{tabla}', {fila}.id, '{op}');
+                END
+            ''')
+
+def prune_changelog(cursor, dias):
+    """Elimina entradas del changelog más antiguas que `dias` días"""
+    cursor.execute("DELETE FROM changelog WHERE fecha < datetime('now', ?)", (f'-{int(dias)} days',))
+    return cursor.rowcount
+
+# Tabla -> [(columna, peso bm25)] indexadas en su tabla FTS5 (<tabla>_fts)
+TABLAS_FTS = {
+    'clientes': [('nombre', 10.0), ('email', 5.0), ('telefono', 5.0), ('direccion', 1.0), ('notas', 1.0)],
+    'productos': [('nombre', 10.0), ('descripcion', 1.0)],
+    'pedidos': [('notas', 1.0), ('encargado_principal', 2.0)],
+}
+
+def create_fts(cursor):
+    """Crea las tablas FTS5 de contenido externo y los triggers que las sincronizan"""
+    for tabla, pesos in TABLAS_FTS.items():
+        fts = f'{tabla}_fts'
+        columnas = [c for c, _ in pesos]
+        lista = ', '.join(columnas)
+        nuevos = ', '.join(f'new.{c}' for c in columnas)
+        viejos = ', '.join(f'old.{c}' for c in columnas)
+        existe = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)).fetchone()
+        
+        # content= evita duplicar el texto; prefix= acelera las búsquedas "term*"
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {lista}, content='{tabla}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_fts_{tabla}_insert AFTER INSERT ON {tabla}
+            BEGIN
+                INSERT INTO {fts} (rowid, {lista}) VALUES (new.id, {nuevos});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_fts_{tabla}_delete AFTER DELETE ON {tabla}
+            BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {lista}) VALUES ('delete', old.id, {viejos});
+            END
+        ''')
+        # Solo reindexar cuando cambia alguna columna indexada (no en cambios de estado)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_fts_{tabla}_update AFTER UPDATE OF {lista} ON {tabla}
+            BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {lista}) VALUES ('delete', old.id, {viejos});
+                INSERT INTO {fts} (rowid, {lista}) VALUES (new.id, {nuevos});
+            END
+        ''')
+        
+        # Ranking por defecto (ORDER BY rank) con los pesos por columna
+        cursor.execute(f"INSERT INTO {fts} ({fts}, rank) VALUES ('rank', ?)",
+                       (f"bm25({', '.join(str(p) for _, p in pesos)})",))
+        
+        if not existe:
+            # Indexar las filas que ya existían antes de crear la tabla FTS
+            cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+            print(f"OK Creado índice de texto completo {fts}")
+
 def seed_users(cursor):
     """Poblar con usuarios predefinidos para Plus Graphics"""
     users = [
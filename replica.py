@@ -0,0 +1,273 @@
+"""
+Réplica local de solo lectura de una base SQLite para reportes y exportaciones.
+La primera vez se copia la base completa con la API de backup (por pasos, sin
+bloquear a los escritores); después un hilo aplica cada pocos milisegundos las
+filas que cambiaron según el changelog (ver models.create_changelog), leyendo
+la primaria con ATTACH en modo solo lectura. Si el changelog se podó por encima
+de lo aplicado, hay demasiados cambios, el esquema cambió o una corrida de
+archivo movió filas a las particiones (ver archivo.py), se vuelve a copiar la
+base completa. Las tablas del cierre de periodos (ver cierres.py) no pasan por el
+changelog: se copian enteras cuando cambia su versión. Las métricas por cliente
+(ver models.create_metricas_clientes) tampoco: se copian las filas de los
+clientes de las ventas y cuentas por cobrar que cambiaron.
+
+La réplica no tiene triggers (se eliminan tras cada copia completa): los
+cambios se aplican tal cual vienen de la primaria, incluida versiones_tablas.
+El último seq aplicado se guarda en la propia réplica (tabla _replica) para
+continuar de forma incremental tras un reinicio del proceso.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from archivo import firma_archivo
+from cierres import TABLAS_CIERRE, version_cierres
+from models import TABLAS_CHANGELOG, TABLAS_METRICAS_CLIENTES
+from respaldos import copiar_por_pasos
+
+class ReplicaLectura:
+    """Copia local de `ruta_primaria` en `ruta_replica`, mantenida por changelog"""
+
+    def __init__(self, ruta_primaria, ruta_replica, intervalo=0.5, delta_max_filas=20000,
+                 paginas_por_paso=256, pragmas=()):
+        self.ruta_primaria = ruta_primaria
+        self.ruta_replica = ruta_replica
+        self.intervalo = intervalo
+        self.delta_max_filas = delta_max_filas
+        self.paginas_por_paso = paginas_por_paso
+        self.pragmas = pragmas
+        self.lock = threading.Lock()
+        self.detenida = threading.Event()
+        self.hilo = None
+        self.conn = None
+        self.seq = None
+        self.error = None
+        # Último momento (monotonic) en que la réplica estaba al día con la primaria
+        self.al_dia_desde = None
+        self.cargas_completas = 0
+        self.sincronizaciones = 0
+        self.filas_aplicadas = 0
+        self.ms_ultima_sincronizacion = None
+        self.lecturas = 0
+        self.lecturas_con_espera = 0
+
+    def iniciar(self):
+        """Arranca el hilo que mantiene la réplica al día"""
+        with self.lock:
+            if self.hilo is not None:
+                return
+            self.hilo = threading.Thread(target=self._bucle, name=f'replica:{self.ruta_replica}', daemon=True)
+            self.hilo.start()
+
+    def _bucle(self):
+        while not self.detenida.wait(self.intervalo):
+            with self.lock:
+                try:
+                    self._sincronizar()
+                    self.error = None
+                except Exception as e:
+                    if self.error != str(e):
+                        print(f"⚠️ Error sincronizando la réplica {self.ruta_replica}: {e}")
+                    self.error = str(e)
+
+    def _abrir(self):
+        if self.conn is not None:
+            return
+        directorio = os.path.dirname(self.ruta_replica)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.conn = sqlite3.connect(self.ruta_replica, uri=True, check_same_thread=False, isolation_level=None)
+        ruta = os.path.abspath(self.ruta_primaria).replace('?', '%3f').replace('#', '%23')
+        self.conn.execute('ATTACH DATABASE ? AS primaria', (f'file:{ruta}?mode=ro',))
+        try:
+            self.seq = self.conn.execute('SELECT seq FROM main._replica').fetchone()[0]
+        except (sqlite3.Error, TypeError):
+            self.seq = None
+
+    def _seq_primaria(self):
+        fila = self.conn.execute("SELECT seq FROM primaria.sqlite_sequence WHERE name = 'changelog'").fetchone()
+        return fila[0] if fila else 0
+
+    def _cierres_pendientes(self):
+        return version_cierres(self.conn, 'primaria') != version_cierres(self.conn, 'main')
+
+    def _carga_completa(self):
+        origen = sqlite3.connect(self.ruta_primaria)
+        try:
+            # El seq se lee antes de copiar: lo que entre durante la copia se vuelve
+            # a aplicar en la siguiente sincronización (borrar + insertar es idempotente)
+            fila = origen.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'").fetchone()
+            seq = fila[0] if fila else 0
+            copiar_por_pasos(origen, self.conn, self.paginas_por_paso, 0, 20)
+        finally:
+            origen.close()
+
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            triggers = self.conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'trigger'").fetchall()
+            for (nombre,) in triggers:
+                self.conn.execute(f'DROP TRIGGER main."{nombre}"')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS main._replica (seq INTEGER NOT NULL)')
+            self.conn.execute('DELETE FROM main._replica')
+            self.conn.execute('INSERT INTO main._replica (seq) VALUES (?)', (seq,))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.seq = seq
+        self.cargas_completas += 1
+
+    def _aplicar_cambios(self):
+        """Aplica los cambios posteriores a self.seq: None si no había cambios, False si
+        hace falta una copia completa"""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # La transacción fija una misma instantánea de la primaria para todo el lote
+            ultimo = self._seq_primaria()
+            cierres = self._cierres_pendientes()
+            if ultimo == self.seq and not cierres:
+                self.conn.execute('ROLLBACK')
+                return None
+            minimo = self.conn.execute('SELECT MIN(seq) FROM primaria.changelog').fetchone()[0]
+            if ultimo < self.seq or minimo is None or minimo > self.seq + 1:
+                # Primaria restaurada o changelog podado por encima de lo aplicado
+                self.conn.execute('ROLLBACK')
+                return False
+            if firma_archivo(self.conn, 'primaria') != firma_archivo(self.conn, 'main'):
+                # Las particiones de archivo no tienen changelog
+                self.conn.execute('ROLLBACK')
+                return False
+
+            cambios = self.conn.execute('''
+                SELECT tabla, fila_id FROM primaria.changelog WHERE seq > ? AND seq <= ?
+            ''', (self.seq, ultimo)).fetchall()
+            if len(cambios) > self.delta_max_filas:
+                self.conn.execute('ROLLBACK')
+                return False
+
+            por_tabla = {}
+            for tabla, fila_id in cambios:
+                if tabla in TABLAS_CHANGELOG:
+                    por_tabla.setdefault(tabla, set()).add(fila_id)
+            clientes = set()
+            for tabla, ids in por_tabla.items():
+                ids = json.dumps(sorted(ids))
+                # Clientes de las filas antes y después del cambio
+                consulta_clientes = f'SELECT cliente_id FROM main.{tabla} WHERE id IN (SELECT value FROM json_each(?))'
+                if tabla in TABLAS_METRICAS_CLIENTES:
+                    clientes.update(fila[0] for fila in self.conn.execute(consulta_clientes, (ids,)))
+                self.conn.execute(f'DELETE FROM main.{tabla} WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+                self.conn.execute(f'''
+                    INSERT INTO main.{tabla} SELECT * FROM primaria.{tabla}
+                    WHERE id IN (SELECT value FROM json_each(?))
+                ''', (ids,))
+                if tabla in TABLAS_METRICAS_CLIENTES:
+                    clientes.update(fila[0] for fila in self.conn.execute(consulta_clientes, (ids,)))
+            clientes.discard(None)
+            if clientes:
+                clientes = json.dumps(sorted(clientes))
+                self.conn.execute('''
+                    DELETE FROM main.cliente_metricas WHERE cliente_id IN (SELECT value FROM json_each(?))
+                ''', (clientes,))
+                self.conn.execute('''
+                    INSERT INTO main.cliente_metricas SELECT * FROM primaria.cliente_metricas
+                    WHERE cliente_id IN (SELECT value FROM json_each(?))
+                ''', (clientes,))
+            if cierres:
+                for tabla in TABLAS_CIERRE:
+                    self.conn.execute(f'DELETE FROM main.{tabla}')
+                    self.conn.execute(f'INSERT INTO main.{tabla} SELECT * FROM primaria.{tabla}')
+            self.conn.execute('DELETE FROM main.versiones_tablas')
+            self.conn.execute('INSERT INTO main.versiones_tablas SELECT * FROM primaria.versiones_tablas')
+            self.conn.execute('UPDATE main._replica SET seq = ?', (ultimo,))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.seq = ultimo
+        self.filas_aplicadas += len(cambios)
+        return True
+
+    def _sincronizar(self):
+        """Pone la réplica al día (se llama con self.lock tomado)"""
+        self._abrir()
+        inicio = time.perf_counter()
+        if self.seq is None:
+            self._carga_completa()
+        else:
+            try:
+                aplicado = self._aplicar_cambios()
+            except sqlite3.OperationalError:
+                # Columnas distintas tras una migración de la primaria
+                aplicado = False
+            if aplicado is None:
+                self.al_dia_desde = time.monotonic()
+                return
+            if not aplicado:
+                self._carga_completa()
+        self.al_dia_desde = time.monotonic()
+        self.sincronizaciones += 1
+        self.ms_ultima_sincronizacion = round((time.perf_counter() - inicio) * 1000, 2)
+
+    def conexion(self):
+        """Conexión de solo lectura a la réplica ya al día, o None si no está disponible"""
+        with self.lock:
+            try:
+                self._abrir()
+                if self.seq is None or self._seq_primaria() != self.seq or self._cierres_pendientes():
+                    # El hilo aún no aplicó los últimos commits: se aplican ahora para
+                    # que la lectura vea lo mismo que vería en la primaria
+                    self.lecturas_con_espera += 1
+                    self._sincronizar()
+            except Exception as e:
+                self.error = str(e)
+                return None
+            self.lecturas += 1
+
+        ruta = os.path.abspath(self.ruta_replica).replace('?', '%3f').replace('#', '%23')
+        conn = sqlite3.connect(f'file:{ruta}?mode=ro', uri=True, check_same_thread=False)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def lag(self):
+        """(cambios pendientes, segundos desde que la réplica estuvo al día)"""
+        with self.lock:
+            if self.conn is None or self.seq is None:
+                return None, None
+            try:
+                pendientes = self._seq_primaria() - self.seq
+            except sqlite3.Error:
+                return None, None
+            if pendientes <= 0:
+                return 0, 0.0
+            return pendientes, round(time.monotonic() - self.al_dia_desde, 3)
+
+    def cerrar(self):
+        self.detenida.set()
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def metricas(self):
+        pendientes, segundos = self.lag()
+        with self.lock:
+            return {
+                'ruta': self.ruta_replica,
+                'seq': self.seq,
+                'lag_cambios': pendientes,
+                'lag_segundos': segundos,
+                'error': self.error,
+                'cargas_completas': self.cargas_completas,
+                'sincronizaciones': self.sincronizaciones,
+                'filas_aplicadas': self.filas_aplicadas,
+                'ms_ultima_sincronizacion': self.ms_ultima_sincronizacion,
+                'lecturas': self.lecturas,
+                'lecturas_con_espera': self.lecturas_con_espera
+            }
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Respaldos en caliente de la base SQLite con la API de backup de SQLite
+(sqlite3.Connection.backup). La copia se hace por pasos de N páginas con una
+pausa entre pasos, así los escritores no quedan bloqueados durante toda la
+copia. Cada respaldo se verifica (PRAGMA integrity_check) y se guarda con un
+manifiesto .json con su SHA-256; al restaurar se vuelve a verificar.
+
+Los respaldos de una base quedan en <directorio>/<nombre>-YYYYmmdd-HHMMSS.db y
+solo se conservan los `retener` más recientes.
+
+Uso:
+    python respaldos.py crear --db database.db --directorio backups
+    python respaldos.py listar --directorio backups
+    python respaldos.py verificar backups/database-20250101-030000.db
+    python respaldos.py restaurar backups/database-20250101-030000.db --db database.db
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+class ErrorRespaldo(Exception):
+    """Respaldo corrupto, sin manifiesto o cuyo checksum no coincide"""
+
+class _DemasiadosReinicios(Exception):
+    pass
+
+def sha256_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def copiar_por_pasos(origen, destino, paginas, pausa, max_reinicios):
+    """Copia por pasos; devuelve (pasos, reinicios). Si otra conexión escribe en la
+    base durante la copia SQLite la reinicia: tras `max_reinicios` se termina en
+    un solo paso, que en modo WAL tampoco bloquea a los escritores"""
+    estado = {'pasos': 0, 'reinicios': 0, 'restantes': None}
+
+    def progreso(status, restantes, total):
+        if estado['restantes'] is not None and restantes > estado['restantes']:
+            estado['reinicios'] += 1
+            if estado['reinicios'] > max_reinicios:
+                raise _DemasiadosReinicios()
+        estado['restantes'] = restantes
+        estado['pasos'] += 1
+        if restantes and pausa:
+            time.sleep(pausa)
+
+    try:
+        origen.backup(destino, pages=paginas, progress=progreso)
+    except _DemasiadosReinicios:
+        origen.backup(destino, pages=-1)
+        estado['pasos'] += 1
+    return estado['pasos'], estado['reinicios']
+
+def verificar_integridad(ruta):
+    conn = sqlite3.connect(f'file:{ruta}?mode=ro', uri=True)
+    try:
+        resultado = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+    if resultado != 'ok':
+        raise ErrorRespaldo(f'{ruta}: integrity_check falló ({resultado})')
+
+def crear_respaldo(ruta_db, directorio, retener=7, paginas=256, pausa=0.005, max_reinicios=20):
+    """Respalda `ruta_db` en `directorio`, lo verifica y aplica la retención; devuelve el manifiesto"""
+    os.makedirs(directorio, exist_ok=True)
+    nombre = os.path.splitext(os.path.basename(ruta_db))[0]
+    destino = os.path.join(directorio, f'{nombre}-{datetime.now().strftime("%Y%m%d-%H%M%S")}.db')
+    sufijo = 1
+    while os.path.exists(destino):
+        sufijo += 1
+        destino = os.path.join(directorio, f'{nombre}-{datetime.now().strftime("%Y%m%d-%H%M%S")}-{sufijo}.db')
+    parcial = destino + '.parcial'
+
+    inicio = time.perf_counter()
+    origen = sqlite3.connect(ruta_db)
+    copia = sqlite3.connect(parcial)
+    try:
+        pasos, reinicios = copiar_por_pasos(origen, copia, paginas, pausa, max_reinicios)
+        # El respaldo queda como un único archivo autocontenido (sin -wal)
+        copia.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        copia.close()
+        origen.close()
+    segundos_copia = time.perf_counter() - inicio
+
+    try:
+        verificar_integridad(parcial)
+    except ErrorRespaldo:
+        os.remove(parcial)
+        raise
+    os.replace(parcial, destino)
+
+    manifiesto = {
+        'archivo': os.path.basename(destino),
+        'origen': ruta_db,
+        'fecha': datetime.now().isoformat(),
+        'bytes': os.path.getsize(destino),
+        'sha256': sha256_archivo(destino),
+        'pasos': pasos,
+        'paginas_por_paso': paginas,
+        'reinicios': reinicios,
+        'segundos_copia': round(segundos_copia, 3),
+        'segundos_total': round(time.perf_counter() - inicio, 3)
+    }
+    with open(destino + '.json', 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2)
+
+    manifiesto['eliminados'] = aplicar_retencion(directorio, nombre, retener)
+    return manifiesto
+
+def listar_respaldos(directorio, nombre=None):
+    """Manifiestos de los respaldos de `directorio`, del más reciente al más antiguo"""
+    if not os.path.isdir(directorio):
+        return []
+    respaldos = []
+    for archivo in os.listdir(directorio):
+        if not archivo.endswith('.db.json'):
+            continue
+        if nombre and not archivo.startswith(f'{nombre}-'):
+            continue
+        try:
+            with open(os.path.join(directorio, archivo), encoding='utf-8') as f:
+                respaldos.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(respaldos, key=lambda m: m['fecha'], reverse=True)
+
+def aplicar_retencion(directorio, nombre, retener):
+    """Elimina los respaldos de `nombre` más allá de los `retener` más recientes"""
+    eliminados = []
+    for manifiesto in listar_respaldos(directorio, nombre)[max(retener, 1):]:
+        ruta = os.path.join(directorio, manifiesto['archivo'])
+        for archivo in (ruta, ruta + '.json'):
+            if os.path.exists(archivo):
+                os.remove(archivo)
+        eliminados.append(manifiesto['archivo'])
+    return eliminados
+
+def verificar_respaldo(ruta):
+    """Comprueba el checksum contra el manifiesto y la integridad; ErrorRespaldo si falla"""
+    try:
+        with open(ruta + '.json', encoding='utf-8') as f:
+            manifiesto = json.load(f)
+    except FileNotFoundError:
+        raise ErrorRespaldo(f'{ruta}: no tiene manifiesto')
+    if sha256_archivo(ruta) != manifiesto['sha256']:
+        raise ErrorRespaldo(f'{ruta}: el checksum no coincide con el manifiesto')
+    verificar_integridad(ruta)
+    return manifiesto
+
+def _contadores(conn):
+    """(versiones_tablas, último seq del changelog) de una base; vacíos si no tiene contadores"""
+    try:
+        versiones = dict(conn.execute('SELECT tabla, version FROM versiones_tablas').fetchall())
+        fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'").fetchone()
+    except sqlite3.OperationalError:
+        return {}, 0
+    return versiones, fila[0] if fila else 0
+
+def _adelantar_contadores(conn, versiones, seq):
+    """
+    Deja los contadores de la base restaurada por encima de los que tenía antes:
+    si volvieran atrás, las escrituras siguientes repetirían versiones (ETags
+    iguales con datos distintos) y seqs que los clientes de /api/sync ya vieron.
+    El changelog se vacía para que todo cursor anterior pida una resincronización
+    completa (410) y la réplica y el motor analítico hagan una carga completa.
+    """
+    restaurados, seq_restaurado = _contadores(conn)
+    if not restaurados:
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for tabla, version in restaurados.items():
+            conn.execute('UPDATE versiones_tablas SET version = ? WHERE tabla = ?',
+                         (max(version, versiones.get(tabla, 0)) + 1, tabla))
+        conn.execute('DELETE FROM changelog')
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'changelog'")
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('changelog', ?)",
+                     (max(seq, seq_restaurado) + 1,))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def restaurar_respaldo(ruta_respaldo, ruta_db):
+    """Verifica el respaldo y lo copia sobre `ruta_db` con la API de backup, de modo
+    que las conexiones abiertas ven la base restaurada completa o no la ven (los
+    contadores de versión y del changelog nunca vuelven atrás)"""
+    verificar_respaldo(ruta_respaldo)
+    inicio = time.perf_counter()
+    origen = sqlite3.connect(f'file:{ruta_respaldo}?mode=ro', uri=True)
+    destino = sqlite3.connect(ruta_db, isolation_level=None)
+    try:
+        versiones, seq = _contadores(destino)
+        origen.backup(destino)
+        # La copia trae el journal_mode del respaldo: la base en uso vuelve a WAL
+        destino.execute('PRAGMA journal_mode = WAL')
+        _adelantar_contadores(destino, versiones, seq)
+    finally:
+        destino.close()
+        origen.close()
+    return round(time.perf_counter() - inicio, 3)
+
+def main():
+    parser = argparse.ArgumentParser(description='Respaldos en caliente de la base SQLite')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    crear = subparsers.add_parser('crear', help='Crear un respaldo verificado')
+    crear.add_argument('--db', default='database.db')
+    crear.add_argument('--directorio', default='backups')
+    crear.add_argument('--retener', type=int, default=7)
+    crear.add_argument('--paginas', type=int, default=256, help='Páginas copiadas por paso')
+
+    listar = subparsers.add_parser('listar', help='Listar los respaldos disponibles')
+    listar.add_argument('--directorio', default='backups')
+
+    verificar = subparsers.add_parser('verificar', help='Verificar checksum e integridad')
+    verificar.add_argument('respaldo')
+
+    restaurar = subparsers.add_parser('restaurar', help='Restaurar un respaldo sobre la base')
+    restaurar.add_argument('respaldo')
+    restaurar.add_argument('--db', default='database.db')
+    restaurar.add_argument('--directorio', default='backups',
+                           help='Donde guardar un respaldo de la base actual antes de restaurar')
+    restaurar.add_argument('--sin-respaldo-previo', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        if args.comando == 'crear':
+            m = crear_respaldo(args.db, args.directorio, retener=args.retener, paginas=args.paginas)
+            print(f"OK {m['archivo']} ({m['bytes'] / 1024 / 1024:.1f} MB, {m['pasos']} pasos, "
+                  f"{m['reinicios']} reinicios, {m['segundos_total']}s) sha256={m['sha256']}")
+            for archivo in m['eliminados']:
+                print(f"Eliminado por retención: {archivo}")
+        elif args.comando == 'listar':
+            for m in listar_respaldos(args.directorio):
+                print(f"{m['archivo']}  {m['fecha']}  {m['bytes'] / 1024 / 1024:.1f} MB  {m['sha256'][:12]}")
+        elif args.comando == 'verificar':
+            m = verificar_respaldo(args.respaldo)
+            print(f"OK {m['archivo']}: checksum e integridad correctos")
+        elif args.comando == 'restaurar':
+            if not args.sin_respaldo_previo and os.path.exists(args.db):
+                previo = crear_respaldo(args.db, args.directorio, retener=10 ** 6)
+                print(f"Respaldo de la base actual: {previo['archivo']}")
+            segundos = restaurar_respaldo(args.respaldo, args.db)
+            print(f"OK {args.respaldo} restaurado sobre {args.db} ({segundos}s)")
+    except ErrorRespaldo as e:
+        print(f"ERROR {e}")
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Snapshots columnares (Parquet, zstd) de las tablas de hechos para análisis
+offline: ventas, líneas de pedido, pedidos y cuentas por cobrar/pagar. Cada
+tabla se escribe en <directorio>/<tabla>/mes=YYYY-MM/part-*.parquet
+(particionado Hive por mes de su fecha), legible con DuckDB, Polars, Spark o
+pandas/pyarrow:
+
+    SELECT * FROM read_parquet('snapshots/ventas/*/*.parquet', hive_partitioning = true)
+
+Las corridas son incrementales: se guarda el último id exportado por tabla y
+solo se agregan archivos con las filas nuevas a las particiones de su mes. Las
+filas ya exportadas que luego se modificaron (según el changelog) hacen que se
+reescriba solo la partición de su mes; un borrado, un cambio que puede mover
+la fila de mes o un changelog podado reescriben la tabla completa.
+
+Cada tabla se lee junto con sus particiones de archivo (ver archivo.py), así el
+snapshot conserva todo el historial. Una corrida de archivo borra filas de las
+tablas activas, por lo que la siguiente corrida reescribe esas tablas completas.
+
+Requiere duckdb (pip install duckdb), que escribe Parquet sin depender de pyarrow.
+
+Uso:
+    python snapshots_columnar.py
+    python snapshots_columnar.py --db database.db --directorio snapshots --completo
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+from analitica import cargar_en_duckdb, duckdb, tipo_duckdb
+from archivo import particiones_archivo, union_archivo
+
+# tabla -> (expresión de fecha que define la partición, join necesario para
+# obtenerla ({pedidos} incluye el archivo), tablas cuyos cambios afectan a lo ya
+# exportado, si la fecha nunca se edita). Con fecha fija un update solo reescribe la partición de su mes; si
+# la fecha puede cambiar (pedidos) la fila podría cambiar de partición y la
+# tabla se reescribe completa
+TABLAS_SNAPSHOT = {
+    'ventas': ('t.fecha', '', ['ventas'], True),
+    'pedidos': ('t.fecha', '', ['pedidos'], False),
+    'pedido_productos': ('p.fecha', 'LEFT JOIN {pedidos} p ON p.id = t.pedido_id', ['pedido_productos', 'pedidos'], False),
+    'cuentas_por_cobrar': ('t.fecha_creacion', '', ['cuentas_por_cobrar'], True),
+    'cuentas_por_pagar': ('t.fecha_creacion', '', ['cuentas_por_pagar'], True),
+}
+
+ARCHIVO_ESTADO = '_snapshot.json'
+MES_SIN_FECHA = 'sin-fecha'
+
+def leer_estado(directorio):
+    """Estado de la última corrida ({} si nunca se generó un snapshot)"""
+    try:
+        with open(os.path.join(directorio, ARCHIVO_ESTADO), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _guardar_estado(directorio, estado):
+    ruta = os.path.join(directorio, ARCHIVO_ESTADO)
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(estado, f, indent=2)
+    os.replace(ruta + '.tmp', ruta)
+
+def _ultimo_seq(conn):
+    fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'").fetchone()
+    return fila[0] if fila else 0
+
+def _cambios_exportados(conn, tabla, seq_anterior, seq_actual):
+    """Filas ya exportadas que cambiaron desde la última corrida: (reescribir_todo, ids_modificados)"""
+    _, _, tablas_origen, fecha_fija = TABLAS_SNAPSHOT[tabla]
+    if seq_actual == seq_anterior:
+        return False, set()
+    minimo = conn.execute('SELECT MIN(seq) FROM changelog').fetchone()[0]
+    if minimo is None or minimo > seq_anterior + 1:
+        # Changelog podado: no se puede saber qué cambió
+        return True, set()
+    
+    marcadores = ', '.join('?' * len(tablas_origen))
+    cambios = conn.execute(f'''
+        SELECT DISTINCT tabla, fila_id, op FROM changelog
+        WHERE seq > ? AND seq <= ? AND op != 'I' AND tabla IN ({marcadores})
+    ''', (seq_anterior, seq_actual, *tablas_origen)).fetchall()
+    ids = set()
+    for origen, fila_id, op in cambios:
+        # De una fila borrada no se conoce el mes en que quedó exportada
+        if op == 'D' or origen != tabla or not fecha_fija:
+            return True, set()
+        ids.add(fila_id)
+    return False, ids
+
+def _expresion_mes(tabla):
+    fecha = TABLAS_SNAPSHOT[tabla][0]
+    return f"COALESCE(substr({fecha}, 1, 7), '{MES_SIN_FECHA}')"
+
+def _origen(tabla, particiones):
+    """FROM y JOIN de una tabla del snapshot, incluidas sus particiones de archivo"""
+    _, join, _, _ = TABLAS_SNAPSHOT[tabla]
+    return union_archivo(tabla, particiones), join.format(pedidos=union_archivo('pedidos', particiones))
+
+def _meses_de(conn, tabla, ids, hasta_id, particiones):
+    """Meses (particiones) de las filas `ids` ya exportadas"""
+    if not ids:
+        return []
+    origen, join = _origen(tabla, particiones)
+    return [fila[0] for fila in conn.execute(f'''
+        SELECT DISTINCT {_expresion_mes(tabla)} FROM {origen} t {join}
+        WHERE t.id IN (SELECT value FROM json_each(?)) AND t.id <= ?
+    ''', (json.dumps(sorted(ids)), hasta_id))]
+
+def _contenido_directorio(duck, directorio):
+    """(archivos, bytes, filas) de los Parquet de una tabla del snapshot"""
+    archivos = []
+    for raiz, _, nombres in os.walk(directorio):
+        archivos += [os.path.join(raiz, nombre) for nombre in nombres if nombre.endswith('.parquet')]
+    if not archivos:
+        return 0, 0, 0
+    # El conteo sale de los metadatos de cada archivo, sin leer los datos
+    filas = duck.execute('SELECT COUNT(*) FROM read_parquet(?)', [archivos]).fetchone()[0]
+    return len(archivos), sum(os.path.getsize(archivo) for archivo in archivos), filas
+
+def _reemplazar(origen, destino):
+    """Reemplaza el directorio `destino` por `origen` (los lectores nunca ven uno a medias)"""
+    anterior = destino + '.anterior'
+    shutil.rmtree(anterior, ignore_errors=True)
+    if os.path.exists(destino):
+        os.replace(destino, anterior)
+    os.replace(origen, destino)
+    shutil.rmtree(anterior, ignore_errors=True)
+
+def _copiar_parquet(duck, condicion, salida, hasta_id):
+    os.makedirs(salida, exist_ok=True)
+    ruta = salida.replace("'", "''")
+    duck.execute(f'''
+        COPY (SELECT * FROM lote WHERE {condicion} ORDER BY id) TO '{ruta}'
+        (FORMAT parquet, COMPRESSION zstd, PARTITION_BY (mes), APPEND,
+         FILENAME_PATTERN 'part-{hasta_id:012d}-{{uuid}}')
+    ''')
+
+def _exportar_tabla(conn, duck, directorio, tabla, desde_id, hasta_id, completo, meses_reescribir, particiones):
+    """Agrega las filas con desde_id < id <= hasta_id y reescribe las particiones de
+    `meses_reescribir` (todas si `completo`); devuelve (filas escritas, meses tocados)"""
+    origen, join = _origen(tabla, particiones)
+    mes = _expresion_mes(tabla)
+    columnas = {fila[1]: tipo_duckdb(fila[2]) for fila in conn.execute(f'PRAGMA table_info({tabla})')}
+    cursor = conn.execute(f'''
+        SELECT {", ".join(f"t.{c}" for c in columnas)}, {mes} AS mes
+        FROM {origen} t {join}
+        WHERE t.id <= ? AND (t.id > ? OR {mes} IN (SELECT value FROM json_each(?)))
+    ''', (hasta_id, desde_id, json.dumps(meses_reescribir)))
+    columnas['mes'] = 'VARCHAR'
+    cargar_en_duckdb(duck, 'lote', cursor, columnas)
+    filas, meses = duck.execute(
+        'SELECT COUNT(*), COALESCE(list(DISTINCT mes ORDER BY mes), []) FROM lote').fetchone()
+    
+    destino = os.path.join(directorio, tabla)
+    nuevo = destino + '.nuevo'
+    shutil.rmtree(nuevo, ignore_errors=True)
+    if completo:
+        # Se escribe aparte y reemplaza al snapshot anterior al final
+        _copiar_parquet(duck, 'true', nuevo, hasta_id)
+        _reemplazar(nuevo, destino)
+        return filas, meses
+    
+    if meses_reescribir:
+        duck.execute('CREATE OR REPLACE TEMP TABLE meses_reescribir AS SELECT UNNEST(?::VARCHAR[]) AS mes',
+                     [meses_reescribir])
+        _copiar_parquet(duck, 'mes IN (SELECT mes FROM meses_reescribir)', nuevo, hasta_id)
+        for particion in meses_reescribir:
+            origen = os.path.join(nuevo, f'mes={particion}')
+            if os.path.exists(origen):
+                _reemplazar(origen, os.path.join(destino, f'mes={particion}'))
+            else:
+                # Ya no quedan filas en ese mes
+                shutil.rmtree(os.path.join(destino, f'mes={particion}'), ignore_errors=True)
+        shutil.rmtree(nuevo, ignore_errors=True)
+        condicion = 'mes NOT IN (SELECT mes FROM meses_reescribir)'
+    else:
+        condicion = 'true'
+    _copiar_parquet(duck, condicion, destino, hasta_id)
+    return filas, meses
+
+def generar_snapshot(ruta_db, directorio, completo=False):
+    """Agrega al snapshot de `directorio` las filas nuevas de `ruta_db`; devuelve un resumen"""
+    if duckdb is None:
+        raise RuntimeError('duckdb no está instalado (pip install duckdb)')
+
+    os.makedirs(directorio, exist_ok=True)
+    inicio = time.perf_counter()
+    estado = leer_estado(directorio)
+    estado.setdefault('tablas', {})
+    resumen = {}
+
+    conn = sqlite3.connect(ruta_db)
+    duck = duckdb.connect(':memory:')
+    try:
+        # Una sola transacción de lectura: todas las tablas del mismo instante
+        conn.execute('BEGIN')
+        seq = _ultimo_seq(conn)
+        particiones = particiones_archivo(conn)
+        for tabla in TABLAS_SNAPSHOT:
+            previo = estado['tablas'].get(tabla)
+            hasta_id = conn.execute(
+                f'SELECT COALESCE(MAX(id), 0) FROM {union_archivo(tabla, particiones)}').fetchone()[0]
+            completa = (completo or previo is None
+                        or not os.path.isdir(os.path.join(directorio, tabla))
+                        or hasta_id < previo['ultimo_id'])
+            meses_reescribir = []
+            if not completa:
+                completa, modificadas = _cambios_exportados(conn, tabla, previo['seq'], seq)
+                meses_reescribir = _meses_de(conn, tabla, modificadas, previo['ultimo_id'], particiones)
+            desde_id = 0 if completa else previo['ultimo_id']
+            
+            filas, meses = _exportar_tabla(conn, duck, directorio, tabla, desde_id, hasta_id,
+                                           completa, meses_reescribir, particiones)
+            archivos, tamano, total = _contenido_directorio(duck, os.path.join(directorio, tabla))
+            estado['tablas'][tabla] = {
+                'ultimo_id': hasta_id, 'seq': seq, 'filas': total, 'archivos': archivos, 'bytes': tamano
+            }
+            # Se guarda tabla por tabla: si una falla, las ya escritas no se repiten
+            estado['generado'] = datetime.now().isoformat()
+            _guardar_estado(directorio, estado)
+            resumen[tabla] = {
+                'modo': 'completo' if completa else 'incremental',
+                'filas_escritas': filas,
+                'meses_reescritos': meses if completa else meses_reescribir,
+                'meses': meses
+            }
+        conn.rollback()
+    finally:
+        duck.close()
+        conn.close()
+
+    return {
+        'directorio': directorio,
+        'tablas': resumen,
+        'segundos': round(time.perf_counter() - inicio, 3),
+        'estado': estado
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot Parquet particionado por mes de las tablas de hechos')
+    parser.add_argument('--db', default='database.db')
+    parser.add_argument('--directorio', default='snapshots')
+    parser.add_argument('--completo', action='store_true', help='Reescribir todas las tablas desde cero')
+    args = parser.parse_args()
+
+    resultado = generar_snapshot(args.db, args.directorio, completo=args.completo)
+    for tabla, datos in resultado['tablas'].items():
+        total = resultado['estado']['tablas'][tabla]
+        print(f"OK {tabla}: {datos['modo']}, {datos['filas_escritas']} filas escritas "
+              f"({total['filas']} en total, {total['archivos']} archivos, {total['bytes'] / 1024:.0f} KB)")
+    print(f"Snapshot generado en {args.directorio} ({resultado['segundos']}s)")
+
+if __name__ == '__main__':
+    main()
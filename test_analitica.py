@@ -0,0 +1,56 @@
+"""Tests del motor analítico (analitica.MotorAnalitico): el snapshot DuckDB sigue a la base SQLite"""
+
+import sqlite3
+
+import pytest
+
+pytest.importorskip('duckdb')
+
+from analitica import MotorAnalitico
+
+@pytest.fixture
+def motor(base_datos):
+    motor = MotorAnalitico(base_datos)
+    yield motor
+    motor.cerrar()
+
+def assert_ventas_iguales(motor, base_datos):
+    conexion = motor.conexion()
+    assert conexion is not None, motor.error
+    analiticas = [tuple(f) for f in conexion.execute('SELECT id, cliente_id, total FROM ventas ORDER BY id').fetchall()]
+    conexion.close()
+    conn = sqlite3.connect(base_datos)
+    assert analiticas == conn.execute('SELECT id, cliente_id, total FROM ventas ORDER BY id').fetchall()
+    conn.close()
+
+def escribir(base_datos, *sentencias):
+    conn = sqlite3.connect(base_datos)
+    for sql in sentencias:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+def test_aplica_los_cambios_por_changelog(motor, base_datos):
+    assert_ventas_iguales(motor, base_datos)
+    escribir(base_datos, 'UPDATE ventas SET total = 1 WHERE id = 1', 'DELETE FROM ventas WHERE id = 2')
+
+    assert_ventas_iguales(motor, base_datos)
+    assert motor.metricas()['cargas_completas'] == 1
+
+def test_restaurar_un_respaldo_fuerza_carga_completa(motor, base_datos, tmp_path):
+    respaldo = str(tmp_path / 'respaldo.db')
+    origen, destino = sqlite3.connect(base_datos), sqlite3.connect(respaldo)
+    origen.backup(destino)
+    assert_ventas_iguales(motor, base_datos)
+
+    escribir(base_datos, *(f'UPDATE ventas SET total = 1 WHERE id = {i}' for i in range(1, 6)))
+    assert_ventas_iguales(motor, base_datos)
+
+    # El respaldo también devuelve sqlite_sequence: el changelog vuelve atrás
+    destino.backup(origen)
+    origen.close()
+    destino.close()
+    escribir(base_datos, 'UPDATE ventas SET total = 2 WHERE id = 10')
+
+    assert_ventas_iguales(motor, base_datos)
+    assert motor.metricas()['cargas_completas'] == 2
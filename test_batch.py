@@ -0,0 +1,67 @@
+"""Tests de /api/batch: las caches en memoria no se llenan desde el snapshot del batch"""
+
+import sqlite3
+
+import pytest
+from flask import g
+
+@pytest.fixture
+def en_batch(backend):
+    """Contexto de petición con un snapshot de batch abierto (como ejecutar_batch)"""
+    with backend.app.test_request_context('/api/batch', method='POST'):
+        conn = backend.get_db_connection()
+        conn.execute('BEGIN')
+        conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone()
+        g.conexion_batch = backend._ConexionCompartida(conn)
+        try:
+            yield conn
+        finally:
+            g.pop('conexion_batch', None)
+            conn.rollback()
+            conn.close()
+
+def escribir(base_datos, sql, params=()):
+    conn = sqlite3.connect(base_datos)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+def test_catalogo_no_se_carga_del_snapshot(backend, base_datos, en_batch):
+    escribir(base_datos, 'UPDATE productos SET precio = 999999 WHERE id = 1')
+
+    catalogo = backend.catalogo_productos()
+    assert catalogo.todos()[1].precio == 999999
+    assert catalogo.version == backend.get_versiones_tablas()['productos']
+
+def test_subpeticiones_no_guardan_en_la_cache(backend, en_batch):
+    backend.limpiar_cache_lecturas()
+    adaptador = backend.app.url_map.bind('')
+    for ruta in ('/api/reportes/clientes-top', '/api/reportes/dashboard'):
+        assert backend._ejecutar_subpeticion(adaptador, ruta)[0] == 200
+    assert backend.get_metricas_coalescing()['entradas_cache'] == 0
+
+def test_subpeticion_lee_el_snapshot_aunque_haya_cache(backend, base_datos, cliente, en_batch):
+    # Resultado cacheado fuera del batch, posterior al snapshot (el test client comparte g)
+    compartida = g.pop('conexion_batch')
+    version_snapshot = backend.version_tabla(compartida, 'clientes')
+    escribir(base_datos, """
+        UPDATE clientes SET nombre = 'Renombrado'
+        WHERE id = (SELECT cliente_id FROM cliente_metricas ORDER BY ingresos DESC LIMIT 1)
+    """)
+    assert cliente.get('/api/reportes/clientes-top').status_code == 200
+    assert backend.get_metricas_coalescing()['entradas_cache'] == 1
+    g.conexion_batch = compartida
+
+    adaptador = backend.app.url_map.bind('')
+    status, cuerpo = backend._ejecutar_subpeticion(adaptador, '/api/reportes/clientes-top')
+    assert status == 200
+    assert 'Renombrado' not in [c['nombre'] for c in cuerpo]
+    assert f'clientes:{version_snapshot}' in g.firma_versiones.split('|')
+    assert backend.get_metricas_coalescing()['entradas_cache'] == 1
+
+def test_autocompletado_no_se_carga_del_snapshot(backend, base_datos, en_batch):
+    escribir(base_datos, "UPDATE clientes SET nombre = 'Zzyzx Recien Renombrado' WHERE id = 1")
+
+    indice = backend.indices_autocompletar()['clientes']
+    assert [r['id'] for r in indice.buscar('zzyzx', 5)] == [1]
+    assert indice.version == backend.get_versiones_tablas()['clientes']
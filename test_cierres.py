@@ -0,0 +1,96 @@
+"""Tests del cierre de periodos: los reportes con meses cerrados dan lo mismo que en vivo"""
+
+import sqlite3
+
+import pytest
+
+from archivo import horizonte_meses
+
+RUTAS_REPORTES = [
+    '/api/reportes/dashboard',
+    '/api/reportes/ingresos-tipo',
+    '/api/reportes/tendencia',
+    '/api/reportes/tendencia?periodo=semana',
+    '/api/reportes/productos-top',
+    '/api/reportes/clientes-top',
+    '/api/dashboard/stats',
+]
+
+def redondear(valor):
+    # Sumar por mes y luego entre meses cambia el orden de la suma en coma flotante
+    if isinstance(valor, float):
+        return round(valor, 2)
+    if isinstance(valor, dict):
+        return {k: redondear(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [redondear(v) for v in valor]
+    return valor
+
+def reportes(cliente):
+    resultado = {}
+    for ruta in RUTAS_REPORTES:
+        respuesta = cliente.get(ruta)
+        assert respuesta.status_code == 200, ruta
+        resultado[ruta] = redondear(respuesta.get_json())
+    return resultado
+
+def cerrar(cliente, hasta):
+    respuesta = cliente.post(f'/api/periodos/cerrar?hasta={hasta}')
+    assert respuesta.status_code == 200, respuesta.get_json()
+    return respuesta.get_json()
+
+@pytest.fixture
+def hasta():
+    """Último mes a cerrar: hace un año (los datos sintéticos cubren tres)"""
+    return horizonte_meses(12)[:7]
+
+def venta_en_mes_cerrado(base_datos, hasta):
+    conn = sqlite3.connect(base_datos)
+    try:
+        return conn.execute('SELECT id, substr(fecha, 1, 7) FROM ventas WHERE fecha < ? ORDER BY id LIMIT 1',
+                            (f'{hasta}-01',)).fetchone()
+    finally:
+        conn.close()
+
+def test_reportes_iguales_con_meses_cerrados(cliente, hasta):
+    en_vivo = reportes(cliente)
+    cerrar(cliente, hasta)
+
+    periodos = cliente.get('/api/periodos').get_json()
+    assert periodos['periodos'] and periodos['corte'] > f'{hasta}-01'
+    assert reportes(cliente) == en_vivo
+
+def test_reportes_iguales_con_cierre_y_archivo(cliente, hasta):
+    en_vivo = reportes(cliente)
+    cerrar(cliente, hasta)
+    respuesta = cliente.post(f'/api/archivo?antes_de={horizonte_meses(18)}')
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['movidas'].get('ventas')
+
+    assert reportes(cliente) == en_vivo
+
+def test_edicion_en_mes_cerrado_bloqueada(cliente, base_datos, hasta):
+    cerrar(cliente, hasta)
+    venta_id, _ = venta_en_mes_cerrado(base_datos, hasta)
+
+    assert cliente.delete(f'/api/ventas/{venta_id}').status_code == 409
+
+def test_mes_desactualizado_se_lee_en_vivo(cliente, backend, base_datos, hasta, monkeypatch):
+    cerrar(cliente, hasta)
+    venta_id, mes = venta_en_mes_cerrado(base_datos, hasta)
+    monkeypatch.setattr(backend, 'CIERRE_BLOQUEAR_EDICIONES', False)
+
+    assert cliente.delete(f'/api/ventas/{venta_id}').status_code == 200
+    periodos = cliente.get('/api/periodos').get_json()['periodos']
+    assert [p['mes'] for p in periodos if p['desactualizado']] == [mes]
+    con_desactualizado = reportes(cliente)
+
+    # Reabrir todo deja los reportes calculados solo en vivo
+    primer_mes = min(p['mes'] for p in periodos)
+    assert cliente.delete(f'/api/periodos/{primer_mes}').status_code == 200
+    assert cliente.get('/api/periodos').get_json()['periodos'] == []
+    assert reportes(cliente) == con_desactualizado
+
+    # Volver a cerrar congela el mes ya corregido
+    cerrar(cliente, hasta)
+    assert reportes(cliente) == con_desactualizado
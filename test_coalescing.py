@@ -0,0 +1,107 @@
+"""Tests del coalescing y la cache de lecturas (app.coalescer)"""
+
+import threading
+import time
+
+import pytest
+
+import app as backend
+
+@pytest.fixture(autouse=True)
+def cache_vacia():
+    backend.limpiar_cache_lecturas()
+    yield
+    backend.limpiar_cache_lecturas()
+
+def lectura_contada(ttl=60, bloqueo=None, dentro=None):
+    """Handler envuelto con coalescer que cuenta sus ejecuciones"""
+    llamadas = []
+
+    def handler():
+        llamadas.append(1)
+        if dentro is not None:
+            dentro()
+        if bloqueo is not None:
+            bloqueo.wait(5)
+        return backend.jsonify({'llamada': len(llamadas)})
+
+    return backend.coalescer(ttl)(handler), llamadas
+
+def pedir(envuelto, ruta='/api/prueba'):
+    with backend.app.test_request_context(ruta):
+        respuesta = envuelto()
+        return respuesta.status_code, respuesta.get_json()
+
+def test_peticiones_simultaneas_ejecutan_el_handler_una_vez():
+    dentro = threading.Event()
+    liberar = threading.Event()
+    envuelto, llamadas = lectura_contada(bloqueo=liberar, dentro=dentro.set)
+    resultados = []
+
+    def peticion():
+        resultados.append(pedir(envuelto))
+
+    coalescidas = backend.get_metricas_coalescing()['coalescidas']
+    lider = threading.Thread(target=peticion)
+    lider.start()
+    assert dentro.wait(5)
+    seguidores = [threading.Thread(target=peticion) for _ in range(4)]
+    for hilo in seguidores:
+        hilo.start()
+    limite = time.monotonic() + 5
+    while backend.get_metricas_coalescing()['coalescidas'] < coalescidas + 4 and time.monotonic() < limite:
+        time.sleep(0.01)
+    liberar.set()
+    for hilo in [lider] + seguidores:
+        hilo.join(5)
+
+    assert len(llamadas) == 1
+    assert resultados == [(200, {'llamada': 1})] * 5
+
+def test_resultado_cacheado_hasta_invalidar():
+    envuelto, llamadas = lectura_contada()
+    assert pedir(envuelto) == (200, {'llamada': 1})
+    assert pedir(envuelto) == (200, {'llamada': 1})
+    assert len(llamadas) == 1
+
+    backend.limpiar_cache_lecturas()
+    assert pedir(envuelto) == (200, {'llamada': 2})
+
+def test_lider_que_empezo_antes_de_una_escritura_no_guarda_su_resultado():
+    envuelto, llamadas = lectura_contada(dentro=backend.limpiar_cache_lecturas)
+    pedir(envuelto)
+    pedir(envuelto)
+    assert len(llamadas) == 2
+    assert backend.get_metricas_coalescing()['entradas_cache'] == 0
+
+def test_cache_acotada_descarta_las_menos_usadas(monkeypatch):
+    monkeypatch.setattr(backend, 'CACHE_MAX_ENTRADAS', 3)
+    envuelto, llamadas = lectura_contada()
+    for pagina in range(5):
+        pedir(envuelto, f'/api/prueba?page={pagina}')
+    # La página 2 se vuelve a usar: pasa a ser la más reciente
+    pedir(envuelto, '/api/prueba?page=2')
+    pedir(envuelto, '/api/prueba?page=5')
+
+    claves = list(backend._cache_lecturas)
+    assert len(claves) == 3
+    assert [c.split('?')[1].split('#')[0] for c in claves] == ['page=4', 'page=2', 'page=5']
+    assert len(llamadas) == 6
+
+def test_cache_descarta_entradas_vencidas_al_llenarse(monkeypatch):
+    monkeypatch.setattr(backend, 'CACHE_MAX_ENTRADAS', 2)
+    vencida, _ = lectura_contada(ttl=0.01)
+    vigente, _ = lectura_contada(ttl=60)
+    pedir(vencida, '/api/prueba?q=vieja')
+    time.sleep(0.02)
+    pedir(vigente, '/api/prueba?q=a')
+    pedir(vigente, '/api/prueba?q=b')
+    assert [c.split('?')[1].split('#')[0] for c in backend._cache_lecturas] == ['q=a', 'q=b']
+
+def test_escritura_invalida_los_reportes(cliente, backend):
+    assert cliente.get('/api/reportes/clientes-top').status_code == 200
+    assert backend.get_metricas_coalescing()['entradas_cache'] == 1
+
+    respuesta = cliente.post('/api/ventas', json={'cliente_id': 1, 'producto_id': 1, 'cantidad': 1})
+    assert respuesta.status_code == 201
+    assert backend.get_metricas_coalescing()['entradas_cache'] == 0
@@ -0,0 +1,31 @@
+"""Tests del dashboard: los contadores en vivo (SSE) y /api/dashboard/stats coinciden"""
+
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+CAMPOS = ('ganancias_totales', 'entregas_pendientes', 'servicios_disponibles',
+          'total_por_pagar', 'total_por_cobrar', 'facturas_vencidas')
+
+def test_contadores_y_stats_usan_el_mismo_dia(backend, cliente, base_datos, monkeypatch):
+    # Una factura que vence mañana (UTC) y un reloj local dos días adelantado:
+    # solo la cuentan vencida ambos si los dos usan el mismo día
+    manana = (datetime.now(timezone.utc) + timedelta(days=1)).strftime('%Y-%m-%d')
+    conn = sqlite3.connect(base_datos)
+    conn.execute('''
+        INSERT INTO cuentas_por_pagar (codigo_factura, proveedor, monto, monto_pagado, saldo, fecha_vencimiento, estado)
+        VALUES ('CP-TEST', 'Proveedor', 100, 0, 100, ?, 'pendiente')
+    ''', (manana,))
+    conn.commit()
+    conn.close()
+
+    class Adelantado(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(days=2)
+
+    monkeypatch.setattr(backend, 'datetime', Adelantado)
+    stats = cliente.get('/api/dashboard/stats').get_json()
+    with backend.app.test_request_context('/api/eventos'):
+        contadores = backend.contadores_dashboard()
+
+    assert {c: round(stats[c], 2) for c in CAMPOS} == {c: round(contadores[c], 2) for c in CAMPOS}
@@ -0,0 +1,52 @@
+"""Tests de /api/export: streaming sin ordenar en memoria y mismas filas que la base"""
+
+import sqlite3
+
+import pytest
+
+from archivo import archivar, horizonte_meses
+
+DESDE, HASTA = horizonte_meses(24), horizonte_meses(6)
+
+@pytest.fixture
+def consultas(backend, monkeypatch):
+    """SQL de cada exportación, capturado al crear el generador"""
+    capturadas = []
+    original = backend._generar_exportacion
+
+    def capturar(conn, sql, params, formato):
+        capturadas.append((sql, params))
+        return original(conn, sql, params, formato)
+
+    monkeypatch.setattr(backend, '_generar_exportacion', capturar)
+    return capturadas
+
+def exportar(cliente, entidad, rango=True):
+    ruta = f'/api/export/{entidad}' + (f'?desde={DESDE}&hasta={HASTA}' if rango else '')
+    respuesta = cliente.get(ruta)
+    assert respuesta.status_code == 200
+    return [linea for linea in respuesta.get_data(as_text=True).splitlines() if linea]
+
+@pytest.mark.parametrize('archivado', [False, True])
+@pytest.mark.parametrize('entidad', ['ventas', 'pedidos', 'pedido-productos', 'cuentas-por-cobrar'])
+def test_exportacion_sin_ordenar_en_memoria(cliente, base_datos, consultas, entidad, archivado):
+    conn = sqlite3.connect(base_datos)
+    if archivado:
+        archivar(conn, horizonte_meses(12))
+    exportar(cliente, entidad)
+    exportar(cliente, entidad, rango=False)
+
+    for sql, params in consultas:
+        plan = [fila[3] for fila in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+        assert not [paso for paso in plan if 'TEMP B-TREE' in paso], plan
+    conn.close()
+
+def test_exportacion_con_rango_devuelve_las_filas_del_rango(cliente, base_datos):
+    conn = sqlite3.connect(base_datos)
+    esperadas = conn.execute("SELECT COUNT(*) FROM ventas WHERE fecha >= ? AND fecha < date(?, '+1 day')",
+                             (DESDE, HASTA)).fetchone()[0]
+    archivar(conn, horizonte_meses(12))
+    conn.close()
+
+    assert esperadas > 0
+    assert len(exportar(cliente, 'ventas')) == esperadas
@@ -0,0 +1,72 @@
+"""Tests de la proyección de flujo de caja (flujo_caja.proyectar_flujo)"""
+
+import sqlite3
+from datetime import date
+
+import pytest
+
+import flujo_caja
+from flujo_caja import GRANULARIDADES, proyectar_flujo
+
+HOY = date.today()
+
+@pytest.fixture
+def conn(base_datos):
+    conn = sqlite3.connect(base_datos)
+    yield conn
+    conn.close()
+
+def saldo_abierto(conn, tabla, fin):
+    return conn.execute(f'''
+        SELECT COALESCE(SUM(saldo), 0) FROM {tabla}
+        WHERE estado != 'pagado' AND saldo > 0 AND fecha_vencimiento < ?
+    ''', (fin,)).fetchone()[0]
+
+@pytest.mark.parametrize('granularidad', GRANULARIDADES)
+def test_totales_coinciden_con_los_saldos_abiertos(conn, granularidad):
+    flujo = proyectar_flujo(conn, dias=90, granularidad=granularidad, saldo_inicial=1000.0, hoy=HOY)
+    fin = flujo['periodos'][-1]['fin']
+
+    entradas = saldo_abierto(conn, 'cuentas_por_cobrar', f'{fin}~')
+    salidas = saldo_abierto(conn, 'cuentas_por_pagar', f'{fin}~')
+    assert flujo['totales']['entradas'] == pytest.approx(entradas, abs=0.01)
+    assert flujo['totales']['salidas'] == pytest.approx(salidas, abs=0.01)
+    assert flujo['periodos'][0]['inicio'] == HOY.isoformat()
+    assert flujo['periodos'][-1]['saldo'] == flujo['totales']['saldo_final']
+    assert flujo['totales']['saldo_final'] == pytest.approx(1000.0 + entradas - salidas, abs=0.05)
+
+def test_ponderar_solo_reduce_los_cobros_vencidos(conn):
+    completo = proyectar_flujo(conn, dias=60, granularidad='mes', hoy=HOY)
+    ponderado = proyectar_flujo(conn, dias=60, granularidad='mes', ponderar=True, hoy=HOY)
+
+    assert completo['vencido']['cobrar'] > 0
+    assert ponderado['vencido']['cobrar'] < completo['vencido']['cobrar']
+    assert ponderado['vencido']['pagar'] == completo['vencido']['pagar']
+    assert ponderado['totales']['salidas'] == completo['totales']['salidas']
+    # Lo vencido cae en el primer periodo: el resto no cambia
+    assert ponderado['periodos'][1:] == [
+        {**p, 'saldo': pytest.approx(p['saldo'] - (completo['totales']['neto'] - ponderado['totales']['neto']), abs=0.05)}
+        for p in completo['periodos'][1:]
+    ]
+
+def test_granularidad_invalida(conn):
+    with pytest.raises(ValueError):
+        proyectar_flujo(conn, granularidad='anio', hoy=HOY)
+
+@pytest.mark.parametrize('ponderar', [False, True])
+@pytest.mark.parametrize('granularidad', GRANULARIDADES)
+def test_numpy_igual_que_python(conn, granularidad, ponderar):
+    pytest.importorskip('numpy')
+    assert flujo_caja.np is not None
+
+    python = proyectar_flujo(conn, dias=120, granularidad=granularidad, ponderar=ponderar, hoy=HOY,
+                             umbral_numpy=10 ** 9)
+    numpy = proyectar_flujo(conn, dias=120, granularidad=granularidad, ponderar=ponderar, hoy=HOY,
+                            umbral_numpy=0)
+
+    assert (python['motor'], numpy['motor']) == ('python', 'numpy')
+    assert numpy['vencido'] == pytest.approx(python['vencido'], abs=0.01)
+    assert numpy['totales'] == pytest.approx(python['totales'], abs=0.01)
+    assert len(numpy['periodos']) == len(python['periodos'])
+    for periodo_numpy, periodo_python in zip(numpy['periodos'], python['periodos']):
+        assert periodo_numpy == pytest.approx(periodo_python, abs=0.01)
@@ -0,0 +1,105 @@
+"""Tests de importar_datos.py: importes con ',' o '.' decimal, delimitadores y validación por fila"""
+
+import io
+import sqlite3
+
+import pytest
+
+from importar_datos import ESQUEMAS_IMPORTACION, _real, importar, leer_filas, validar_fila
+
+@pytest.mark.parametrize('texto, esperado', [
+    ('12.5', 12.5),
+    ('12,5', 12.5),
+    ('1,234.50', 1234.5),
+    ('1.234,50', 1234.5),
+    ('1.234.567', 1234567.0),
+    ('1,234,567.8', 1234567.8),
+    ('-1.234,5', -1234.5),
+    (' 0,125 ', 0.125),
+    ('1234,567', 1234.567),
+    ('7', 7.0),
+    (3, 3.0),
+    (2.75, 2.75),
+])
+def test_real_deduce_el_separador(texto, esperado):
+    assert _real(texto) == esperado
+
+@pytest.mark.parametrize('texto', ['1.234', '1,234', '', '-', 'abc', '1.2.3,4,5', '12,34.56,7', '1,23,456.7', True])
+def test_real_rechaza_ambiguos_e_invalidos(texto):
+    with pytest.raises(ValueError):
+        _real(texto)
+
+@pytest.mark.parametrize('texto, separador, esperado', [
+    ('1.234', ',', 1234.0),
+    ('1.234', '.', 1.234),
+    ('1,234', ',', 1.234),
+    ('1.234,5', ',', 1234.5),
+])
+def test_real_con_separador_fijo(texto, separador, esperado):
+    assert _real(texto, separador) == esperado
+
+def test_validar_fila():
+    _, columnas = ESQUEMAS_IMPORTACION['ventas']
+    fila = {'producto_id': '3', 'cantidad': 2.0, 'total': '1.234,50', 'fecha': '2024-05-01', 'cliente_id': ' '}
+    assert validar_fila(columnas, fila) == (None, 3, 2, 1234.5, '2024-05-01 00:00:00', None, 'pagado')
+
+    with pytest.raises(ValueError, match="'producto_id' es requerido"):
+        validar_fila(columnas, {**fila, 'producto_id': ''})
+    with pytest.raises(ValueError, match="'total'"):
+        validar_fila(columnas, {**fila, 'total': '1,234'})
+    with pytest.raises(ValueError, match="'fecha'"):
+        validar_fila(columnas, {**fila, 'fecha': '01/05/2024'})
+
+def filas_csv(contenido, delimitador=None):
+    return list(leer_filas(io.BytesIO(contenido.encode('utf-8-sig')), 'csv', delimitador))
+
+def test_leer_filas_deduce_el_delimitador():
+    esperadas = [{'nombre': 'Taza', 'tipo': 'Regalo', 'precio': '1.234,50'}]
+    assert filas_csv('nombre;tipo;precio\r\nTaza;Regalo;1.234,50\r\n') == esperadas
+    assert filas_csv('nombre,tipo,precio\nTaza,Regalo,"1.234,50"\n') == esperadas
+    assert filas_csv('nombre\ttipo\tprecio\nTaza\tRegalo\t1.234,50\n') == esperadas
+    assert filas_csv('nombre\nTaza\n') == [{'nombre': 'Taza'}]
+
+def test_leer_filas_con_delimitador_fijo():
+    assert filas_csv('nombre;tipo\nTaza;Regalo\n', ';') == [{'nombre': 'Taza', 'tipo': 'Regalo'}]
+    with pytest.raises(ValueError):
+        filas_csv('nombre\nTaza\n', ':')
+
+@pytest.fixture
+def conn(base_datos):
+    conn = sqlite3.connect(base_datos)
+    yield conn
+    conn.close()
+
+def test_importar_csv_con_punto_y_coma(conn):
+    contenido = 'nombre;tipo;precio\nTaza;Regalo;1.234,50\nLlavero;Regalo;12,5\nSin precio;Regalo;\nAmbiguo;Regalo;1,234\n'
+    resumen = importar(conn, 'productos', filas_csv(contenido))
+
+    assert (resumen['insertadas'], resumen['rechazadas']) == (2, 2)
+    assert [e['fila'] for e in resumen['errores']] == [4, 5]
+    assert conn.execute("SELECT nombre, precio FROM productos WHERE tipo = 'Regalo' ORDER BY id").fetchall() == [
+        ('Taza', 1234.5), ('Llavero', 12.5)]
+
+def test_importar_rechaza_referencias_inexistentes(conn):
+    filas = [
+        {'producto_id': '1', 'cantidad': '1', 'total': '10,5', 'fecha': '2099-01-01'},
+        {'producto_id': '999999', 'cantidad': '1', 'total': '10', 'fecha': '2099-01-01'},
+    ]
+    antes = conn.execute('SELECT COUNT(*) FROM ventas').fetchone()[0]
+    resumen = importar(conn, 'ventas', filas, separador_decimal=',')
+
+    assert resumen['insertadas'] == 1
+    assert resumen['errores'] == [{'fila': 3, 'error': "'producto_id' 999999 no existe"}]
+    assert conn.execute('SELECT COUNT(*) FROM ventas').fetchone()[0] == antes + 1
+    # Los índices diferidos se recrean al final
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND name = 'idx_ventas_fecha'").fetchone()[0] == 1
+
+def test_endpoint_importa_con_delimitador(cliente):
+    datos = {'archivo': (io.BytesIO('nombre;tipo;precio\nTaza;Regalo;3,5\n'.encode()), 'productos.csv')}
+    respuesta = cliente.post('/api/import/productos?delimitador=;', data=datos, content_type='multipart/form-data')
+    assert respuesta.status_code == 201
+    assert respuesta.get_json()['insertadas'] == 1
+
+    datos = {'archivo': (io.BytesIO(b'nombre\nTaza\n'), 'productos.csv')}
+    assert cliente.post('/api/import/productos?delimitador=:', data=datos,
+                        content_type='multipart/form-data').status_code == 400
@@ -0,0 +1,136 @@
+"""Tests de cliente_metricas: los triggers dan lo mismo que recalcular, también con ventas archivadas"""
+
+import sqlite3
+
+import pytest
+
+from archivo import archivar, horizonte_meses
+from models import recalcular_metricas_clientes
+
+COLUMNAS = ('cliente_id', 'num_ventas', 'ingresos', 'primera_compra', 'ultima_compra',
+            'saldo_pendiente', 'facturas_pendientes')
+
+@pytest.fixture
+def conn(base_datos):
+    conn = sqlite3.connect(base_datos)
+    yield conn
+    conn.close()
+
+def metricas(conn):
+    filas = conn.execute(f'SELECT {", ".join(COLUMNAS)} FROM cliente_metricas ORDER BY cliente_id').fetchall()
+    # Sumar de a una venta y agrupar todas cambia el orden de la suma en coma flotante
+    return [tuple(round(v, 2) if isinstance(v, float) else v for v in fila) for fila in filas]
+
+def recalculadas(conn):
+    """cliente_metricas reconstruida desde cero, sin tocar la base (la transacción se descarta)"""
+    conn.commit()
+    recalcular_metricas_clientes(conn.cursor())
+    resultado = metricas(conn)
+    conn.rollback()
+    return resultado
+
+def assert_igual_a_recalcular(conn):
+    conn.commit()
+    assert metricas(conn) == recalculadas(conn)
+
+def test_carga_inicial_igual_a_las_ventas_y_cuentas(conn):
+    ventas = {fila[0]: fila[1:] for fila in conn.execute('''
+        SELECT cliente_id, COUNT(*), ROUND(SUM(total), 2), MIN(fecha), MAX(fecha)
+        FROM ventas GROUP BY cliente_id
+    ''')}
+    cuentas = {fila[0]: fila[1:] for fila in conn.execute('''
+        SELECT cliente_id, ROUND(SUM(saldo), 2), COUNT(*) FROM cuentas_por_cobrar
+        WHERE estado != 'pagado' AND saldo > 0 GROUP BY cliente_id
+    ''')}
+
+    for cliente_id, *resto in metricas(conn):
+        assert tuple(resto[:4]) == ventas.get(cliente_id, (0, 0.0, None, None))
+        assert tuple(resto[4:]) == cuentas.get(cliente_id, (0.0, 0))
+    assert_igual_a_recalcular(conn)
+
+def test_escrituras_de_ventas_mantienen_las_metricas(conn):
+    conn.execute("INSERT INTO ventas (cliente_id, producto_id, cantidad, total, fecha) VALUES (3, 1, 2, 50.0, '2001-01-01')")
+    conn.execute("INSERT INTO ventas (cliente_id, producto_id, cantidad, total, fecha) VALUES (4, 1, 1, 25.5, '2099-01-01')")
+    assert_igual_a_recalcular(conn)
+
+    conn.execute("UPDATE ventas SET total = total * 2, fecha = '2000-06-01' WHERE id = 10")
+    conn.execute('UPDATE ventas SET cliente_id = 9 WHERE id = 11')
+    assert_igual_a_recalcular(conn)
+
+    # Borrar la primera y la última venta de un cliente recalcula sus fechas
+    primera, ultima = conn.execute('''
+        SELECT (SELECT id FROM ventas WHERE cliente_id = 3 ORDER BY fecha LIMIT 1),
+               (SELECT id FROM ventas WHERE cliente_id = 3 ORDER BY fecha DESC LIMIT 1)
+    ''').fetchone()
+    conn.execute('DELETE FROM ventas WHERE id IN (?, ?)', (primera, ultima))
+    conn.execute('DELETE FROM ventas WHERE cliente_id = 5')
+    assert_igual_a_recalcular(conn)
+
+def test_pagos_y_borrados_de_cuentas_mantienen_el_saldo(conn):
+    pendientes = [fila[0] for fila in conn.execute(
+        "SELECT id FROM cuentas_por_cobrar WHERE estado != 'pagado' AND saldo > 0 ORDER BY id LIMIT 6")]
+    assert len(pendientes) == 6
+
+    conn.execute("UPDATE cuentas_por_cobrar SET saldo = 0, monto_pagado = monto, estado = 'pagado' WHERE id = ?",
+                 (pendientes[0],))
+    conn.execute('UPDATE cuentas_por_cobrar SET saldo = saldo / 2, monto_pagado = monto - saldo / 2 WHERE id = ?',
+                 (pendientes[1],))
+    conn.execute('UPDATE cuentas_por_cobrar SET cliente_id = 1 WHERE id = ?', (pendientes[2],))
+    conn.execute('DELETE FROM cuentas_por_cobrar WHERE id IN (?, ?)', (pendientes[3], pendientes[4]))
+    conn.execute('''
+        INSERT INTO cuentas_por_cobrar (numero_factura, cliente_id, monto, monto_pagado, saldo, fecha_vencimiento, estado)
+        VALUES ('FAC-TEST', 2, 100.0, 0, 100.0, '2099-01-01', 'pendiente')
+    ''')
+    assert_igual_a_recalcular(conn)
+
+def test_archivar_no_cambia_las_metricas(conn):
+    antes = metricas(conn)
+
+    movidas = archivar(conn, horizonte_meses(12))['movidas']
+    assert movidas.get('ventas')
+
+    assert metricas(conn) == antes
+    assert conn.execute('SELECT COUNT(*) FROM cliente_metricas WHERE primera_archivada IS NOT NULL').fetchone()[0] > 0
+    assert_igual_a_recalcular(conn)
+
+def test_borrar_ventas_activas_con_ventas_archivadas(conn):
+    archivar(conn, horizonte_meses(12))
+    cliente_id = conn.execute('''
+        SELECT m.cliente_id FROM cliente_metricas m
+        WHERE m.primera_archivada IS NOT NULL
+          AND (SELECT COUNT(*) FROM ventas v WHERE v.cliente_id = m.cliente_id) >= 3
+        ORDER BY m.cliente_id LIMIT 1
+    ''').fetchone()[0]
+
+    # La primera compra activa es posterior a las archivadas; la última sí cambia
+    for orden in ('fecha', 'fecha DESC'):
+        conn.execute(f'''
+            DELETE FROM ventas WHERE id = (SELECT id FROM ventas WHERE cliente_id = ? ORDER BY {orden} LIMIT 1)
+        ''', (cliente_id,))
+        assert_igual_a_recalcular(conn)
+
+    conn.execute('DELETE FROM ventas WHERE cliente_id = ?', (cliente_id,))
+    assert_igual_a_recalcular(conn)
+    primera, ultima, archivada = conn.execute('''
+        SELECT primera_compra, ultima_compra, ultima_archivada FROM cliente_metricas WHERE cliente_id = ?
+    ''', (cliente_id,)).fetchone()
+    assert primera is not None and ultima == archivada
+
+def test_endpoints_leen_cliente_metricas(cliente, base_datos):
+    conn = sqlite3.connect(base_datos)
+    fila = conn.execute('SELECT * FROM cliente_metricas WHERE cliente_id = 1').fetchone()
+    ranking = [nombre for nombre, in conn.execute('''
+        SELECT c.nombre FROM cliente_metricas m JOIN clientes c ON c.id = m.cliente_id
+        WHERE m.num_ventas > 0 ORDER BY m.ingresos DESC LIMIT 10
+    ''')]
+    conn.close()
+
+    respuesta = cliente.get('/api/clientes/1')
+    assert respuesta.status_code == 200
+    datos = respuesta.get_json()['metricas']
+    assert datos['num_ventas'] == fila[1]
+    assert datos['ingresos'] == round(fila[2], 2)
+    assert (datos['primera_compra'], datos['ultima_compra']) == (fila[3], fila[4])
+
+    top = cliente.get('/api/reportes/clientes-top').get_json()
+    assert [c['nombre'] for c in top] == ranking
@@ -0,0 +1,24 @@
+"""Tests de ?fields= e ?include= en los listados (app.construir_proyeccion)"""
+
+def listar(cliente, ruta):
+    respuesta = cliente.get(ruta)
+    assert respuesta.status_code == 200, respuesta.get_json()
+    return respuesta.get_json()
+
+def test_pedidos_con_productos_solo_devuelven_los_campos_pedidos(cliente):
+    pedidos = listar(cliente, '/api/pedidos?fields=fecha&include=productos')
+    assert pedidos and all(set(p) == {'fecha', 'productos'} for p in pedidos)
+    assert any(p['productos'] for p in pedidos)
+
+    completos = {p['id']: p for p in listar(cliente, '/api/pedidos?fields=id,fecha&include=productos')}
+    assert set(next(iter(completos.values()))) == {'id', 'fecha', 'productos'}
+    assert [p['productos'] for p in pedidos] == [p['productos'] for p in completos.values()]
+
+def test_ventas_con_producto_no_agregan_producto_id(cliente):
+    ventas = listar(cliente, '/api/ventas?fields=total&include=producto')
+    assert ventas and all(set(v) == {'total', 'producto_nombre'} for v in ventas)
+
+def test_include_repetido_y_desconocido(cliente):
+    assert listar(cliente, '/api/pedidos?fields=fecha&include=productos,productos') == \
+        listar(cliente, '/api/pedidos?fields=fecha&include=productos')
+    assert cliente.get('/api/pedidos?include=facturas').status_code == 400
@@ -0,0 +1,93 @@
+"""Tests de la réplica de lectura (replica.ReplicaLectura): copia completa y catch-up por changelog"""
+
+import sqlite3
+
+import pytest
+
+from archivo import archivar, horizonte_meses
+from replica import ReplicaLectura
+
+TABLAS_COMPARADAS = [
+    'clientes', 'productos', 'pedidos', 'pedido_productos', 'ventas',
+    'cuentas_por_cobrar', 'cuentas_por_pagar', 'cliente_metricas', 'versiones_tablas'
+]
+
+@pytest.fixture
+def replica(base_datos, tmp_path):
+    replica = ReplicaLectura(base_datos, str(tmp_path / 'replicas' / 'default.db'))
+    yield replica
+    replica.cerrar()
+
+def contenido(conn, tabla):
+    return conn.execute(f'SELECT * FROM {tabla} ORDER BY rowid').fetchall()
+
+def assert_igual_a_primaria(replica, base_datos, tablas=TABLAS_COMPARADAS):
+    lectura = replica.conexion()
+    assert lectura is not None, replica.error
+    primaria = sqlite3.connect(base_datos)
+    try:
+        for tabla in tablas:
+            assert [tuple(f) for f in contenido(lectura, tabla)] == contenido(primaria, tabla), tabla
+    finally:
+        lectura.close()
+        primaria.close()
+
+def escribir(base_datos, *sentencias):
+    conn = sqlite3.connect(base_datos)
+    for sql, params in sentencias:
+        conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+def test_aplica_los_cambios_sin_copia_completa(replica, base_datos):
+    assert_igual_a_primaria(replica, base_datos)
+    assert replica.cargas_completas == 1
+
+    escribir(base_datos,
+             ("INSERT INTO ventas (cliente_id, producto_id, cantidad, total, fecha) VALUES (3, 1, 2, 50.0, '2030-01-01')", ()),
+             ('UPDATE clientes SET nombre = ? WHERE id = 7', ('Cliente renombrado',)),
+             ('UPDATE ventas SET cliente_id = 9 WHERE id = 11', ()),
+             ('DELETE FROM ventas WHERE id = 12', ()),
+             ('DELETE FROM pedido_productos WHERE pedido_id = 5', ()),
+             ('DELETE FROM pedidos WHERE id = 5', ()),
+             ("UPDATE cuentas_por_cobrar SET saldo = 0, monto_pagado = monto, estado = 'pagado' WHERE id <= 20", ()))
+
+    assert_igual_a_primaria(replica, base_datos)
+    assert replica.cargas_completas == 1
+    assert replica.filas_aplicadas > 0
+
+def test_continua_desde_el_ultimo_seq_tras_reiniciar(replica, base_datos):
+    assert_igual_a_primaria(replica, base_datos)
+    replica.cerrar()
+
+    escribir(base_datos, ('UPDATE productos SET precio = precio + 1 WHERE id = 2', ()))
+    reiniciada = ReplicaLectura(base_datos, replica.ruta_replica)
+    try:
+        assert_igual_a_primaria(reiniciada, base_datos)
+        assert reiniciada.cargas_completas == 0
+    finally:
+        reiniciada.cerrar()
+
+def test_changelog_podado_provoca_copia_completa(replica, base_datos):
+    assert_igual_a_primaria(replica, base_datos)
+
+    escribir(base_datos,
+             ('UPDATE clientes SET notas = ? WHERE id = 1', ('cambio',)),
+             ('UPDATE clientes SET notas = ? WHERE id = 2', ('cambio',)),
+             ('DELETE FROM changelog', ()))
+    escribir(base_datos, ('UPDATE clientes SET notas = ? WHERE id = 3', ('cambio',)))
+
+    assert_igual_a_primaria(replica, base_datos)
+    assert replica.cargas_completas == 2
+
+def test_archivo_provoca_copia_completa_con_particiones(replica, base_datos):
+    assert_igual_a_primaria(replica, base_datos)
+
+    conn = sqlite3.connect(base_datos)
+    movidas = archivar(conn, horizonte_meses(12))['movidas']
+    particiones = [fila[0] for fila in conn.execute('SELECT nombre FROM archivo_particiones')]
+    conn.close()
+    assert movidas.get('ventas')
+
+    assert_igual_a_primaria(replica, base_datos, TABLAS_COMPARADAS + particiones)
+    assert replica.cargas_completas == 2
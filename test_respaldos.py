@@ -0,0 +1,50 @@
+"""Tests de respaldos.py: restaurar sobre una base en uso no hace volver atrás los contadores"""
+
+import os
+import sqlite3
+
+import pytest
+
+from respaldos import crear_respaldo, restaurar_respaldo
+
+def contadores(base_datos):
+    conn = sqlite3.connect(base_datos)
+    versiones = dict(conn.execute('SELECT tabla, version FROM versiones_tablas'))
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'").fetchone()[0]
+    conn.close()
+    return versiones, seq
+
+@pytest.fixture
+def respaldo(base_datos, tmp_path):
+    directorio = str(tmp_path / 'backups')
+    return os.path.join(directorio, crear_respaldo(base_datos, directorio)['archivo'])
+
+def test_restaurar_adelanta_versiones_y_changelog(cliente, base_datos, respaldo):
+    assert cliente.put('/api/clientes/1', json={'nombre': 'Después del respaldo'}).status_code == 200
+    etag = cliente.get('/api/clientes').headers['ETag']
+    versiones, seq = contadores(base_datos)
+
+    restaurar_respaldo(respaldo, base_datos)
+
+    restauradas, seq_restaurado = contadores(base_datos)
+    assert all(restauradas[t] > v for t, v in versiones.items())
+    assert seq_restaurado > seq
+    # El ETag de antes no sirve para los datos restaurados
+    respuesta = cliente.get('/api/clientes', headers={'If-None-Match': etag})
+    assert respuesta.status_code == 200
+    assert 'Después del respaldo' not in [c['nombre'] for c in respuesta.get_json()]
+
+def test_cursores_anteriores_piden_resincronizar(cliente, base_datos, respaldo):
+    cliente.put('/api/clientes/2', json={'nombre': 'Cambio sincronizado'})
+    cursor = cliente.get('/api/sync?since=0').get_json()['hasta']
+
+    restaurar_respaldo(respaldo, base_datos)
+
+    respuesta = cliente.get(f'/api/sync?since={cursor}')
+    assert respuesta.status_code == 410
+    assert respuesta.get_json()['reiniciar']
+    hasta = respuesta.get_json()['hasta']
+    # Las escrituras siguientes usan seqs que ningún cliente vio
+    cliente.put('/api/clientes/3', json={'nombre': 'Tras restaurar'})
+    cambios = cliente.get(f'/api/sync?since={hasta}').get_json()
+    assert cambios['hasta'] > cursor